@@ -0,0 +1,79 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+"""Benchmark for how long importing init (and thus all of the modules it
+imports) takes, which fails if it goes over a time budget, or if one of
+the heavy libraries that should only be imported when first used is
+imported. Run from the top level of the repo:
+  python -m benchmarks.import_time [--budget SECONDS]
+"""
+
+#constants
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULE_TO_IMPORT = 'init'
+IMPORT_TIME_BUDGET_S = 1.5 # maximum number of seconds importing init may take
+NUM_RUNS = 3 # number of times to time the import; the fastest is used
+#libraries that should not be imported (just) by importing init
+LAZY_MODULES = ['seaborn', 'matplotlib', 'colorcet', 'plotly', 'pyecharts',
+  'nltk', 'textblob', 'spacy', 'wordcloud', 'PIL', 'fuzzywuzzy']
+
+def get_import_times(module_name=MODULE_TO_IMPORT):
+  """Imports the given module in a new python process (so nothing is
+  already imported) with -X importtime, and returns a tuple of:
+    - the cumulative import time of the module, in seconds
+    - a dictionary of each (sub)module imported to its cumulative import
+    time, in seconds
+    - the list of the modules in LAZY_MODULES that were imported
+  """
+  assert isinstance(module_name, str)
+  check_lazy_str = f'import sys, json; print(json.dumps([m for m in {LAZY_MODULES!r} if m in sys.modules]))'
+  res = subprocess.run(
+    [sys.executable, '-X', 'importtime', '-c', f'import {module_name}; {check_lazy_str}'],
+    cwd=REPO_DIR, capture_output=True, text=True)
+  assert res.returncode == 0, res.stderr
+  #lines are of the form "import time: self [us] | cumulative | imported package"
+  dict_import_times = {}
+  for line in res.stderr.splitlines():
+    if not line.startswith('import time:') or 'cumulative' in line:
+      continue
+    _, cumulative_us, imported_module = line.split('|')
+    dict_import_times[imported_module.strip()] = int(cumulative_us) / 1e6
+  lazy_modules_imported = json.loads(res.stdout.strip().splitlines()[-1])
+  return dict_import_times[module_name], dict_import_times, lazy_modules_imported
+
+def test_import_time(budget_s=IMPORT_TIME_BUDGET_S, num_runs=NUM_RUNS, num_slowest=10):
+  """Tests that importing init takes at most budget_s seconds (the
+  fastest of num_runs imports), and that it doesn't import any of the
+  modules in LAZY_MODULES. Prints the import time and the num_slowest
+  slowest top-level imports.
+  Returns the (fastest) import time, in seconds.
+  """
+  assert isinstance(budget_s, (int, float))
+  assert isinstance(num_runs, int)
+  assert num_runs > 0
+  runs = [get_import_times() for _ in range(num_runs)]
+  import_time_s, dict_import_times, lazy_modules_imported = min(runs, key=lambda run: run[0])
+  #slowest top-level packages imported (ie not submodules)
+  top_level_times = [(name, t) for (name, t) in dict_import_times.items() if '.' not in name and name != MODULE_TO_IMPORT]
+  top_level_times = sorted(top_level_times, key=lambda x: x[1], reverse=True)[:num_slowest]
+  print(f'import {MODULE_TO_IMPORT}: {import_time_s:.3f}s (budget: {budget_s}s)')
+  print(' - slowest imports: ' + ', '.join([f'{name} ({t:.3f}s)' for (name, t) in top_level_times]))
+  assert len(lazy_modules_imported) == 0, f'modules that should be imported lazily were imported: {lazy_modules_imported}'
+  assert import_time_s <= budget_s, f'import {MODULE_TO_IMPORT} took {import_time_s:.3f}s, over the budget of {budget_s}s'
+  return import_time_s
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description=f'Benchmark of the time to import {MODULE_TO_IMPORT}.')
+  parser.add_argument('--budget', type=float, default=IMPORT_TIME_BUDGET_S,
+    help='maximum number of seconds the import may take')
+  parser.add_argument('--runs', type=int, default=NUM_RUNS,
+    help='number of times to time the import (the fastest is used)')
+  args = parser.parse_args()
+  try:
+    test_import_time(args.budget, args.runs)
+  except AssertionError as e:
+    print(f'FAILED: {e}')
+    sys.exit(1)
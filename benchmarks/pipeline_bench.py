@@ -0,0 +1,257 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+from datetime import datetime, timezone
+try:
+  import resource
+except ImportError: # not on windows
+  resource = None
+import numpy as np
+from benchmarks import synth_data
+
+"""Benchmark of each stage of the pipeline (ingest, null cleaning,
+indexing, frequency tables, top n tables, grouped statistics, text
+filtering, word vector building) on the synthetic wine data (see
+synth_data.py) at one or more scales. For each stage, it records its
+wall time, the peak memory traced by tracemalloc while it ran, and the
+peak RSS of the process after it. Each run is appended to a history
+file (with the git commit it ran on), and compared to the previous run
+at the same scale, so that changes can be checked for speedups (or
+slowdowns). Run from the top level of the repo:
+  python -m benchmarks.pipeline_bench [--scales 1 10 100] [--stages ...]
+Stages whose dependencies are not installed are recorded as skipped.
+"""
+
+#constants
+STAGES = ['ingest', 'null_cleaning', 'indexes', 'freq_tables', 'top_n',
+  'grouped_stats', 'text_filter', 'word_vectors']
+RESULTS_DIR = os.path.join('benchmarks', 'results')
+HISTORY_PATH = os.path.join(RESULTS_DIR, 'pipeline_history.jsonl')
+TOP_N_LIST = [5, 10, 20]
+TEXT_NUM_ROWS = 2000 #number of descriptions the text stages process
+WORD_VECTOR_DIM = 50
+#maximum RSS is in KiB on linux, and in bytes on macOS
+MAXRSS_UNIT_BYTES = 1 if platform.system() == 'Darwin' else 1024
+
+def get_maxrss_mb():
+  """Returns the peak RSS of this process so far, in MiB, or None if it
+  can't be measured (on windows)."""
+  if resource is None:
+    return None
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAXRSS_UNIT_BYTES / (1 << 20)
+
+def get_git_commit():
+  """Returns the (short) hash of the current git commit, or None."""
+  res = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True)
+  return res.stdout.strip() if res.returncode == 0 else None
+
+def measure_stage(stage_func, trace_memory=True):
+  """Runs the given stage (a function without arguments) and returns a
+  dictionary of its measurements: wall time ('seconds'), peak memory
+  traced by tracemalloc while it ran ('peak_traced_mb'; if
+  trace_memory), and peak RSS of the process after it ('maxrss_mb'; if
+  it can be measured).
+  If the stage can't be run as one of its dependencies is not installed,
+  then the dictionary is instead {'skipped': <reason>}."""
+  if trace_memory:
+    tracemalloc.start()
+  start_time = time.perf_counter()
+  try:
+    stage_func()
+  except ImportError as e:
+    return {'skipped': f'missing dependency: {e.name}'}
+  finally:
+    seconds = time.perf_counter() - start_time
+    if trace_memory:
+      _, peak_traced_bytes = tracemalloc.get_traced_memory()
+      tracemalloc.stop()
+  measurements = {'seconds': round(seconds, 4)}
+  maxrss_mb = get_maxrss_mb()
+  if maxrss_mb is not None:
+    measurements['maxrss_mb'] = round(maxrss_mb, 1)
+  if trace_memory:
+    measurements['peak_traced_mb'] = round(peak_traced_bytes / (1 << 20), 1)
+  return measurements
+
+def get_stage_funcs(cur, con, wine_data_path, text_num_rows=TEXT_NUM_ROWS):
+  """Returns a dictionary of each stage's name to the function (without
+  arguments) that runs it on the database vars, in order."""
+  #imported here, as benchmarks is run from the top level of the repo
+  from data_cleaning import data_cleaning
+  from database import db_constants, db_op, db_index
+  from wine_stat import null_info, freq
+  import init
+  wine_init_table_name = db_constants.WINE_INIT_TABLE_NAME
+  temp_table_name = data_cleaning.TEMP_WINE_DATA_TABLE
+
+  def ingest():
+    data_cleaning.load_wine_data_to_table(cur, con, temp_table_name, wine_data_path)
+
+  def null_cleaning():
+    #as in data_cleaning.init_wine_table_with_null_cleaning, without printing
+    null_info.get_null_profile(cur, con, temp_table_name)
+    data_cleaning.drop_null_entries_from_cols(cur, con, temp_table_name,
+      data_cleaning.COL_NAMES_TO_DROP_NULL_ENTRIES_FROM)
+    null_info.get_null_profile(cur, con, temp_table_name)
+    db_op.create_table_as(cur, con, wine_init_table_name,
+      f'SELECT * FROM {db_op.quote_identifier(temp_table_name)}')
+
+  def indexes():
+    db_index.create_indexes(cur, con, wine_init_table_name)
+
+  def freq_tables():
+    freq.set_db_freq_tables(cur, con, wine_init_table_name, freq.FREQ_TABLE_SPECS)
+
+  def top_n():
+    freq.get_top_ns_rows_of_each_freq_table(cur, con, TOP_N_LIST)
+
+  def grouped_stats():
+    stats_cube = init.get_stats_cube(cur, con)
+    for (measure, dims) in init.STATS_GROUPINGS:
+      stats_cube.write_slice(cur, con, measure, dims)
+
+  def get_text_df():
+    return db_op.read_table(cur, con, wine_init_table_name, ['description', 'country', 'variety'],
+      limit=text_num_rows, compact=True)
+
+  def text_filter():
+    from data_cleaning import text_filter as text_filter_module
+    text_filter_module.TextFilter(get_text_df())
+
+  def word_vectors():
+    from point_prediction import get_word_vector
+    #vocabulary of the synthetic descriptions' words (and one for unknown
+    #words, last), with random vectors
+    word_list = synth_data.DESCRIPTION_WORDS + ['<unknown>']
+    vocabulary_vectors = np.random.default_rng(synth_data.SEED).standard_normal((len(word_list), WORD_VECTOR_DIM))
+    sentences = [get_word_vector.clean_description(description) for description in get_text_df()['description']]
+    get_word_vector.get_sentence_vectors(sentences, vocabulary_vectors, word_list, 30, WORD_VECTOR_DIM)
+
+  return {
+    'ingest': ingest,
+    'null_cleaning': null_cleaning,
+    'indexes': indexes,
+    'freq_tables': freq_tables,
+    'top_n': top_n,
+    'grouped_stats': grouped_stats,
+    'text_filter': text_filter,
+    'word_vectors': word_vectors
+  }
+
+def run_pipeline_bench(scale=1, stages=STAGES, trace_memory=True, text_num_rows=TEXT_NUM_ROWS, db_path=None):
+  """Runs the given stages of the pipeline, in order, on the synthetic
+  wine data at the given scale (generated first if needed), in a new
+  database file, and returns the record of the run (see below).
+  Param:
+    @scale: the scale of the synthetic data (see synth_data.py)
+    @stages: list of the stages to run, from STAGES. Each stage needs
+    the tables of the stages before it, so leaving out one of the first
+    ones only makes sense with an existing database (see db_path).
+    @trace_memory: whether to trace memory allocations with tracemalloc
+    (which slows down the stages somewhat)
+    @text_num_rows: the number of descriptions the text stages process
+    @db_path: path of the database to run in; a new temporary one
+    (deleted afterwards) if None
+  Returns a dictionary with the time of the run, its git commit, the
+  scale and number of rows, and a dictionary of each stage run to its
+  measurements (see measure_stage).
+  """
+  assert isinstance(stages, list)
+  for stage in stages:
+    assert stage in STAGES
+  from database import db_conn
+  wine_data_path = synth_data.write_synth_data(scale)
+  temp_dir = None
+  if db_path is None:
+    temp_dir = tempfile.TemporaryDirectory()
+    db_path = os.path.join(temp_dir.name, 'bench.db')
+  manager = db_conn.get_manager(db_path)
+  con = manager.get_writer()
+  cur = con.cursor()
+  try:
+    stage_funcs = get_stage_funcs(cur, con, wine_data_path, text_num_rows)
+    dict_stage_measurements = {}
+    for stage in stages:
+      dict_stage_measurements[stage] = measure_stage(stage_funcs[stage], trace_memory)
+  finally:
+    manager.close()
+    if temp_dir is not None:
+      temp_dir.cleanup()
+  return {
+    'run_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+    'git_commit': get_git_commit(),
+    'python': platform.python_version(),
+    'scale': scale,
+    'num_rows': synth_data.WineDataGenerator(scale).num_rows,
+    'trace_memory': trace_memory,
+    'text_num_rows': text_num_rows,
+    'stages': dict_stage_measurements
+  }
+
+def load_history(history_path=HISTORY_PATH):
+  """Returns the list of the records of the runs in the history file."""
+  if not os.path.exists(history_path):
+    return []
+  with open(history_path) as f:
+    return [json.loads(line) for line in f if line.strip()]
+
+def append_to_history(run_record, history_path=HISTORY_PATH):
+  """Appends the record of a run to the history file."""
+  os.makedirs(os.path.dirname(history_path), exist_ok=True)
+  with open(history_path, 'a') as f:
+    f.write(json.dumps(run_record) + '\n')
+
+def get_previous_run(run_record, history):
+  """Returns the last run in the history with the same scale (and memory
+  tracing setting) as the given run, or None."""
+  for previous_run in reversed(history):
+    if previous_run['scale'] == run_record['scale'] and previous_run['trace_memory'] == run_record['trace_memory']:
+      return previous_run
+  return None
+
+def print_run(run_record, previous_run=None):
+  """Prints the measurements of each stage of a run, along with the
+  change in time from the previous run (if given)."""
+  print(f"scale {run_record['scale']} ({run_record['num_rows']} rows), commit {run_record['git_commit']}:")
+  for (stage, measurements) in run_record['stages'].items():
+    if 'skipped' in measurements:
+      print(f' - {stage}: skipped ({measurements["skipped"]})')
+      continue
+    line = f' - {stage}: {measurements["seconds"]:.3f}s'
+    if 'peak_traced_mb' in measurements:
+      line += f', peak traced {measurements["peak_traced_mb"]} MiB'
+    if 'maxrss_mb' in measurements:
+      line += f', max rss {measurements["maxrss_mb"]} MiB'
+    previous_measurements = previous_run['stages'].get(stage, {}) if previous_run is not None else {}
+    if previous_measurements.get('seconds'):
+      change = 100 * (measurements['seconds'] / previous_measurements['seconds'] - 1)
+      line += f' ({change:+.1f}% vs {previous_run["git_commit"]})'
+    print(line)
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Benchmark of each stage of the pipeline on synthetic data.')
+  parser.add_argument('--scales', type=float, nargs='+', default=[1],
+    help=f'scales of the synthetic data to run at (ex: {" ".join([str(scale) for scale in synth_data.SCALES])})')
+  parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES)
+  parser.add_argument('--text-rows', type=int, default=TEXT_NUM_ROWS,
+    help='number of descriptions the text stages process')
+  parser.add_argument('--no-trace-memory', action='store_true',
+    help="don't trace memory allocations (faster, but no peak traced memory)")
+  parser.add_argument('--no-history', action='store_true',
+    help="don't append the runs to the history file")
+  args = parser.parse_args()
+  history = load_history()
+  for scale in args.scales:
+    scale = int(scale) if scale == int(scale) else scale
+    run_record = run_pipeline_bench(scale, args.stages, not args.no_trace_memory, args.text_rows)
+    print_run(run_record, get_previous_run(run_record, history))
+    if not args.no_history:
+      append_to_history(run_record)
+    history.append(run_record)
+  sys.exit(0)
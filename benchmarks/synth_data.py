@@ -0,0 +1,224 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+"""Generator of synthetic wine reviews with the same schema as the
+wine data .csv file (winemag-data-130k-v2), with cardinalities, skew
+and null rates close to the real data's, at a multiple (scale) of its
+130k rows. Used to benchmark the pipeline on more (or less) data than
+we have. The same seed and scale always give the same data.
+Run from the top level of the repo:
+  python -m benchmarks.synth_data --scale 10 [--out PATH]
+"""
+
+#constants
+BASE_NUM_ROWS = 129971 #number of rows of the real wine data (scale 1)
+SCALES = [1, 10, 100] #scales benchmarked by default
+CHUNK_SIZE = 100000 #number of rows generated (and written) at a time
+SEED = 143
+DEFAULT_OUT_DIR = os.path.join('benchmarks', 'data')
+#columns of the .csv, in order (after its unnamed row number column)
+WINE_DATA_COLS = ['country', 'description', 'designation', 'points', 'price',
+  'province', 'region_1', 'region_2', 'taster_name', 'taster_twitter_handle',
+  'title', 'variety', 'winery']
+"""
+Number of distinct values of the categorical columns in the real data
+(at scale 1), and the exponent of the zipf-like skew of their value
+frequencies (the frequency of the k-th most common value is proportional
+to 1/k**skew). Columns whose number of distinct values keeps growing
+with more reviews (wineries, designations, ...) get sqrt(scale) times
+as many at scales larger than 1.
+"""
+CARDINALITIES = {
+  'country': (43, 1.6),
+  'province': (425, 1.1), #each in one country
+  'region_1': (1229, 1.1), #each in one province (skew unused: drawn within it)
+  'region_2': (17, 0.9),
+  'variety': (707, 1.3),
+  'winery': (16757, 0.7),
+  'designation': (37979, 0.8),
+  'taster_name': (19, 0.9) #each with one (or no) twitter handle
+}
+GROWING_COLS = ['region_1', 'winery', 'designation']
+#fraction of null entries of each column in the real data
+NULL_RATES = {
+  'country': 0.0005,
+  'designation': 0.2883,
+  'price': 0.0692,
+  'province': 0.0005,
+  'region_1': 0.1635,
+  'region_2': 0.6114,
+  'taster_name': 0.2019,
+  'variety': 0.00001
+}
+NUM_TASTERS_WITHOUT_TWITTER = 4 #the least common tasters have none
+#points are roughly normal between 80 and 100, and prices log-normal
+POINTS_MEAN, POINTS_STD = 88.45, 3.04
+PRICE_LOG_MEAN, PRICE_LOG_STD = 3.3, 0.62
+PRICE_POINTS_CORR = 0.45 #correlation of log price with points
+#descriptions are sentences of words drawn from DESCRIPTION_WORDS, with a
+#number of words roughly normal (as in the real descriptions)
+DESCRIPTION_NUM_WORDS_MEAN, DESCRIPTION_NUM_WORDS_STD = 40, 11
+DESCRIPTION_MIN_NUM_WORDS = 3
+DESCRIPTION_WORDS = '''a an and the of with this is it its in on to from for by as but
+that notes flavors aromas palate finish wine fruit acidity tannins nose drink
+black red cherry berry plum apple citrus lemon lime peach pear apricot pineapple
+currant raspberry strawberry blackberry cassis fig raisin vanilla oak spice pepper
+chocolate coffee tobacco leather earth mineral herb toast smoke honey butter cream
+rich ripe dry sweet crisp fresh bright juicy soft firm smooth round full light
+bold dense elegant balanced complex concentrated structured vibrant tart savory
+spicy fruity floral earthy oaky toasty silky velvety lush lean zesty tangy
+long short lingering clean hints touch shows offers opens delivers blend
+vineyard bottle years age cellar now through glass texture body style'''.split()
+DESCRIPTION_PUNCTUATION = [',', '.', ';']
+
+def get_num_distinct_values(col, scale):
+  """Returns the number of distinct values of the given categorical
+  column at the given scale."""
+  num_distinct, _ = CARDINALITIES[col]
+  return int(num_distinct * np.sqrt(scale)) if col in GROWING_COLS and scale > 1 else num_distinct
+
+def get_zipf_probs(num_values, skew):
+  """Returns the probabilities of each of num_values values, with
+  zipf-like skew (see CARDINALITIES)."""
+  probs = 1.0 / np.power(np.arange(1, num_values + 1), skew)
+  return probs / probs.sum()
+
+class WineDataGenerator:
+  """Generates the rows of the synthetic wine data in chunks. The
+  hierarchies of the real data are kept: each province is in one
+  country, each region_1 in one province, and each taster has one
+  (or no) twitter handle.
+  """
+  def __init__(self, scale=1, seed=SEED):
+    """Param:
+      @scale: the multiple of the real data's number of rows to generate
+      (can be a fraction, such as 0.1 for a small test dataset)
+      @seed: seed of the random generator
+    """
+    assert isinstance(scale, (int, float))
+    assert scale > 0
+    self.scale = scale
+    self.seed = seed
+    self.num_rows = int(round(BASE_NUM_ROWS * scale))
+    rng = np.random.default_rng(seed)
+    self.num_values = {col: get_num_distinct_values(col, scale) for col in CARDINALITIES}
+    self.probs = {col: get_zipf_probs(self.num_values[col], CARDINALITIES[col][1]) for col in CARDINALITIES}
+    #hierarchies: the country of each province, and the regions of each
+    #province (a range of region_1 codes), with every country having at
+    #least one province and every province at least one region
+    self.province_country = self.get_parents(rng, 'province', 'country')
+    region_1_province = self.get_parents(rng, 'region_1', 'province')
+    self.province_num_regions = np.bincount(region_1_province, minlength=self.num_values['province'])
+    self.province_first_region = np.cumsum(self.province_num_regions) - self.province_num_regions
+    self.region_1_order = np.argsort(region_1_province, kind='stable') #region codes by province
+
+  def get_parents(self, rng, col, parent_col):
+    """Returns the numpy array of the (code of the) parent of each value
+    of col, each of the values of parent_col being the parent of at least
+    one value of col (more common parents having more children)."""
+    num_values, num_parents = self.num_values[col], self.num_values[parent_col]
+    assert num_values >= num_parents
+    return np.concatenate([np.arange(num_parents),
+      rng.choice(num_parents, num_values - num_parents, p=self.probs[parent_col])])
+
+  def get_chunk(self, chunk_ind, chunk_size=CHUNK_SIZE):
+    """Returns the chunk_ind-th chunk of (up to chunk_size) rows, as a
+    dataframe with the WINE_DATA_COLS, indexed by row number."""
+    start = chunk_ind * chunk_size
+    num_rows = max(0, min(chunk_size, self.num_rows - start))
+    rng = np.random.default_rng([self.seed, chunk_ind])
+    #province is drawn first, then country follows from it, and region_1
+    #is drawn among the province's regions (skewed towards its first ones)
+    province_codes = rng.choice(self.num_values['province'], num_rows, p=self.probs['province'])
+    country_codes = self.province_country[province_codes]
+    region_ranks = np.floor(self.province_num_regions[province_codes] * rng.random(num_rows) ** 2).astype(np.int64)
+    region_1_codes = self.region_1_order[self.province_first_region[province_codes] + region_ranks]
+    taster_codes = rng.choice(self.num_values['taster_name'], num_rows, p=self.probs['taster_name'])
+    variety_codes = rng.choice(self.num_values['variety'], num_rows, p=self.probs['variety'])
+    winery_codes = rng.choice(self.num_values['winery'], num_rows, p=self.probs['winery'])
+    designation_codes = rng.choice(self.num_values['designation'], num_rows, p=self.probs['designation'])
+    region_2_codes = rng.choice(self.num_values['region_2'], num_rows, p=self.probs['region_2'])
+    #correlated points and (log) prices
+    z_points, z_noise = rng.standard_normal(num_rows), rng.standard_normal(num_rows)
+    points = np.clip(np.round(POINTS_MEAN + POINTS_STD * z_points), 80, 100).astype(np.int64)
+    z_price = PRICE_POINTS_CORR * z_points + np.sqrt(1 - PRICE_POINTS_CORR ** 2) * z_noise
+    price = np.clip(np.round(np.exp(PRICE_LOG_MEAN + PRICE_LOG_STD * z_price)), 4, 3300)
+    df = pd.DataFrame({
+      'country': pd.Series(country_codes).map(lambda code: f'Country {code}'),
+      'description': self.get_descriptions(rng, num_rows),
+      'designation': pd.Series(designation_codes).map(lambda code: f'Designation {code}'),
+      'points': points,
+      'price': price,
+      'province': pd.Series(province_codes).map(lambda code: f'Province {code}'),
+      'region_1': pd.Series(region_1_codes).map(lambda code: f'Region {code}'),
+      'region_2': pd.Series(region_2_codes).map(lambda code: f'Region2 {code}'),
+      'taster_name': pd.Series(taster_codes).map(lambda code: f'Taster {code}'),
+      'taster_twitter_handle': pd.Series(taster_codes).map(
+        lambda code: None if code >= self.num_values['taster_name'] - NUM_TASTERS_WITHOUT_TWITTER else f'@taster{code}'),
+      'variety': pd.Series(variety_codes).map(lambda code: f'Variety {code}'),
+      'winery': pd.Series(winery_codes).map(lambda code: f'Winery {code}')
+    })
+    for (col, null_rate) in NULL_RATES.items():
+      df.loc[rng.random(num_rows) < null_rate, col] = None
+    #tasters' twitter handles are null where they are
+    df.loc[df['taster_name'].isna(), 'taster_twitter_handle'] = None
+    vintages = rng.integers(1990, 2018, num_rows).astype(str)
+    df['title'] = df['winery'].fillna('') + ' ' + vintages + ' ' + df['designation'].fillna('') \
+      + ' ' + df['variety'].fillna('') + ' (' + df['province'].fillna('') + ')'
+    df.index = pd.RangeIndex(start, start + num_rows)
+    return df[WINE_DATA_COLS]
+
+  def get_descriptions(self, rng, num_rows):
+    """Returns a list of num_rows random descriptions."""
+    num_words = np.maximum(DESCRIPTION_MIN_NUM_WORDS, np.round(
+      rng.normal(DESCRIPTION_NUM_WORDS_MEAN, DESCRIPTION_NUM_WORDS_STD, num_rows)).astype(np.int64))
+    words = np.array(DESCRIPTION_WORDS, dtype=object)[rng.integers(0, len(DESCRIPTION_WORDS), num_words.sum())]
+    #end some words with punctuation, and each description with a period
+    punctuation = np.array(DESCRIPTION_PUNCTUATION + [''] * 12, dtype=object)[
+      rng.integers(0, len(DESCRIPTION_PUNCTUATION) + 12, len(words))]
+    words = words + punctuation
+    ends = np.cumsum(num_words)
+    return [' '.join(words[end - n:end]).capitalize().rstrip(',;.') + '.' for (n, end) in zip(num_words, ends)]
+
+  def get_num_chunks(self, chunk_size=CHUNK_SIZE):
+    """Returns the number of chunks of chunk_size rows of the data."""
+    return (self.num_rows + chunk_size - 1) // chunk_size
+
+def get_synth_data_path(scale, out_dir=DEFAULT_OUT_DIR, seed=SEED):
+  """Returns the path of the .csv file of synthetic data for the given
+  scale and seed."""
+  return os.path.join(out_dir, f'synth-wine-data-x{scale}-seed{seed}.csv')
+
+def write_synth_data(scale=1, path=None, seed=SEED, chunk_size=CHUNK_SIZE, overwrite=False):
+  """Writes the synthetic wine data at the given scale to a .csv file
+  with the same layout as the real one (its first column is the
+  unnamed row number), chunk by chunk (so in bounded memory).
+  Param:
+    @scale: the multiple of the real data's number of rows to generate
+    @path: the path of the .csv file; see get_synth_data_path if None
+    @seed: seed of the random generator
+    @chunk_size: number of rows generated (and written) at a time
+    @overwrite: whether to generate the file again if it already exists
+  Returns the path of the .csv file.
+  """
+  path = get_synth_data_path(scale, seed=seed) if path is None else path
+  if os.path.exists(path) and not overwrite:
+    return path
+  os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+  generator = WineDataGenerator(scale, seed)
+  for chunk_ind in range(generator.get_num_chunks(chunk_size)):
+    generator.get_chunk(chunk_ind, chunk_size).to_csv(path, mode='w' if chunk_ind == 0 else 'a',
+      header=(chunk_ind == 0))
+  return path
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Generates synthetic wine review data.')
+  parser.add_argument('--scale', type=float, default=1,
+    help=f'multiple of the real data\'s number of rows ({BASE_NUM_ROWS}) to generate')
+  parser.add_argument('--out', default=None, help='path of the .csv file to write')
+  parser.add_argument('--seed', type=int, default=SEED)
+  args = parser.parse_args()
+  scale = int(args.scale) if args.scale == int(args.scale) else args.scale
+  print(write_synth_data(scale, args.out, args.seed, overwrite=True))
@@ -1,11 +1,23 @@
+import os
+import json
+import argparse
 import pandas as pd
-import spacy
-from tqdm import tqdm
+try:
+  from data_cleaning import text_cache
+except ImportError:
+  #(run as a script from this directory)
+  import text_cache
 
 
-# To generate data/adjectives_nouns.csv. Takes 20-30 minutes to run
-# To thus generate data/adjectives_nouns.csv, uncomment the below,
-# and run this script file.
+# To generate data/adjectives_nouns.csv, run this script file
+# (importing it does not run the extraction, nor load spacy).
+# Each description is parsed once (with spacy's nlp.pipe, in batches, and
+# optionally in several processes), and the results are appended to the
+# csv a chunk of rows at a time, with a checkpoint after each chunk, so
+# that an interrupted run picks up where it left off when run again.
+# The adjectives and nouns of each description are also kept in the
+# processed text cache (see text_cache.py), so that only the descriptions
+# never extracted before are parsed.
 
 #stopwords = ['i', 'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves', 'you', 'your', 'yours', 'yourself',
 #  'yourselves', 'he', 'him', 'his', 'himself', 'she', 'her', 'hers', 'herself', 'it', 'its', 'itself',
@@ -36,19 +48,195 @@ from tqdm import tqdm
 #
 #  return sentence
 
-# Load English tokenizer, tagger, parser and NER
-nlp = spacy.load("en_core_web_sm")
-#spacy.prefer_gpu()
+#paths to the data read and written, relative to this directory
+WINE_DATA_PATH = '../data/winemag-data-130k-v2.csv'
+ADJ_NOUNS_DATA_PATH = '../data/adjectives_nouns.csv'
+TEXT_CACHE_DB_PATH = os.path.join('..', text_cache.TEXT_CACHE_DB_PATH)
+#the checkpoint of a run is kept next to the csv written, with this suffix
+CHECKPOINT_SUFFIX = '.checkpoint.json'
+#spacy model used to tag the descriptions, and its components that the
+#tags and lemmas don't need (so they are not run)
+SPACY_MODEL_NAME = "en_core_web_sm"
+SPACY_DISABLED_COMPONENTS = ['parser', 'ner']
+SPACY_BATCH_SIZE = 256 #number of descriptions spacy tags at a time
+EXTRACTION_CHUNK_SIZE = 5000 #number of rows written (and checkpointed) at a time
+#the processing configuration of the adjectives and nouns, as cached
+EXTRACTION_CONFIG = {'step': 'adjectives_nouns', 'model': SPACY_MODEL_NAME,
+  'disabled': SPACY_DISABLED_COMPONENTS, 'tags': ['JJ', 'NN'], 'lemmas': True}
+#the loaded spacy model; loaded on first use by get_nlp()
+glbl_nlp = None
 
-tqdm.pandas()
+def get_nlp():
+  """Returns the spacy model (English tokenizer, tagger and lemmatizer,
+  without the parser and NER, which aren't used), loading it the first
+  time this is called."""
+  global glbl_nlp
+  if glbl_nlp is None:
+    import spacy
+    glbl_nlp = spacy.load(SPACY_MODEL_NAME, disable=SPACY_DISABLED_COMPONENTS)
+    #spacy.prefer_gpu()
+  return glbl_nlp
 
-def get_adjectives(text, tag_ = 'JJ'):
-  blob = nlp(text)
-  return [ token.lemma_ for token in blob if token.tag_ == tag_]
+def get_adjectives_and_nouns(doc):
+  """Returns the lists of the lemmas of the adjectives (JJ) and of the
+  nouns (NN) of the given parsed (spacy) doc."""
+  adjectives, nouns = [], []
+  for token in doc:
+    if token.tag_ == 'JJ':
+      adjectives.append(token.lemma_)
+    elif token.tag_ == 'NN':
+      nouns.append(token.lemma_)
+  return adjectives, nouns
 
+def load_checkpoint(adj_nouns_data_path, wine_data_path):
+  """Returns the checkpoint of the run writing adj_nouns_data_path from
+  wine_data_path, as a dictionary with the number of rows written
+  ('num_rows') and the size of the csv then ('num_bytes'), or None if
+  there is none (for that input)."""
+  checkpoint_path = adj_nouns_data_path + CHECKPOINT_SUFFIX
+  if not os.path.exists(checkpoint_path) or not os.path.exists(adj_nouns_data_path):
+    return None
+  with open(checkpoint_path) as f:
+    checkpoint = json.load(f)
+  return checkpoint if checkpoint['wine_data_path'] == os.path.abspath(wine_data_path) else None
 
-df = pd.read_csv('../data/winemag-data-130k-v2.csv')
-#df['description_cleaned'] = df['description'].progress_apply(lambda x: pre_process(x))
-df['description_adj_cleaned'] = df['description'].progress_apply(get_adjectives)
-df['description_noun_cleaned'] = df['description'].progress_apply(lambda x: get_adjectives(x, tag_ = 'NN'))
-df.to_csv('../data/adjectives_nouns.csv')
+def save_checkpoint(adj_nouns_data_path, wine_data_path, num_rows, num_bytes):
+  """Records that the first num_rows rows (num_bytes bytes) of
+  adj_nouns_data_path have been written (see load_checkpoint)."""
+  checkpoint_path = adj_nouns_data_path + CHECKPOINT_SUFFIX
+  with open(checkpoint_path + '.tmp', 'w') as f:
+    json.dump({'wine_data_path': os.path.abspath(wine_data_path), 'num_rows': num_rows, 'num_bytes': num_bytes}, f)
+  #replaced at once, so an interruption never leaves a partial checkpoint
+  os.replace(checkpoint_path + '.tmp', checkpoint_path)
+
+def read_wine_data_chunks(wine_data_path, chunk_size, num_rows_to_skip=0):
+  """Yields the rows of the wine data after the first num_rows_to_skip,
+  as dataframes of up to chunk_size rows, indexed by their row number
+  in the whole file (as pd.read_csv would index them). The values are
+  read as the strings they are in the file (so that they are written
+  back the same whichever chunk they are in)."""
+  num_rows_read = num_rows_to_skip
+  for df_chunk in pd.read_csv(wine_data_path, chunksize=chunk_size, skiprows=range(1, num_rows_to_skip + 1),
+    dtype=str, keep_default_na=False):
+    df_chunk.index = pd.RangeIndex(num_rows_read, num_rows_read + len(df_chunk))
+    num_rows_read += len(df_chunk)
+    yield df_chunk
+
+def main(wine_data_path=WINE_DATA_PATH, adj_nouns_data_path=ADJ_NOUNS_DATA_PATH,
+  n_process=1, batch_size=SPACY_BATCH_SIZE, chunk_size=EXTRACTION_CHUNK_SIZE, resume=True,
+  text_cache_path=TEXT_CACHE_DB_PATH):
+  """Extracts the adjectives and nouns of each description of the
+  wine data, and writes them (with the wine data) to adj_nouns_data_path.
+  Param:
+    @wine_data_path, adj_nouns_data_path: the csv files read and written
+    @n_process: the number of processes spacy tags the descriptions in
+    @batch_size: the number of descriptions spacy tags at a time
+    @chunk_size: the number of rows written to the csv at a time; a run
+    is checkpointed after each chunk
+    @resume: whether to resume from the checkpoint of an interrupted
+    run (if there is one), rather than start over
+    @text_cache_path: the path of the cache of the processed texts (see
+    text_cache.py); None to parse all of the descriptions without it
+  """
+  from tqdm import tqdm
+  checkpoint = load_checkpoint(adj_nouns_data_path, wine_data_path) if resume else None
+  num_rows_done = checkpoint['num_rows'] if checkpoint is not None else 0
+  if checkpoint is not None:
+    #drop whatever was written after the checkpoint
+    with open(adj_nouns_data_path, 'r+b') as f:
+      f.truncate(checkpoint['num_bytes'])
+    print(f'Resuming after row {num_rows_done}')
+  elif os.path.exists(adj_nouns_data_path):
+    os.remove(adj_nouns_data_path)
+  cache = text_cache.get_text_cache(text_cache_path) if text_cache_path is not None else None
+  config_key = cache.register_config(EXTRACTION_CONFIG) if cache is not None else None
+
+  #the chunks read, by their number, until their rows are written, each as
+  #a dictionary of its dataframe ('df'), the hashes of its descriptions
+  #('hashes'), the [adjectives, nouns] of each of its rows so far
+  #('values'), and the number of its rows still being parsed ('num_missing')
+  dict_chunks = {}
+  #hash to [adjectives, nouns] of the descriptions parsed in this run, until
+  #the first chunk with them is written (and they are added to the cache)
+  dict_parsed_values = {}
+  dict_waiting_rows = {} #hash of each description being parsed to its rows, as (chunk number, position)
+  next_chunk_ind = 0
+  progress_bar = tqdm(initial=num_rows_done)
+
+  def write_completed_chunks():
+    """Writes the chunks whose rows all have their values, in order,
+    adding the values parsed for them to the cache. These values are then
+    dropped from dict_parsed_values, so that it only holds those of the
+    chunks not written yet (later rows with the same descriptions get them
+    from the cache, or are parsed again without it)."""
+    nonlocal next_chunk_ind, num_rows_done
+    while next_chunk_ind in dict_chunks and dict_chunks[next_chunk_ind]['num_missing'] == 0:
+      chunk = dict_chunks.pop(next_chunk_ind)
+      df_chunk = chunk['df']
+      df_chunk['description_adj_cleaned'] = [values[0] for values in chunk['values']]
+      df_chunk['description_noun_cleaned'] = [values[1] for values in chunk['values']]
+      if cache is not None:
+        cache.put_values(config_key, {text_hash: dict_parsed_values[text_hash]
+          for text_hash in chunk['hashes'] if text_hash in dict_parsed_values})
+      with open(adj_nouns_data_path, 'a', newline='') as f:
+        df_chunk.to_csv(f, header=(num_rows_done == 0))
+        f.flush()
+        os.fsync(f.fileno())
+        num_bytes = f.tell()
+      for text_hash in chunk['hashes']:
+        dict_parsed_values.pop(text_hash, None)
+      num_rows_done += len(df_chunk)
+      save_checkpoint(adj_nouns_data_path, wine_data_path, num_rows_done, num_bytes)
+      next_chunk_ind += 1
+
+  def get_descriptions():
+    """Yields each distinct description to parse (that isn't cached, nor
+    already parsed), with its hash, filling in the values of the others."""
+    for (chunk_ind, df_chunk) in enumerate(read_wine_data_chunks(wine_data_path, chunk_size, num_rows_done)):
+      text_hashes = [text_cache.get_text_hash(description) for description in df_chunk['description']]
+      dict_cached_values = cache.get_values(config_key, text_hashes) if cache is not None else {}
+      chunk = {'df': df_chunk, 'hashes': text_hashes, 'values': [None] * len(df_chunk), 'num_missing': 0}
+      dict_chunks[chunk_ind] = chunk
+      descriptions_to_parse = []
+      for (pos, (description, text_hash)) in enumerate(zip(df_chunk['description'], text_hashes)):
+        values = dict_cached_values.get(text_hash, dict_parsed_values.get(text_hash))
+        if values is not None:
+          chunk['values'][pos] = values
+          progress_bar.update(1)
+          continue
+        chunk['num_missing'] += 1
+        if text_hash not in dict_waiting_rows:
+          dict_waiting_rows[text_hash] = []
+          descriptions_to_parse.append((description, text_hash))
+        dict_waiting_rows[text_hash].append((chunk_ind, pos))
+      #(chunks with nothing to parse are complete as soon as they are read)
+      write_completed_chunks()
+      yield from descriptions_to_parse
+
+  #the docs come back in the order of the descriptions, so the chunks
+  #are completed one after the other
+  for (doc, text_hash) in get_nlp().pipe(get_descriptions(), as_tuples=True, batch_size=batch_size, n_process=n_process):
+    values = list(get_adjectives_and_nouns(doc))
+    dict_parsed_values[text_hash] = values
+    for (chunk_ind, pos) in dict_waiting_rows.pop(text_hash):
+      dict_chunks[chunk_ind]['values'][pos] = values
+      dict_chunks[chunk_ind]['num_missing'] -= 1
+      progress_bar.update(1)
+    write_completed_chunks()
+  write_completed_chunks()
+  progress_bar.close()
+  #the run is complete
+  if os.path.exists(adj_nouns_data_path + CHECKPOINT_SUFFIX):
+    os.remove(adj_nouns_data_path + CHECKPOINT_SUFFIX)
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Extracts the adjectives and nouns of the descriptions of the wine data.')
+  parser.add_argument('--n-process', type=int, default=1, help='number of processes to tag the descriptions in')
+  parser.add_argument('--batch-size', type=int, default=SPACY_BATCH_SIZE, help='number of descriptions tagged at a time')
+  parser.add_argument('--chunk-size', type=int, default=EXTRACTION_CHUNK_SIZE,
+    help='number of rows written (and checkpointed) at a time')
+  parser.add_argument('--restart', action='store_true', help="start over, rather than resume an interrupted run")
+  parser.add_argument('--no-cache', action='store_true', help="parse all of the descriptions, without the processed text cache")
+  args = parser.parse_args()
+  main(n_process=args.n_process, batch_size=args.batch_size, chunk_size=args.chunk_size, resume=not args.restart,
+    text_cache_path=None if args.no_cache else TEXT_CACHE_DB_PATH)
@@ -1,13 +1,17 @@
+import sys
 import pandas as pd
 import os # for path to data, see below in count_nulls where used
-from wine_stat import common_stat, null_info
-from database import db_constants
+from wine_stat import null_info
+from database import db_constants, db_op, db_catalog, instrument
 
 #constants
 WINE_DATA_PATH = f'../data/winemag-data-130k-v2_new.csv' # already had cleaning done on it #f'../data/{db_constants.WINE_DATA_FILE}' 
 TEMP_WINE_DATA_TABLE = 'temp_wine_data' #wine data before cleaning;
                                         #is deleted after cleaning
 WINE_INIT_TABLE_NAME = db_constants.WINE_INIT_TABLE_NAME
+STREAM_CHUNK_SIZE = 10000 #number of csv rows read (and inserted) per chunk when
+                          #streaming the wine data into the database
+COL_NAMES_TO_DROP_NULL_ENTRIES_FROM = ['country', 'price', 'province', 'variety']
 
 def drop_null_entries_from_cols(cur, con, table_name, col_names):
   """Drops all null entries from columns in col_names from the
@@ -26,20 +30,88 @@ def drop_null_entries_from_cols(cur, con, table_name, col_names):
   for col_name in col_names:
     assert isinstance(col_name, str)
   assert len(col_names) > 0
-  table_data = pd.read_sql(f'SELECT * FROM {table_name}', con)
-  table_data.set_index('index')
-  #query string to drop all nulls in only the specified columns
-  query_str = f'SELECT * FROM {table_name} WHERE {col_names[0]} IS NOT NULL'
-  for col_name in col_names[1:]:
-    query_str += f' AND {col_name} IS NOT NULL'
-  table_to_replace_with_data = pd.read_sql(query_str, con)
-  #replace table with new table
-  # I don't write the index here (index=False), as table reading from
-  # presumambly already has it
-  table_to_replace_with_data.to_sql(table_name, con, index=False, if_exists='replace')
+  #condition matching rows with a null in any of the specified columns
+  where_str = ' OR '.join([f'{db_op.quote_identifier(col_name)} IS NULL' for col_name in col_names])
+  #delete those rows in place in the table
+  db_op.delete_rows_where(cur, con, table_name, where_str)
 
 
-def init_wine_table_with_null_cleaning(cur, con, new_table_name=WINE_INIT_TABLE_NAME):
+def get_wine_data_path(wine_data_path=None):
+  """Returns the path to the wine data .csv file to initialize the database
+  with: wine_data_path if given, else the default one in the data directory."""
+  # os.path used here as I had trouble using ".." in relative path on Windows
+  return wine_data_path if wine_data_path else os.path.join(os.path.dirname(__file__), WINE_DATA_PATH)
+
+def stream_wine_table_with_null_cleaning(cur, con, new_table_name=WINE_INIT_TABLE_NAME,
+  wine_data_path=None, chunksize=STREAM_CHUNK_SIZE,
+  col_names=COL_NAMES_TO_DROP_NULL_ENTRIES_FROM):
+  """Streaming version of init_wine_table_with_null_cleaning: reads the
+  wine data .csv file in chunks of chunksize rows, drops the rows with
+  nulls in the columns of col_names from each chunk, and bulk-inserts the
+  remaining rows straight into the table new_table_name. No temporary
+  table is created and the whole dataset is never held in memory at once,
+  so peak memory only depends on chunksize (not on the size of the .csv).
+  All of the inserts are done in one transaction, so the table is either
+  fully written or (on an error) left as it was before.
+  Param:
+    @cur, con: database vars
+    @new_table_name: the name of the table to write the null-cleaned wine
+    data to. It is replaced if it already exists.
+    @wine_data_path: path to the .csv file to read (defaults to the
+    one in the data directory)
+    @chunksize: the number of .csv rows to read and insert at a time
+    @col_names: the columns to drop null entries from
+  Returns a tuple of the number of rows read from the .csv file and
+  the number of rows written to the table.
+  """
+  assert isinstance(new_table_name, str)
+  assert isinstance(chunksize, int)
+  assert chunksize > 0
+  assert isinstance(col_names, list)
+  for col_name in col_names:
+    assert isinstance(col_name, str)
+  # don't read the "Unnamed: 0" column, as the row number is kept in
+  # the index column instead (as for to_sql in the non-streaming version)
+  reader = pd.read_csv(get_wine_data_path(wine_data_path),
+    usecols=lambda col: col != 'Unnamed: 0', chunksize=chunksize)
+  num_rows_read, num_rows_written = 0, 0
+  insert_query_str = None
+  with db_op.transaction(cur, con): # one transaction (from the DROP TABLE on): commits at the end, rolls back on error
+    for chunk in reader:
+      num_rows_read += chunk.shape[0]
+      # keep row numbers of the original .csv as the index column
+      chunk = chunk.dropna(subset=col_names).reset_index()
+      if insert_query_str is None:
+        #create table from the schema of the first chunk (sqlite column
+        #types are only affinities, so later chunks still fit in it).
+        #Columns that are all null in the first chunk are read as floats by
+        #pandas, so give them a text column type instead.
+        all_null_cols = [col for col in chunk.columns if chunk[col].isna().all()]
+        schema_chunk = chunk.astype({col: object for col in all_null_cols})
+        cur.execute(f'DROP TABLE IF EXISTS {db_op.quote_identifier(new_table_name)}')
+        cur.execute(pd.io.sql.get_schema(schema_chunk, new_table_name, con=con))
+        cols_str = ', '.join([db_op.quote_identifier(col) for col in chunk.columns])
+        params_str = ', '.join(['?'] * chunk.shape[1])
+        insert_query_str = f'INSERT INTO {db_op.quote_identifier(new_table_name)} ({cols_str}) VALUES ({params_str})'
+      #convert nans to None so that they are written as NULL
+      chunk = chunk.astype(object).where(chunk.notna(), None)
+      cur.executemany(insert_query_str, chunk.itertuples(index=False, name=None))
+      num_rows_written += chunk.shape[0]
+  return num_rows_read, num_rows_written
+
+def load_wine_data_to_table(cur, con, table_name=TEMP_WINE_DATA_TABLE, wine_data_path=None):
+  """Reads the wine data .csv file (all at once) and writes it as is
+  (before any cleaning) to the given table, replacing it if it exists.
+  Returns the number of rows written."""
+  assert isinstance(table_name, str)
+  wine_data = pd.read_csv(get_wine_data_path(wine_data_path))
+  # drop the "Unamed: 0" second column, as pandas has index column instead
+  wine_data = wine_data.drop('Unnamed: 0', axis=1)
+  wine_data.to_sql(table_name, con, if_exists='replace')
+  return wine_data.shape[0]
+
+def init_wine_table_with_null_cleaning(cur, con, new_table_name=WINE_INIT_TABLE_NAME,
+  streaming=False, wine_data_path=None, chunksize=STREAM_CHUNK_SIZE):
   """Initializes and writes to the database the overall wine table with null
   values cleaned out. Note that NOT ALL NULL ENTRIES ARE REMOVED here: this is
   because some columns have lots of nulls (like >20%), and so those are 
@@ -48,17 +120,25 @@ def init_wine_table_with_null_cleaning(cur, con, new_table_name=WINE_INIT_TABLE_
     @cur, con: database vars
     @new_table_name: the name to write the initial, overall wine table name
     with all the data (except for cleaned out nulls) to the database with
+    @streaming: if True, then the .csv is streamed into the table in chunks
+    (see stream_wine_table_with_null_cleaning) instead of loading all of it
+    into memory and going through a temporary table. The (full-table) null
+    info summaries are not printed in this mode.
+    @wine_data_path: path to the .csv file to read (defaults to the
+    one in the data directory)
+    @chunksize: the number of .csv rows read at a time when streaming
   """
+  if streaming:
+    init_total_num_rows, res_total_num_rows = stream_wine_table_with_null_cleaning(
+      cur, con, new_table_name, wine_data_path, chunksize)
+    register_wine_table(cur, con, new_table_name, wine_data_path, res_total_num_rows)
+    print_null_cleaning_summary(init_total_num_rows, res_total_num_rows, new_table_name)
+    return
   #data
-  # os.path used here as I had trouble using ".." in relative path on Windows
-  wine_data = pd.read_csv(os.path.join(os.path.dirname(__file__), WINE_DATA_PATH))
-  # drop the "Unamed: 0" second column, as pandas has index column instead
-  wine_data = wine_data.drop('Unnamed: 0', axis=1)
-  wine_data.to_sql(TEMP_WINE_DATA_TABLE, con, if_exists='replace')
+  load_wine_data_to_table(cur, con, TEMP_WINE_DATA_TABLE, wine_data_path)
 
   # print summary info about nulls in initital overall wine table
-  init_total_num_rows = common_stat.get_num_rows_in_table(cur, con, TEMP_WINE_DATA_TABLE)
-  null_info.print_null_info_for_table(cur, con, TEMP_WINE_DATA_TABLE)
+  init_total_num_rows = null_info.print_null_info_for_table(cur, con, TEMP_WINE_DATA_TABLE).num_rows
   """As a result of the printed results above, print the following
   to inform the user about which null entries we decide to drop.
   (Currently only drop those that makeup less than 10% of our overall data).
@@ -82,29 +162,47 @@ include:
           - taster_name (20.19% null)
           - taster_twitter_handle (24.02% null)"""
   print(print_str_null_drop_info)
-  col_names_to_drop_null_entries_from = ['country', 'price', 'province', 'variety']
   drop_null_entries_from_cols(cur, con, 
-    TEMP_WINE_DATA_TABLE, col_names_to_drop_null_entries_from)
+    TEMP_WINE_DATA_TABLE, COL_NAMES_TO_DROP_NULL_ENTRIES_FROM)
   # now print summary again with new table with cleaned nulls
   new_print_str_null_drop_info = """As a result of having dropped the before \
 mentioned null entries in specific columns (country, price, province, and \
 variety), the number of rows and null info for our dataset is now as \
 follows: """
   print(new_print_str_null_drop_info)
-  null_info.print_null_info_for_table(cur, con, TEMP_WINE_DATA_TABLE)
+  res_total_num_rows = null_info.print_null_info_for_table(cur, con, TEMP_WINE_DATA_TABLE).num_rows
 
   #write table with cleaned nulls to database as our wine init overall table
   # (this is done below by copying it over from the temporary table
   # with these cleaned nulls)
-  new_wine_data = pd.read_sql(f'SELECT * FROM {TEMP_WINE_DATA_TABLE}', con)
-  #  Don't use (another) index here as presume it already exists as column in
-  #  the temporary table; ie index=False here.
-  new_wine_data.to_sql(new_table_name, con, index=False, if_exists='replace')
+  #  (the index column already exists in the temporary table, and so is
+  #  copied over with the other columns)
+  db_op.create_table_as(cur, con, new_table_name,
+    f'SELECT * FROM {db_op.quote_identifier(TEMP_WINE_DATA_TABLE)}')
 
   #print some info about the change in table size as a result
   #of having dropped (some) nulls
-  # number of rows after having dropped nulls in the above columns
-  res_total_num_rows = common_stat.get_num_rows_in_table(cur, con, TEMP_WINE_DATA_TABLE)
+  # (the number of rows after having dropped nulls in the above columns
+  # was counted with the null info above)
+  register_wine_table(cur, con, new_table_name, wine_data_path, res_total_num_rows)
+  print_null_cleaning_summary(init_total_num_rows, res_total_num_rows, new_table_name)
+
+def register_wine_table(cur, con, new_table_name, wine_data_path, num_rows):
+  """Records the null-cleaned wine table in the database's catalog."""
+  db_catalog.register_table(cur, con, new_table_name, db_catalog.KIND_WINE_INIT,
+    params={
+      'wine_data_path': get_wine_data_path(wine_data_path),
+      'col_names_to_drop_null_entries_from': COL_NAMES_TO_DROP_NULL_ENTRIES_FROM
+    }, row_count=num_rows)
+
+def print_null_cleaning_summary(init_total_num_rows, res_total_num_rows, new_table_name):
+  """Prints how many rows were dropped by null cleaning, and confirms
+  that the cleaned table has been written to the database.
+  Param:
+    @init_total_num_rows: the number of rows before null cleaning
+    @res_total_num_rows: the number of rows after null cleaning
+    @new_table_name: the name of the null-cleaned table
+  """
   # number of rows dropped as a result of having cleaned out (some) nulls
   num_rows_diff = init_total_num_rows - res_total_num_rows
   # percentage of rows retained (rounded to two decimal places)
@@ -118,4 +216,8 @@ follows: """
 
   #print confirmation that table is initialized with (some) cleaned/removed nulls
   print(f'-- Confirmation: newly-created table with name "{new_table_name}" now with cleaned nulls written to database with that name. --')
-  print("")
\ No newline at end of file
+  print("")
+
+#record the calls of the public functions of this module while the
+#instrumentation is enabled (see database/instrument.py)
+instrument.instrument_module(sys.modules[__name__])
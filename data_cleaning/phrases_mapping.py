@@ -1,10 +1,10 @@
 import re
 from collections import defaultdict
-from nltk.stem import PorterStemmer
-from fuzzywuzzy import fuzz
 import json
 import math
 import os
+import sys
+from database import instrument
 
 stopwords = ['i', 'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves', 'you', 'your', 'yours', 'yourself', 
     'yourselves', 'he', 'him', 'his', 'himself', 'she', 'her', 'hers', 'herself', 'it', 'its', 'itself', 
@@ -33,6 +33,11 @@ def find_similar_phrases(phrases, stopwords=stopwords, threshold = 80, generic =
         A dictionary similar_map that similar_map[phrase] = list of phrases to the key
     """
     
+    #imported here so that importing this module (such as for its
+    #stopwords) doesn't import nltk and fuzzywuzzy
+    from nltk.stem import PorterStemmer
+    from fuzzywuzzy import fuzz
+
     #remove punctuations
     pattern = re.compile(r'[^\w\s]')
     phrases_cleaned = [pattern.sub('',str(s).lower()) for s in phrases]
@@ -65,6 +70,7 @@ def mapping_dict (similar_map, generic = False, generic_thres=50):
     
     Generic_thres: Min of similarity within same group
     """
+    from fuzzywuzzy import fuzz
     groups = []
     for k, v in similar_map.items():
         # continue if k was already searched before
@@ -211,5 +217,7 @@ def mapping_column(col, threshold=85, generic=False, logging=True):
             one[v_] = k
             
     return col.apply(lambda x: one[x] if (check_not_nan(x) and x in one) else x)
-    
-    
\ No newline at end of file
+
+#record the calls of the public functions of this module while the
+#instrumentation is enabled (see database/instrument.py)
+instrument.instrument_module(sys.modules[__name__], exclude=['check_not_nan'])
@@ -0,0 +1,159 @@
+import os
+import json
+import hashlib
+import sqlite3 as sl
+import pandas as pd
+
+"""On-disk cache of processed texts (normalized descriptions, tagged
+words, extracted adjectives and nouns), so that the descriptions, which
+never change, are only processed once across runs. It is an sqlite
+database with one table, whose rows are keyed by:
+  - the key of the processing configuration (see get_config_key): a hash
+  of a dictionary describing the processing step and everything its
+  output depends on (ex: the stopwords, stemmer or tagger)
+  - a hash of the text processed (see get_text_hash)
+and hold the processed value as json. The configurations themselves are
+kept in a second table, for reference.
+
+Ex:
+  cache = text_cache.get_text_cache()
+  config = {'step': 'normalize', 'stemmer': 'porter', 'stopwords': stopwords}
+  #only the texts not in the cache yet are passed to normalize_texts
+  texts_normalized = cache.map_cached(normalize_texts, df['description'], config)
+
+This module only depends on sqlite3 and pandas, so that it can also be
+imported by the scripts run from the data_cleaning directory.
+"""
+
+#constants
+TEXT_CACHE_DB_NAME = 'text_cache.db'
+#path of the cache, relative to the top level of the repo
+TEXT_CACHE_DB_PATH = os.path.join('database', TEXT_CACHE_DB_NAME)
+TEXT_CACHE_TABLE_NAME = 'processed_texts'
+TEXT_CACHE_CONFIGS_TABLE_NAME = 'processed_text_configs'
+TEXT_HASH_SIZE = 16 #bytes of the blake2b hash of each text
+LOOKUP_BATCH_SIZE = 500 #number of text hashes looked up per query
+
+def get_text_hash(text):
+  """Returns the (blake2b) hash of the given text, as bytes."""
+  return hashlib.blake2b(text.encode('utf-8'), digest_size=TEXT_HASH_SIZE).digest()
+
+def get_config_key(config):
+  """Returns the key of the given processing configuration (a
+  json-serializable dictionary), as a hex string; the same for equal
+  dictionaries, whatever the order of their keys."""
+  assert isinstance(config, dict)
+  config_str = json.dumps(config, sort_keys=True)
+  return hashlib.blake2b(config_str.encode('utf-8'), digest_size=TEXT_HASH_SIZE).hexdigest()
+
+class TextCache:
+  """Cache of processed texts in an sqlite database file (see the module
+  docstring); the file and its tables are created when first used."""
+  def __init__(self, db_path=TEXT_CACHE_DB_PATH):
+    assert isinstance(db_path, str)
+    self.db_path = db_path
+    self.__con = None
+
+  def get_con(self):
+    """Returns the connection to the cache, opening it (and creating its
+    tables if needed) the first time."""
+    if self.__con is None:
+      db_dir = os.path.dirname(self.db_path)
+      if db_dir != '':
+        os.makedirs(db_dir, exist_ok=True)
+      con = sl.connect(self.db_path)
+      con.execute('PRAGMA journal_mode=WAL')
+      con.execute(f'''CREATE TABLE IF NOT EXISTS {TEXT_CACHE_TABLE_NAME} (
+        config_key TEXT NOT NULL,
+        text_hash BLOB NOT NULL,
+        value TEXT NOT NULL,
+        PRIMARY KEY (config_key, text_hash)) WITHOUT ROWID''')
+      con.execute(f'''CREATE TABLE IF NOT EXISTS {TEXT_CACHE_CONFIGS_TABLE_NAME} (
+        config_key TEXT PRIMARY KEY,
+        config TEXT NOT NULL)''')
+      con.commit()
+      self.__con = con
+    return self.__con
+
+  def close(self):
+    """Closes the connection to the cache (if open)."""
+    if self.__con is not None:
+      self.__con.close()
+      self.__con = None
+
+  def register_config(self, config):
+    """Records the given processing configuration, and returns its key
+    (see get_config_key)."""
+    config_key = get_config_key(config)
+    con = self.get_con()
+    con.execute(f'INSERT OR IGNORE INTO {TEXT_CACHE_CONFIGS_TABLE_NAME} (config_key, config) VALUES (?, ?)',
+      (config_key, json.dumps(config, sort_keys=True)))
+    con.commit()
+    return config_key
+
+  def get_values(self, config_key, text_hashes):
+    """Returns the dictionary of the given text hashes that are cached for
+    the configuration config_key to their (decoded) values."""
+    assert isinstance(config_key, str)
+    con = self.get_con()
+    dict_values = {}
+    for i in range(0, len(text_hashes), LOOKUP_BATCH_SIZE):
+      batch = list(text_hashes[i:(i+LOOKUP_BATCH_SIZE)])
+      rows = con.execute(f'''SELECT text_hash, value FROM {TEXT_CACHE_TABLE_NAME}
+        WHERE config_key = ? AND text_hash IN ({", ".join(["?"] * len(batch))})''', [config_key] + batch).fetchall()
+      for (text_hash, value) in rows:
+        dict_values[text_hash] = json.loads(value)
+    return dict_values
+
+  def put_values(self, config_key, dict_values):
+    """Adds the given dictionary of text hashes to their (json-serializable)
+    values to the cache, for the configuration config_key."""
+    assert isinstance(config_key, str)
+    assert isinstance(dict_values, dict)
+    con = self.get_con()
+    con.executemany(f'INSERT OR REPLACE INTO {TEXT_CACHE_TABLE_NAME} (config_key, text_hash, value) VALUES (?, ?, ?)',
+      [(config_key, text_hash, json.dumps(value)) for (text_hash, value) in dict_values.items()])
+    con.commit()
+
+  def map_cached(self, func, texts, config):
+    """Returns func applied to the given texts, as a series with the same
+    index, computing it only for the distinct texts that aren't cached for
+    the given configuration yet (and adding those to the cache). Missing
+    texts are left missing.
+    Param:
+      @func: function taking a series of texts and returning a series of
+      their (json-serializable) processed values, in the same order
+      @texts: series of the texts to process
+      @config: dictionary describing the processing done by func (see
+      get_config_key); values cached under another configuration are
+      never used
+    """
+    assert isinstance(texts, pd.Series)
+    config_key = self.register_config(config)
+    unique_texts = list(pd.unique(texts[texts.notna()]))
+    text_hashes = [get_text_hash(text) for text in unique_texts]
+    dict_values = self.get_values(config_key, text_hashes)
+    missing_inds = [ind for (ind, text_hash) in enumerate(text_hashes) if text_hash not in dict_values]
+    if len(missing_inds) > 0:
+      values = func(pd.Series([unique_texts[ind] for ind in missing_inds]))
+      dict_new_values = {text_hashes[ind]: value for (ind, value) in zip(missing_inds, values)}
+      self.put_values(config_key, dict_new_values)
+      dict_values.update(dict_new_values)
+    dict_text_values = {text: dict_values[text_hash] for (text, text_hash) in zip(unique_texts, text_hashes)}
+    return pd.Series([dict_text_values[text] if not pd.isna(text) else text for text in texts],
+      index=texts.index, name=texts.name)
+
+"""
+The shared caches, by the absolute path of their database file (see
+get_text_cache).
+"""
+glbl_text_caches = {}
+
+def get_text_cache(db_path=TEXT_CACHE_DB_PATH):
+  """Returns the shared cache for the given database file, creating it
+  if needed."""
+  assert isinstance(db_path, str)
+  key = os.path.abspath(db_path)
+  if key not in glbl_text_caches:
+    glbl_text_caches[key] = TextCache(db_path)
+  return glbl_text_caches[key]
@@ -1,15 +1,174 @@
+import os
+import sys
+import functools
 import pandas as pd
 import re
-import nltk
-nltk.download('punkt')
-from nltk.stem import PorterStemmer
-from data_cleaning import phrases_mapping
-from database import db_op
-from textblob import TextBlob
-from PIL import Image
+from data_cleaning import phrases_mapping, text_cache
+from database import db_op, instrument
 import numpy as np
-from wordcloud import WordCloud
-import matplotlib.pyplot as plt
+
+"""Text processing and word clouds. The nlp (nltk, textblob) and
+plotting (PIL, wordcloud, matplotlib) libraries are only imported
+when the functions that need them are first called, and the nltk
+corpora are only downloaded then (and only if they are missing)."""
+
+#nltk corpora needed by TextBlob's tagging, as their nltk.data paths
+#to their download names
+NLTK_CORPORA = {
+  'tokenizers/punkt': 'punkt',
+  'taggers/averaged_perceptron_tagger': 'averaged_perceptron_tagger'
+}
+#whether the nltk corpora have already been checked for / downloaded
+glbl_nltk_corpora_ready = False
+
+def ensure_nltk_corpora():
+  """Downloads the nltk corpora in NLTK_CORPORA that are missing; only
+  checks for them the first time it is called."""
+  global glbl_nltk_corpora_ready
+  if glbl_nltk_corpora_ready:
+    return
+  import nltk
+  for (corpus_path, corpus_name) in NLTK_CORPORA.items():
+    try:
+      nltk.data.find(corpus_path)
+    except LookupError:
+      nltk.download(corpus_name)
+  glbl_nltk_corpora_ready = True
+
+#characters stripped from the words of the texts (neither word characters
+#nor whitespace)
+PUNCTUATION_RE = re.compile(r'[^\w\s]')
+#cache of the (Porter) stem of each word stemmed so far, so that each
+#distinct word is only stemmed once
+glbl_stem_cache = {}
+
+def normalize_texts(texts, stopwords=phrases_mapping.stopwords):
+  """Returns the given texts normalized, as a series with the same index:
+  each whitespace-separated word lowercased, stripped of punctuation
+  (PUNCTUATION_RE), and stemmed, with the stopwords (and the words that
+  were only punctuation) left as empty words, joined by spaces.
+  The column is lowercased at once, and each distinct word is only
+  stripped, looked up in the (frozen) set of stopwords and stemmed once
+  (see glbl_stem_cache); each text is then just a join of the
+  normalized words looked up.
+  Param:
+    @texts: series of the texts to normalize
+    @stopwords: list of the (lowercase) words to leave out
+  """
+  assert isinstance(texts, pd.Series)
+  from nltk.stem import PorterStemmer
+  ps = PorterStemmer()
+  stopwords_set = frozenset(stopwords)
+  dict_normalized_words = {} #lowercased word to its normalized word
+  def get_normalized_word(word):
+    word_stripped = PUNCTUATION_RE.sub('', word)
+    if word_stripped == '' or word_stripped in stopwords_set:
+      normalized_word = ''
+    else:
+      if word_stripped not in glbl_stem_cache:
+        glbl_stem_cache[word_stripped] = ps.stem(word_stripped)
+      normalized_word = glbl_stem_cache[word_stripped]
+    dict_normalized_words[word] = normalized_word
+    return normalized_word
+  texts_normalized = []
+  for words in texts.str.lower().str.split():
+    if not isinstance(words, list):
+      #(missing text)
+      texts_normalized.append(words)
+      continue
+    texts_normalized.append(' '.join([dict_normalized_words[word] if word in dict_normalized_words
+      else get_normalized_word(word) for word in words]))
+  return pd.Series(texts_normalized, index=texts.index, name=texts.name)
+
+#number of texts each task of the process pool processes (see map_text_chunks)
+TEXT_CHUNK_SIZE = 2000
+#the processing configurations of the texts normalized and tagged here,
+#as cached (see text_cache.py); the stopwords are added to the first
+NORMALIZE_CONFIG = {'step': 'normalize', 'stemmer': 'nltk.PorterStemmer', 'punctuation': PUNCTUATION_RE.pattern}
+TAG_CONFIG = {'step': 'tag', 'tagger': 'textblob'}
+
+def get_tagged_words(texts):
+  """Returns the words of each of the given texts, as split by TextBlob's
+  part-of-speech tagging, as a series of lists with the same index."""
+  assert isinstance(texts, pd.Series)
+  from textblob import TextBlob
+  ensure_nltk_corpora()
+  #following line inpsired by:
+  # https://stackoverflow.com/questions/56980515/how-to-extract-all-adjectives-from-a-strings-of-text-in-a-pandas-dataframe
+  return texts.apply(lambda text: [word for (word, tag) in TextBlob(text).tags])
+
+def map_text_chunks(func, texts, n_workers=1, chunk_size=TEXT_CHUNK_SIZE):
+  """Applies func to the given texts in chunks of chunk_size texts, run
+  in a pool of n_workers processes, and returns the results concatenated
+  back in the order of the texts.
+  Param:
+    @func: function taking a series of texts and returning a series with
+    the same index; it is sent to the worker processes, so it must be a
+    module-level function (or a functools.partial of one)
+    @texts: series of the texts to process
+    @n_workers: the number of worker processes; with 1 (or if there is only
+    one chunk), func is just run on all of the texts in this process. None
+    for one per cpu.
+    @chunk_size: the number of texts sent to a worker at a time
+  """
+  assert isinstance(texts, pd.Series)
+  n_workers = os.cpu_count() if n_workers is None else n_workers
+  assert isinstance(n_workers, int) and n_workers > 0
+  assert isinstance(chunk_size, int) and chunk_size > 0
+  if n_workers == 1 or len(texts) <= chunk_size:
+    return func(texts)
+  from concurrent.futures import ProcessPoolExecutor
+  chunks = [texts.iloc[i:(i+chunk_size)] for i in range(0, len(texts), chunk_size)]
+  with ProcessPoolExecutor(max_workers=min(n_workers, len(chunks))) as executor:
+    #(map returns the results in the order of the chunks)
+    return pd.concat(list(executor.map(func, chunks)))
+
+#representations of the word counts of the texts of a TextFilter
+WORD_COUNTS_DICTS = 'dicts' #a T dictionary of word counts per row (see set_adjectives_counts)
+WORD_COUNTS_MATRIX = 'matrix' #a shared vocabulary and a sparse document-term matrix (see set_adjectives_matrix)
+GROUP_ROW_COL = 'group_row' #column of the row of each group in the matrix of its word counts
+
+def get_document_term_matrix(word_lists):
+  """Returns the vocabulary of the given lists of words (as a list, in
+  order of first appearance) and their document-term matrix: a scipy
+  CSR matrix with a row per list and a column per word of the
+  vocabulary, of the number of times the word is in the list.
+  The rows are built from the lengths of the lists directly (as the
+  indptr of the matrix), with the words factorized all at once.
+  """
+  import scipy.sparse
+  lengths = np.fromiter((len(words) for words in word_lists), dtype=np.int64, count=len(word_lists))
+  indptr = np.concatenate([[0], np.cumsum(lengths)])
+  word_codes, vocabulary = pd.factorize(pd.Series([word for words in word_lists for word in words], dtype=object))
+  matrix = scipy.sparse.csr_matrix((np.ones(len(word_codes), dtype=np.int32), word_codes, indptr),
+    shape=(len(lengths), len(vocabulary)))
+  #(merges the counts of the words repeated in a list)
+  matrix.sum_duplicates()
+  return list(vocabulary), matrix
+
+def get_group_totals(df, cols_to_group_by, matrix):
+  """Returns the groups of the rows of df by the columns cols_to_group_by
+  (sorted, and leaving out the rows with a null in them, as pandas'
+  groupby), as a dataframe of their keys with a row per group, along with
+  the sums of the rows of the matrix (aligned with the rows of df) in each
+  group, as a CSR matrix with a row per group. The sums are the product
+  of a sparse indicator matrix of the rows of each group with the matrix.
+  """
+  import scipy.sparse
+  grouped = df.groupby(cols_to_group_by, sort=True, observed=True)
+  df_groups = grouped.size().index.to_frame(index=False)
+  group_ids = grouped.ngroup()
+  is_in_group = group_ids.notna().to_numpy()
+  indicator = scipy.sparse.csr_matrix(
+    (np.ones(is_in_group.sum(), dtype=matrix.dtype), (group_ids[is_in_group].to_numpy(dtype=np.int64), np.flatnonzero(is_in_group))),
+    shape=(len(df_groups), len(df)))
+  return df_groups, (indicator @ matrix).tocsr()
+
+def get_row_frequencies(matrix, row, vocabulary):
+  """Returns the dictionary of the words of the given row of the matrix
+  (see get_document_term_matrix) to their counts."""
+  start, end = matrix.indptr[row], matrix.indptr[row + 1]
+  return {vocabulary[ind]: int(count) for (ind, count) in zip(matrix.indices[start:end], matrix.data[start:end])}
 
 class T(dict):
   """A class that behaves as a dictionary, 
@@ -53,13 +212,9 @@ class T(dict):
       to_ret[circle_center] = r_to_use
     elif isinstance(t_T, T) or isinstance(t_T, dict):
       to_ret = T(self)
-      # should only have one key-value pair
-      if len(t_T) > 0:
-        k, v = list(t_T.items())[0]
-        circle_center, rmin = k, v
-        curr_dist_stored = self.get(circle_center, 0)
-        r_to_use = rmin + curr_dist_stored #max(rmin, curr_dist_stored)
-        to_ret[circle_center] = r_to_use
+      # add the value of every key (such as the frequency of every word)
+      for (k, v) in t_T.items():
+        to_ret[k] = to_ret.get(k, 0) + v
     return to_ret
   
   """Comparison functions for whether an object
@@ -112,52 +267,66 @@ class TextFilter:
       "top n" means per another dataframe passed in
       (such as top 10 by mean, top 10 by count, etc.),
       having word clouds produced for them.
+    The text normalization and tagging can be run in parallel,
+    in chunks, in a pool of processes (see n_workers), and their
+    results are cached on disk (see text_cache.py), so that each
+    description is only processed once across runs.
     """ 
-    def __init__(self, df, coltext='description', stopwords=phrases_mapping.stopwords, suffix="processed"):
+    def __init__(self, df, coltext='description', stopwords=phrases_mapping.stopwords, suffix="processed",
+        n_workers=1, chunk_size=TEXT_CHUNK_SIZE, text_cache_path=text_cache.TEXT_CACHE_DB_PATH,
+        word_counts=WORD_COUNTS_DICTS):
         """Initialize class with dataframe and column of text,
         and use stopwords to clean out entries. By default
         do this on the description column.
+        Param:
+          @n_workers: the number of processes to normalize and tag
+          the texts in (see map_text_chunks); 1 to run in this process,
+          None for one per cpu
+          @chunk_size: the number of texts each process handles at a time
+          @text_cache_path: the path of the cache of the processed texts
+          (see text_cache.py); None to process all of them without it
+          @word_counts: how the word counts of each row are kept: as a
+          column of T dictionaries (WORD_COUNTS_DICTS), or as a
+          vocabulary and sparse document-term matrix (WORD_COUNTS_MATRIX,
+          which needs scipy, and is much smaller and faster to group);
+          both give the same word counts
         """ 
         assert isinstance(coltext, str)
         assert isinstance(stopwords, list)
         for word in stopwords:
             assert isinstance(word, str)
         assert isinstance(df, pd.DataFrame)
+        assert word_counts in [WORD_COUNTS_DICTS, WORD_COUNTS_MATRIX]
         #logic drawn from phrases_mapping.py beginning of
         #find_similar_phrases
         self.d = df.copy()
         self.__coltext = coltext
         self.__coltext_cleaned = f'{coltext}_{suffix}'
+        self.n_workers = n_workers
+        self.chunk_size = chunk_size
+        self.word_counts = word_counts
+        self.vocabulary = None
+        self.doc_term_matrix = None
+        self.text_cache = text_cache.get_text_cache(text_cache_path) if text_cache_path is not None else None
 
-        #initialize description_processed column
-        for (rowind, description) in self.d[coltext].items():
-            #convert description to list of strings, separated on whitespace
-            phrases = description.split()
-
-            #remove 
-            pattern = re.compile(r'[^\w\s]')
-            phrases_cleaned = [pattern.sub('',str(s).lower()) for s in phrases]
-            
-            #remove stopping words, such as of, is, and, I, am, ...
-            phrases_cleaned = [ ' '.join([i for i in s.split() if i not in stopwords]) for s in phrases_cleaned]
-
-            #stemming (no need lemmentization)
-            ps = PorterStemmer()
-            phrases_cleaned = [' '.join([ps.stem(i) for i in s.split()]) for s in phrases_cleaned]
-
-            #add column that is coltext_cleaned, as given above, that is space 
-            #delimited string of these phrases
-            self.d.loc[df.index[rowind], self.__coltext_cleaned] = ' '.join(phrases_cleaned)
+        #initialize description_processed column: words lowercased, stripped
+        #of punctuation and stemmed, without stopwords (see normalize_texts)
+        self.d[self.__coltext_cleaned] = self.map_cached(functools.partial(normalize_texts, stopwords=stopwords),
+            self.d[coltext], {**NORMALIZE_CONFIG, 'stopwords': sorted(set(stopwords))})
 
         #initialize with adjectives list
         self.set_adjectives()
-        self.set_adjectives_counts()
+        if word_counts == WORD_COUNTS_MATRIX:
+            self.set_adjectives_matrix()
+        else:
+            self.set_adjectives_counts()
   
     def set_adjectives(self, colname=None, suffix="adjectives"):
         """Uses TextBlob to filter; by default, assumes
         filtering for adjectives.It writes the resulting list
         of words into a new column in the dataframe that
-        this class wraps.
+        this class wraps. The texts are tagged in the
+        class's pool of processes (see __init__).
         Param:
           @colname: the column with the text to get.
           @suffix: the suffix to added to a new column name for the
@@ -167,15 +336,22 @@ class TextFilter:
         assert isinstance(suffix, str)
         colname = self.__coltext_cleaned if colname is None else colname
         # print("set_adjectives colname: ", colname)
-        def get_words(text):
-            """Text to get the words of."""
-            word_blob = TextBlob(text)
-            #following line inpsired by:
-            # https://stackoverflow.com/questions/56980515/how-to-extract-all-adjectives-from-a-strings-of-text-in-a-pandas-dataframe
-            return [word for (word, tag) in word_blob.tags]
+        #(downloaded here first, so that the workers only find them)
+        ensure_nltk_corpora()
         #assumes colname text is comma-delimited, so split and process
         new_adj_col_name = f'{colname}_{suffix}'
-        self.d[new_adj_col_name] = self.d[colname].apply(get_words)
+        self.d[new_adj_col_name] = self.map_cached(get_tagged_words, self.d[colname], TAG_CONFIG)
+
+    def map_cached(self, func, texts, config):
+        """Returns func applied to the texts in the class's pool of
+        processes (see map_text_chunks), only for the texts that
+        aren't in its cache for the given processing configuration
+        (see text_cache.TextCache.map_cached), if it has one."""
+        def map_chunks(texts_to_process):
+            return map_text_chunks(func, texts_to_process, self.n_workers, self.chunk_size)
+        if self.text_cache is None:
+            return map_chunks(texts)
+        return self.text_cache.map_cached(map_chunks, texts, config)
   
     def set_adjectives_counts(self, colname=None, suffix="dict_counts"):
         """Adds a new column that is a dictionary with the counts of each
@@ -193,6 +369,30 @@ class TextFilter:
             return T(dict_words_seen)
         self.d[new_word_count_col_name] = self.d[colname].apply(create_word_count_dict)
 
+    def set_adjectives_matrix(self, colname=None):
+        """Sets the shared vocabulary (self.vocabulary) and the sparse
+        document-term matrix (self.doc_term_matrix) of the lists of
+        words in the given column (by default, the adjectives; see
+        get_document_term_matrix), in place of the column of T
+        dictionaries of set_adjectives_counts. Row i of the matrix has
+        the word counts of the i-th row of the dataframe this class wraps."""
+        assert colname is None or isinstance(colname, str)
+        colname = f'{self.__coltext_cleaned}_adjectives' if colname is None else colname
+        self.vocabulary, self.doc_term_matrix = get_document_term_matrix(self.d[colname])
+
+    def group_by_matrix(self, cols_to_group_by):
+        """Returns the groups of the dataframe this class wraps by the
+        given columns, as a dataframe of their keys with the row of each
+        group (GROUP_ROW_COL) in the matrix of their summed word counts,
+        which is returned along with it (see get_group_totals)."""
+        assert isinstance(cols_to_group_by, list)
+        for col in cols_to_group_by:
+            assert isinstance(col, str)
+        assert self.doc_term_matrix is not None, 'the document-term matrix must be set first (see set_adjectives_matrix)'
+        df_groups, group_totals = get_group_totals(self.d, cols_to_group_by, self.doc_term_matrix)
+        df_groups[GROUP_ROW_COL] = np.arange(len(df_groups))
+        return df_groups, group_totals
+
     def group_by(self, d, cols_to_group_by, col_to_sum='description_processed_adjectives_dict_counts'):
       """Returns new dataframe with columns
       of columns to group by, along with "summed"
@@ -204,7 +404,7 @@ class TextFilter:
       for col in cols_to_group_by:
           assert isinstance(col, str)
       df_to_ret = d.copy()
-      df_to_ret = df_to_ret.groupby(by=cols_to_group_by, group_keys=False)[col_to_sum].sum().reset_index()
+      df_to_ret = df_to_ret.groupby(by=cols_to_group_by, group_keys=False, observed=True)[col_to_sum].sum().reset_index()
       #expand dataframe from dictionaries of words/keys to counts/values
       df_to_ret[col_to_sum + '_words'] = df_to_ret[col_to_sum].apply(lambda x: list(x.keys()))
       df_to_ret[col_to_sum + '_counts'] = df_to_ret[col_to_sum].apply(lambda x: list(x.values()))
@@ -229,7 +429,7 @@ class TextFilter:
         assert isinstance(col, str)
       new_d = d.copy()
       new_d[col_to_sum] = new_d[col_to_sum].astype(str)
-      new_d = new_d.groupby(by=cols_to_group_by + [col_to_sum], group_keys=False)[cols_to_group_by + [col_to_sum]].apply(lambda x: x).drop_duplicates()
+      new_d = new_d.groupby(by=cols_to_group_by + [col_to_sum], group_keys=False, observed=True)[cols_to_group_by + [col_to_sum]].apply(lambda x: x).drop_duplicates()
       return new_d
     def produce_wine_word_clouds(
       self, 
@@ -262,7 +462,9 @@ class TextFilter:
         or tablename with the column col_to_measure_by can be passed
         @ascending: whether topn gets the "top" or "bottom" n groups,
         as measured by the corresponding entry in col_to_measure_by
-        @col_to_sum: the name for the column of summed frequencies.
+        @col_to_sum: the name for the column of summed frequencies
+        (not used with WORD_COUNTS_MATRIX, whose frequencies are taken
+        from the rows of the matrix of the groups' word counts).
         @img_file_path: a path to the image to use for the word clouds
         @colormapname: the name for the color map to be used for the
         word clouds
@@ -273,8 +475,15 @@ class TextFilter:
         assert isinstance(col, str)
       assert isinstance(topn, int)
       assert topn > 0
-      df_to_plot = self.group_by(self.d, cols_to_group_by, col_to_sum)
-      df_to_plot = self.group_by_dict(df_to_plot, cols_to_group_by, col_to_sum)
+      from PIL import Image
+      from wordcloud import WordCloud
+      import matplotlib.pyplot as plt
+      if self.word_counts == WORD_COUNTS_MATRIX:
+        #one row per group, with the row of its word counts in group_totals
+        df_to_plot, group_totals = self.group_by_matrix(cols_to_group_by)
+      else:
+        df_to_plot = self.group_by(self.d, cols_to_group_by, col_to_sum)
+        df_to_plot = self.group_by_dict(df_to_plot, cols_to_group_by, col_to_sum)
       #keep only the topn by some given measurement
       df_to_plot = db_op.filter_top_n(cur, con, 
         cols_to_group_by, 
@@ -289,8 +498,16 @@ class TextFilter:
       for (k, row) in df_to_plot.iterrows():
         print("key for row: ", k)
         print("row: ", row)
+        if self.word_counts == WORD_COUNTS_MATRIX:
+          frequencies = get_row_frequencies(group_totals, int(row[GROUP_ROW_COL]), self.vocabulary)
+        else:
+          frequencies = eval(row[col_to_sum])
         wordcloud = WordCloud(mask=mask, width = 800, height = 800, colormap=plt.get_cmap(colormapname),
-                    background_color ='white').generate_from_frequencies(eval(row[col_to_sum]), **kwargs)
+                    background_color ='white').generate_from_frequencies(frequencies, **kwargs)
         plt.imshow(wordcloud)
         plt.axis("off")
-        plt.show()
\ No newline at end of file
+        plt.show()
+
+#record the calls of the public functions of this module while the
+#instrumentation is enabled (see database/instrument.py)
+instrument.instrument_module(sys.modules[__name__], exclude=['T'])
@@ -0,0 +1,209 @@
+import json
+from datetime import datetime, timezone
+from database import db_columnar, db_op
+
+"""Catalog of the derived tables in the database (frequency tables, top n
+tables, tables of statistics, ...), stored as a table in the database
+itself. For each derived table, it records its name, kind, schema (list
+of column names), the table it was derived from, the parameters it was
+built with, its number of rows, and when (and how long) it was built.
+Since it is stored in the database, any process can find the derived
+tables of an existing database without rebuilding them.
+The catalog also stores sketches (summaries, see wine_stat/sketches.py)
+of the columns of tables, such as their distinct count sketches, so
+that they can be reused or merged with those of new rows later.
+A db_columnar.ColumnarStore keeps its own catalog (of its tables), that
+register_table, unregister_table and get_catalog_entries (and the
+functions built on it) use when passed the store as con."""
+
+#constants
+CATALOG_TABLE_NAME = 'derived_table_catalog'
+SKETCH_TABLE_NAME = 'column_sketch_catalog' #sketches of the columns of tables
+# kinds of derived tables
+KIND_FREQ = 'freq'
+KIND_TOP_N = 'top_n'
+KIND_BASIC_STATS = 'basic_stats'
+KIND_GROUPED_LIMIT = 'grouped_limit'
+KIND_STR_CONCAT = 'str_concat'
+KIND_WINE_INIT = 'wine_init'
+# kinds of column sketches
+SKETCH_KIND_HLL = 'hll' #HyperLogLog distinct count sketch
+
+def catalog_table_exists(cur, con):
+  """Returns whether the catalog table exists in the database."""
+  res = con.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name=?",
+    (CATALOG_TABLE_NAME,)).fetchone()
+  return res[0] > 0
+
+def ensure_catalog_table(cur, con):
+  """Creates the catalog table if it doesn't exist yet."""
+  con.execute(f'''CREATE TABLE IF NOT EXISTS {CATALOG_TABLE_NAME} (
+    table_name TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    schema TEXT NOT NULL,
+    source_table TEXT,
+    params TEXT,
+    row_count INTEGER,
+    built_at TEXT,
+    build_seconds REAL
+  )''')
+
+def register_table(cur, con, table_name, kind, source_table=None, params=None,
+  schema=None, row_count=None, build_seconds=None, commit=True):
+  """Records (or updates) the given derived table in the catalog.
+  Param:
+    @cur, con: database vars
+    @table_name: the name of the derived table
+    @kind: the kind of derived table (one of the KIND_* constants above)
+    @source_table: the name of the table it was derived from
+    @params: dictionary of the parameters it was built with (must be
+    json-serializable)
+    @schema: list of its column names; read from the table if None
+    @row_count: its number of rows; counted from the table if None
+    @build_seconds: how many seconds it took to build, if known
+    @commit: whether to commit after recording it. Pass False when
+    registering tables inside of a larger transaction.
+  """
+  assert isinstance(table_name, str)
+  assert isinstance(kind, str)
+  assert source_table is None or isinstance(source_table, str)
+  assert params is None or isinstance(params, dict)
+  assert schema is None or isinstance(schema, list)
+  assert row_count is None or isinstance(row_count, int)
+  assert isinstance(commit, bool)
+  if db_columnar.is_columnar_store(con):
+    con.register_table(table_name, kind, source_table, params, schema, row_count, build_seconds)
+    return
+  schema = db_op.get_table_col_names(cur, con, table_name) if schema is None else schema
+  if row_count is None:
+    row_count = con.execute(f'SELECT COUNT(*) FROM {db_op.quote_identifier(table_name)}').fetchone()[0]
+  ensure_catalog_table(cur, con)
+  #update the entry in place if the table is already in the catalog (unlike
+  #INSERT OR REPLACE, which would give it a new rowid, and so move it to the
+  #end of the order of get_catalog_entries)
+  con.execute(f'''INSERT INTO {CATALOG_TABLE_NAME} VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(table_name) DO UPDATE SET kind = excluded.kind, schema = excluded.schema,
+    source_table = excluded.source_table, params = excluded.params, row_count = excluded.row_count,
+    built_at = excluded.built_at, build_seconds = excluded.build_seconds''', (
+    table_name,
+    kind,
+    json.dumps(schema),
+    source_table,
+    json.dumps(params if params is not None else {}),
+    row_count,
+    datetime.now(timezone.utc).isoformat(timespec='seconds'),
+    build_seconds
+  ))
+  if commit:
+    con.commit()
+
+def unregister_table(cur, con, table_name, commit=True):
+  """Removes the given table from the catalog (if it is in it)."""
+  assert isinstance(table_name, str)
+  if db_columnar.is_columnar_store(con):
+    con.unregister_table(table_name)
+  elif catalog_table_exists(cur, con):
+    con.execute(f'DELETE FROM {CATALOG_TABLE_NAME} WHERE table_name = ?', (table_name,))
+    if commit:
+      con.commit()
+
+def get_catalog_entries(cur, con, kind=None):
+  """Returns the list of the catalog's entries (all of them, or only
+  those of the given kind) for tables that still exist in the database,
+  in the order they were first registered. Each entry is a dictionary
+  with the catalog's columns as keys (with schema and params decoded).
+  Returns an empty list if the database has no catalog (yet)."""
+  assert kind is None or isinstance(kind, str)
+  if db_columnar.is_columnar_store(con):
+    return con.get_catalog_entries(kind)
+  if not catalog_table_exists(cur, con):
+    return []
+  query_str = f'''SELECT c.* FROM {CATALOG_TABLE_NAME} AS c
+    JOIN sqlite_master AS m ON m.type = 'table' AND m.name = c.table_name'''
+  params = ()
+  if kind is not None:
+    query_str += ' WHERE c.kind = ?'
+    params = (kind,)
+  query_str += ' ORDER BY c.rowid'
+  res = con.execute(query_str, params)
+  col_names = [col_desc[0] for col_desc in res.description]
+  entries = []
+  for row in res.fetchall():
+    entry = dict(zip(col_names, row))
+    entry['schema'] = json.loads(entry['schema'])
+    entry['params'] = json.loads(entry['params']) if entry['params'] else {}
+    entries.append(entry)
+  return entries
+
+def get_catalog_entry(cur, con, table_name):
+  """Returns the catalog's entry for the given table (see
+  get_catalog_entries), or None if it isn't in the catalog."""
+  assert isinstance(table_name, str)
+  for entry in get_catalog_entries(cur, con):
+    if entry['table_name'] == table_name:
+      return entry
+  return None
+
+def get_freq_schemas(cur, con):
+  """Returns a dictionary of the frequency tables in the database to
+  their schemas (list of column names), in the same form as
+  freq.glbl_dict_freq_schemas."""
+  return {entry['table_name']: entry['schema'] for entry in get_catalog_entries(cur, con, KIND_FREQ)}
+
+def get_top_n_freq_schemas(cur, con):
+  """Returns a dictionary of n's to dictionaries of the top n frequency
+  tables in the database for that n to their schemas, in the same form as
+  freq.glbl_top_n_freq_schemas."""
+  dict_top_n_freq_schemas = {}
+  for entry in get_catalog_entries(cur, con, KIND_TOP_N):
+    n = entry['params']['n']
+    dict_top_n_freq_schemas[n] = dict_top_n_freq_schemas.get(n, {})
+    dict_top_n_freq_schemas[n][entry['table_name']] = entry['schema']
+  return dict_top_n_freq_schemas
+
+def ensure_sketch_table(cur, con):
+  """Creates the table of column sketches if it doesn't exist yet."""
+  con.execute(f'''CREATE TABLE IF NOT EXISTS {SKETCH_TABLE_NAME} (
+    table_name TEXT NOT NULL,
+    col_name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    params TEXT,
+    sketch BLOB NOT NULL,
+    built_at TEXT,
+    PRIMARY KEY (table_name, col_name, kind)
+  )''')
+
+def store_sketches(cur, con, table_name, kind, dict_sketch_bytes, params=None, commit=True):
+  """Stores (or replaces) the given sketches of the columns of a table.
+  Param:
+    @cur, con: database vars
+    @table_name: the name of the table the sketches are of
+    @kind: the kind of sketch (ex: 'hll')
+    @dict_sketch_bytes: dictionary of column names to their sketch (as bytes)
+    @params: dictionary of the parameters the sketches were built with
+    (must be json-serializable), such as their precision
+    @commit: whether to commit after storing them
+  """
+  assert isinstance(table_name, str)
+  assert isinstance(kind, str)
+  assert isinstance(dict_sketch_bytes, dict)
+  assert params is None or isinstance(params, dict)
+  ensure_sketch_table(cur, con)
+  built_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+  params_str = json.dumps(params if params is not None else {})
+  con.executemany(f'INSERT OR REPLACE INTO {SKETCH_TABLE_NAME} VALUES (?, ?, ?, ?, ?, ?)',
+    [(table_name, col_name, kind, params_str, sketch_bytes, built_at) for (col_name, sketch_bytes) in dict_sketch_bytes.items()])
+  if commit:
+    con.commit()
+
+def get_sketches(cur, con, table_name, kind):
+  """Returns a dictionary of the column names of the given table to a
+  tuple of (their stored sketch of the given kind as bytes, the
+  parameters it was built with). Empty if none are stored."""
+  assert isinstance(table_name, str)
+  assert isinstance(kind, str)
+  if con.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name=?", (SKETCH_TABLE_NAME,)).fetchone()[0] == 0:
+    return {}
+  res = con.execute(f'SELECT col_name, sketch, params FROM {SKETCH_TABLE_NAME} WHERE table_name = ? AND kind = ? ORDER BY rowid',
+    (table_name, kind))
+  return {col_name: (bytes(sketch), json.loads(params) if params else {}) for (col_name, sketch, params) in res.fetchall()}
@@ -0,0 +1,380 @@
+import os
+import json
+from datetime import datetime, timezone
+
+"""Columnar storage backend: stores tables (wine_init and the derived
+tables) as files of columns, instead of rows in the sqlite database, so
+that reading a few columns of a table doesn't read the rest (such as the
+descriptions). Each table is one file in the store's directory, either:
+  - an Arrow IPC file (FORMAT_ARROW, the default), read memory-mapped, so
+  only the pages of the columns (and rows) read are loaded, or
+  - a Parquet file (FORMAT_PARQUET), which is smaller on disk, and whose
+  row groups are skipped by predicates using their min/max statistics.
+String columns are stored dictionary-encoded (each distinct string once).
+Reads project to the given columns and push the given predicates down to
+the file scan (see read_table).
+
+A ColumnarStore is passed as the con (and cur) of the db_op table
+functions (get_table_col_names, read_table, write_table, ...), of the
+catalog functions (its catalog is a json file in its directory), and of
+the statistics functions built on them (such as
+common_stat.get_table_recurs_limit_grouped_by, the basic statistics
+functions, common_stat.StatsCube and null_info.get_null_profile), which
+then run unchanged against it. Ex:
+  store = db_columnar.ColumnarStore()
+  db_columnar.export_tables(cur, con, store) # copy wine_init and the derived tables
+  cube = common_stat.StatsCube(['country'], ['price']).build(store, store, 'wine_init')
+This needs pyarrow, which is only imported when a store is first used.
+"""
+
+#constants
+COLUMNAR_DIR = os.path.join('database', 'columnar')
+FORMAT_ARROW = 'arrow' #Arrow IPC (feather v2) files, uncompressed so they can be memory-mapped
+FORMAT_PARQUET = 'parquet'
+FILE_EXTENSIONS = {FORMAT_ARROW: '.arrow', FORMAT_PARQUET: '.parquet'}
+DATASET_FORMATS = {FORMAT_ARROW: 'ipc', FORMAT_PARQUET: 'parquet'} #names of the formats in pyarrow.dataset
+CATALOG_FILE_NAME = '_catalog.json'
+#operators of the predicates that can be pushed down (see get_filter_expression)
+FILTER_OPS = ['=', '==', '!=', '<', '<=', '>', '>=', 'in', 'not in', 'is null', 'is not null']
+
+def import_pyarrow():
+  """Imports pyarrow (only needed once a store is used), returning the
+  modules used here: pyarrow, pyarrow.compute, pyarrow.dataset,
+  pyarrow.fs and pyarrow.parquet."""
+  import pyarrow as pa
+  import pyarrow.compute as pc
+  import pyarrow.dataset as ds
+  import pyarrow.fs as pa_fs
+  import pyarrow.parquet as pq
+  return pa, pc, ds, pa_fs, pq
+
+def is_columnar_store(con):
+  """Returns whether the given con is a ColumnarStore (rather than an
+  sqlite connection)."""
+  return isinstance(con, ColumnarStore)
+
+def get_filter_expression(filters):
+  """Returns the pyarrow.dataset expression that is true for the rows
+  matching all of the given predicates (or None if there are none).
+  Param:
+    @filters: list of predicates, as tuples of (column name, operator,
+    value), with the operator one of FILTER_OPS (value is a list for 'in'
+    and 'not in', and is left out for 'is null' and 'is not null'). Ex:
+      [('country', '=', 'US'), ('price', '<=', 100)]
+  """
+  assert filters is None or isinstance(filters, list)
+  if not filters:
+    return None
+  _, _, ds, _, _ = import_pyarrow()
+  expression = None
+  for predicate in filters:
+    assert isinstance(predicate, tuple)
+    col, op = predicate[0], predicate[1].lower()
+    assert op in FILTER_OPS
+    field = ds.field(col)
+    if op in ['=', '==']:
+      predicate_expression = field == predicate[2]
+    elif op == '!=':
+      predicate_expression = field != predicate[2]
+    elif op == '<':
+      predicate_expression = field < predicate[2]
+    elif op == '<=':
+      predicate_expression = field <= predicate[2]
+    elif op == '>':
+      predicate_expression = field > predicate[2]
+    elif op == '>=':
+      predicate_expression = field >= predicate[2]
+    elif op == 'in':
+      predicate_expression = field.isin(list(predicate[2]))
+    elif op == 'not in':
+      #(nulls don't match, as in sql)
+      predicate_expression = field.is_valid() & ~field.isin(list(predicate[2]))
+    elif op == 'is null':
+      predicate_expression = field.is_null()
+    else:
+      predicate_expression = field.is_valid()
+    expression = predicate_expression if expression is None else expression & predicate_expression
+  return expression
+
+class ColumnarStore:
+  """Directory of tables stored as columnar files (see the module
+  docstring), with a catalog of its derived tables."""
+  def __init__(self, directory=COLUMNAR_DIR, file_format=FORMAT_ARROW):
+    """Initializes the store (creating its directory if needed).
+    Param:
+      @directory: the directory the table files (and catalog) are in
+      @file_format: FORMAT_ARROW or FORMAT_PARQUET, the format tables are
+      written in. Tables in either format are read.
+    """
+    assert isinstance(directory, str)
+    assert file_format in FILE_EXTENSIONS
+    self.directory = directory
+    self.file_format = file_format
+    os.makedirs(directory, exist_ok=True)
+
+  def get_table_path(self, table_name, file_format=None):
+    """Returns the path of the file of the given table (in the given
+    format; by default, in the format it is stored in, or else in the
+    store's format)."""
+    assert isinstance(table_name, str)
+    if file_format is None:
+      for candidate_format in [self.file_format] + [f for f in FILE_EXTENSIONS if f != self.file_format]:
+        path = os.path.join(self.directory, table_name + FILE_EXTENSIONS[candidate_format])
+        if os.path.exists(path):
+          return path
+      file_format = self.file_format
+    return os.path.join(self.directory, table_name + FILE_EXTENSIONS[file_format])
+
+  def get_table_format(self, table_name):
+    """Returns the format the given table is stored in."""
+    path = self.get_table_path(table_name)
+    return FORMAT_PARQUET if path.endswith(FILE_EXTENSIONS[FORMAT_PARQUET]) else FORMAT_ARROW
+
+  def has_table(self, table_name):
+    """Returns whether the store has the given table."""
+    return os.path.exists(self.get_table_path(table_name))
+
+  def get_table_names(self):
+    """Returns the list of the names of the tables in the store."""
+    table_names = []
+    for file_name in sorted(os.listdir(self.directory)):
+      for extension in FILE_EXTENSIONS.values():
+        if file_name.endswith(extension):
+          table_names.append(file_name[:-len(extension)])
+    return table_names
+
+  def get_dataset(self, table_name):
+    """Returns the pyarrow dataset of the given table, reading its file
+    memory-mapped."""
+    assert self.has_table(table_name), f'no table {table_name} in {self.directory}'
+    _, _, ds, pa_fs, _ = import_pyarrow()
+    return ds.dataset(self.get_table_path(table_name), format=DATASET_FORMATS[self.get_table_format(table_name)],
+      filesystem=pa_fs.LocalFileSystem(use_mmap=True))
+
+  def get_col_names(self, table_name):
+    """Returns the list of column names of the given table, in order."""
+    return list(self.get_dataset(table_name).schema.names)
+
+  def get_num_rows(self, table_name, filters=None):
+    """Returns the number of rows of the given table (matching the given
+    predicates, if any; see get_filter_expression)."""
+    return self.get_dataset(table_name).count_rows(filter=get_filter_expression(filters))
+
+  def read_arrow_table(self, table_name, cols=None, filters=None, order_by=None, limit=None):
+    """Returns the given columns (all of them if None) of the rows of the
+    given table matching the given predicates (see get_filter_expression),
+    sorted by order_by and cut to the first limit rows (if given), as a
+    pyarrow table. Only the columns read (and used by the predicates and
+    order_by) are loaded from the file."""
+    assert cols is None or isinstance(cols, list)
+    assert order_by is None or isinstance(order_by, list)
+    assert limit is None or isinstance(limit, int)
+    read_cols = cols
+    if cols is not None and order_by:
+      read_cols = cols + [col for (col, _) in order_by if col not in cols]
+    arrow_table = self.get_dataset(table_name).to_table(columns=read_cols, filter=get_filter_expression(filters))
+    if order_by:
+      pa, pc, _, _, _ = import_pyarrow()
+      #dictionary-encoded (string) columns can't be sorted by, so sort by
+      #their decoded values instead
+      dict_sort_cols = {}
+      for (col, _) in order_by:
+        column = arrow_table.column(col)
+        dict_sort_cols[col] = column.cast(column.type.value_type) if pa.types.is_dictionary(column.type) else column
+      #nulls last, as pandas' sort_values and db_op's ORDER BY
+      sort_keys = [(col, 'ascending' if ascending else 'descending') for (col, ascending) in order_by]
+      try:
+        sort_indices = pc.sort_indices(pa.table(dict_sort_cols),
+          sort_keys=[sort_key + ('at_end',) for sort_key in sort_keys])
+      except (TypeError, ValueError): #older pyarrow only takes one placement for all the keys
+        sort_indices = pc.sort_indices(pa.table(dict_sort_cols), sort_keys=sort_keys, null_placement='at_end')
+      arrow_table = arrow_table.take(sort_indices)
+    if limit is not None:
+      arrow_table = arrow_table.slice(0, limit)
+    if read_cols is not cols:
+      arrow_table = arrow_table.select(cols)
+    return arrow_table
+
+  def read_table(self, table_name, cols=None, filters=None, categoricals=False, order_by=None, limit=None):
+    """Returns the given columns (all of them if None) of the rows of the
+    given table matching the given predicates, as a dataframe (see
+    read_arrow_table).
+    Param:
+      @table_name: the name of the table to read
+      @cols: list of the columns to read, in order
+      @filters: list of predicates the rows read must match (see
+      get_filter_expression)
+      @categoricals: whether to return the (dictionary-encoded) string
+      columns as pandas categoricals, rather than as strings
+      @order_by: list of tuples of (column name, ascending) to sort the
+      rows by, in order of priority
+      @limit: the maximum number of rows to read (after sorting)
+    """
+    return self.to_pandas(self.read_arrow_table(table_name, cols, filters, order_by, limit), categoricals)
+
+  def read_table_chunks(self, table_name, cols=None, chunksize=100000, categoricals=False):
+    """Yields the given columns of the given table as dataframes of up to
+    chunksize rows each, in order (see read_table)."""
+    assert isinstance(chunksize, int)
+    for batch in self.get_dataset(table_name).to_batches(columns=cols, batch_size=chunksize):
+      if batch.num_rows > 0:
+        yield self.to_pandas(batch, categoricals)
+
+  def to_pandas(self, arrow_table, categoricals=False):
+    """Returns the given pyarrow table (or record batch) as a dataframe,
+    with its dictionary-encoded columns decoded unless categoricals."""
+    pa, _, _, _, _ = import_pyarrow()
+    if not categoricals:
+      for (ind, field) in enumerate(arrow_table.schema):
+        if pa.types.is_dictionary(field.type):
+          arrow_table = arrow_table.set_column(ind, field.name, arrow_table.column(ind).cast(field.type.value_type))
+    return arrow_table.to_pandas()
+
+  def write_table(self, table_name, df, index=True):
+    """Writes the given dataframe as the given table (replacing it if it
+    exists), with its string columns dictionary-encoded.
+    Param:
+      @table_name: the name of the table to write
+      @df: the dataframe to write
+      @index: whether to write the index of df as column(s), as pandas'
+      to_sql does (named 'index' if it has no name)
+    """
+    assert isinstance(table_name, str)
+    pa, pc, _, _, pq = import_pyarrow()
+    if index:
+      df = df.reset_index()
+    arrow_table = pa.Table.from_pandas(df, preserve_index=False)
+    for (ind, field) in enumerate(arrow_table.schema):
+      if pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+        arrow_table = arrow_table.set_column(ind, field.name, pc.dictionary_encode(arrow_table.column(ind)))
+    #write to a temporary file first, and replace the table's file with it
+    #once written, so readers never see a partial (or missing) table, and
+    #the old table is kept if the write fails
+    path = self.get_table_path(table_name, self.file_format)
+    temp_path = path + '.tmp'
+    try:
+      if self.file_format == FORMAT_ARROW:
+        with pa.OSFile(temp_path, 'wb') as sink:
+          with pa.ipc.new_file(sink, arrow_table.schema) as writer:
+            writer.write_table(arrow_table)
+      else:
+        pq.write_table(arrow_table, temp_path, use_dictionary=True)
+    except BaseException:
+      if os.path.exists(temp_path):
+        os.remove(temp_path)
+      raise
+    os.replace(temp_path, path)
+    #delete the table's file in the other format, if it was stored in it
+    #(the store's format is read first, so readers see the new table already)
+    for file_format in FILE_EXTENSIONS:
+      other_path = self.get_table_path(table_name, file_format)
+      if file_format != self.file_format and os.path.exists(other_path):
+        os.remove(other_path)
+    return table_name
+
+  def drop_table(self, table_name):
+    """Deletes the given table's file(s), if any."""
+    for file_format in FILE_EXTENSIONS:
+      path = self.get_table_path(table_name, file_format)
+      if os.path.exists(path):
+        os.remove(path)
+
+  def get_null_counts(self, table_name, cols):
+    """Returns a tuple of (the number of rows of the given table, a
+    dictionary of each of the given columns to its number of nulls, the
+    number of rows without a null in any of these columns). The null
+    counts are read from the columns' validity bitmaps."""
+    assert isinstance(cols, list)
+    _, pc, _, _, _ = import_pyarrow()
+    arrow_table = self.read_arrow_table(table_name, cols)
+    dict_num_nulls = {col: arrow_table.column(col).null_count for col in cols}
+    is_fully_non_null = None
+    for col in cols:
+      if dict_num_nulls[col] == 0:
+        continue
+      is_valid = pc.is_valid(arrow_table.column(col))
+      is_fully_non_null = is_valid if is_fully_non_null is None else pc.and_(is_fully_non_null, is_valid)
+    num_fully_non_null = arrow_table.num_rows if is_fully_non_null is None else pc.sum(is_fully_non_null).as_py() or 0
+    return (arrow_table.num_rows, dict_num_nulls, num_fully_non_null)
+
+  def get_catalog_path(self):
+    """Returns the path of the store's catalog file."""
+    return os.path.join(self.directory, CATALOG_FILE_NAME)
+
+  def load_catalog(self):
+    """Returns the store's catalog, as a dictionary of table names to
+    their entries (see db_catalog.get_catalog_entries), in the order
+    they were first registered."""
+    if not os.path.exists(self.get_catalog_path()):
+      return {}
+    with open(self.get_catalog_path()) as f:
+      return json.load(f)
+
+  def register_table(self, table_name, kind, source_table=None, params=None,
+    schema=None, row_count=None, build_seconds=None):
+    """Records (or updates) the given derived table in the store's
+    catalog (see db_catalog.register_table)."""
+    dict_catalog = self.load_catalog()
+    dict_catalog[table_name] = {
+      'table_name': table_name,
+      'kind': kind,
+      'schema': self.get_col_names(table_name) if schema is None else schema,
+      'source_table': source_table,
+      'params': params if params is not None else {},
+      'row_count': self.get_num_rows(table_name) if row_count is None else row_count,
+      'built_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+      'build_seconds': build_seconds
+    }
+    self.save_catalog(dict_catalog)
+
+  def save_catalog(self, dict_catalog):
+    """Writes the given catalog (see load_catalog) as the store's catalog,
+    through a temporary file, so that an interrupted write can't leave a
+    partial catalog."""
+    assert isinstance(dict_catalog, dict)
+    temp_path = self.get_catalog_path() + '.tmp'
+    with open(temp_path, 'w') as f:
+      json.dump(dict_catalog, f, indent=2)
+    os.replace(temp_path, self.get_catalog_path())
+
+  def unregister_table(self, table_name):
+    """Removes the given table from the store's catalog (if it is in it)."""
+    dict_catalog = self.load_catalog()
+    if table_name in dict_catalog:
+      del dict_catalog[table_name]
+      self.save_catalog(dict_catalog)
+
+  def get_catalog_entries(self, kind=None):
+    """Returns the list of the catalog's entries (all of them, or only
+    those of the given kind) for tables that are still in the store."""
+    return [entry for entry in self.load_catalog().values()
+      if (kind is None or entry['kind'] == kind) and self.has_table(entry['table_name'])]
+
+def export_tables(cur, con, store, table_names=None):
+  """Copies tables from the sqlite database to the given store (with
+  their catalog entries, for derived tables).
+  Param:
+    @cur, con: database vars of the sqlite database
+    @store: the ColumnarStore to copy them to
+    @table_names: list of the names of the tables to copy; defaults to
+    the wine init table and all of the derived tables in the catalog
+  Returns the list of the names of the tables copied.
+  """
+  assert isinstance(store, ColumnarStore)
+  assert table_names is None or isinstance(table_names, list)
+  #imported here, as db_op and db_catalog dispatch to this module
+  import pandas as pd
+  from database import db_constants, db_op, db_catalog
+  dict_entries = {entry['table_name']: entry for entry in db_catalog.get_catalog_entries(cur, con)}
+  if table_names is None:
+    table_names = [db_constants.WINE_INIT_TABLE_NAME] + [table_name for table_name in dict_entries
+      if table_name != db_constants.WINE_INIT_TABLE_NAME]
+  for table_name in table_names:
+    #the tables already have their index (if any) as a column
+    df = pd.read_sql(f'SELECT * FROM {db_op.quote_identifier(table_name)}', con)
+    store.write_table(table_name, df, index=False)
+    if table_name in dict_entries:
+      entry = dict_entries[table_name]
+      store.register_table(table_name, entry['kind'], entry['source_table'], entry['params'],
+        entry['schema'], entry['row_count'], entry['build_seconds'])
+  return table_names
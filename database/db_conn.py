@@ -0,0 +1,195 @@
+import os
+import queue
+import threading
+import sqlite3 as sl
+from contextlib import contextmanager
+from urllib.parse import quote
+from database import db_constants, db_trace, instrument
+
+"""Shared connections to the database: one writer connection, and a
+pool of read-only reader connections that can be used from several
+threads at once (including while the writer rebuilds tables, as the
+database is put in WAL journal mode).
+
+Ex:
+  manager = db_conn.get_manager()
+  con = manager.get_writer() # for building tables
+  with manager.reader() as read_con: # in any thread
+    df = pd.read_sql('SELECT ...', read_con)
+Reader connections can be passed as the con of the wine_stat
+functions that only read from the database.
+The statements run on the connections can be traced by setting a
+db_trace.QueryTracer on the manager (see set_tracer)."""
+
+#constants
+WINE_INIT_PATH_TO_DB = os.path.join('database', db_constants.WINE_INIT_DB_NAME)
+NUM_READERS = 4 # maximum number of pooled reader connections per database
+CACHE_SIZE_KIB = 64 * 1024 # page cache size of each connection, in KiB
+MMAP_SIZE = 256 * 1024 * 1024 # bytes of the database file to memory-map
+BUSY_TIMEOUT_S = 30 # seconds to wait for a lock held by another connection
+
+class ConnectionManager:
+  """Hands out the connections to a single database file: one shared
+  writer connection (opened in WAL journal mode), and up to num_readers
+  pooled read-only connections (opened with mode=ro). Every connection
+  is opened with check_same_thread=False, so it can be used from any
+  thread; the pool makes sure each reader is only used by one thread
+  at a time, and writer() does the same for the writer.
+  """
+  def __init__(self, db_path=WINE_INIT_PATH_TO_DB, num_readers=NUM_READERS,
+    cache_size_kib=CACHE_SIZE_KIB, mmap_size=MMAP_SIZE, tracer=None):
+    """Initializes the manager; connections are only opened when first used.
+    Param:
+      @db_path: path to the database file
+      @num_readers: the maximum number of reader connections to open
+      @cache_size_kib: page cache size of each connection, in KiB
+      @mmap_size: number of bytes of the database file to memory-map
+      @tracer: db_trace.QueryTracer to record the statements run on the
+      connections with, if any (see set_tracer)
+    """
+    assert isinstance(db_path, str)
+    assert isinstance(num_readers, int)
+    assert num_readers > 0
+    assert isinstance(cache_size_kib, int)
+    assert isinstance(mmap_size, int)
+    assert tracer is None or isinstance(tracer, db_trace.QueryTracer)
+    self.db_path = db_path
+    self.num_readers = num_readers
+    self.cache_size_kib = cache_size_kib
+    self.mmap_size = mmap_size
+    self.tracer = tracer
+    self.__writer = None
+    self.__writer_lock = threading.RLock()
+    self.__readers = queue.LifoQueue() # idle reader connections
+    self.__all_readers = [] # every reader connection opened
+    self.__readers_lock = threading.Lock()
+
+  def __set_pragmas(self, con):
+    """Sets the per-connection tuning pragmas (and the tracer) on the
+    given connection."""
+    con.execute(f'PRAGMA cache_size = -{self.cache_size_kib}')
+    con.mmap_size = None
+    self.__set_mmap_size(con)
+    con.tracer = self.tracer
+
+  def __set_mmap_size(self, con):
+    """Sets the mmap_size of the given connection, if it changed: 0 while
+    the instrumentation is enabled, so that the pages sqlite reads are read
+    calls, counted in the bytes read it records (reads through the memory
+    map are page faults, which it does not see); self.mmap_size otherwise."""
+    mmap_size = 0 if instrument.is_enabled() else self.mmap_size
+    if con.mmap_size != mmap_size:
+      con.execute(f'PRAGMA mmap_size = {mmap_size}')
+      con.mmap_size = mmap_size
+
+  def get_writer(self):
+    """Returns the (shared) writer connection, opening it if needed. The
+    database file is created if it does not exist yet. When used from
+    several threads, use writer() instead, so only one uses it at a time."""
+    with self.__writer_lock:
+      if self.__writer is None:
+        con = sl.connect(self.db_path, timeout=BUSY_TIMEOUT_S, check_same_thread=False,
+          factory=db_trace.TracedConnection)
+        #WAL lets readers keep reading while tables are being written
+        con.execute('PRAGMA journal_mode = WAL')
+        con.execute('PRAGMA synchronous = NORMAL')
+        self.__set_pragmas(con)
+        self.__writer = con
+      else:
+        self.__set_mmap_size(self.__writer)
+      return self.__writer
+
+  @contextmanager
+  def writer(self):
+    """Context manager for exclusive use of the writer connection."""
+    with self.__writer_lock:
+      yield self.get_writer()
+
+  def __open_reader(self):
+    """Opens a new read-only connection to the database."""
+    db_uri = f'file:{quote(os.path.abspath(self.db_path))}?mode=ro'
+    con = sl.connect(db_uri, uri=True, timeout=BUSY_TIMEOUT_S, check_same_thread=False,
+      factory=db_trace.TracedConnection)
+    con.execute('PRAGMA query_only = 1')
+    self.__set_pragmas(con)
+    return con
+
+  def acquire_reader(self, timeout=None):
+    """Returns an idle reader connection from the pool, opening a new one
+    if all are in use and fewer than num_readers are open, and otherwise
+    waiting (up to timeout seconds, or forever if None) for one to be
+    released. The database file must already exist. Each connection
+    acquired should be given back with release_reader."""
+    try:
+      con = self.__readers.get_nowait()
+    except queue.Empty:
+      with self.__readers_lock:
+        if len(self.__all_readers) < self.num_readers:
+          con = self.__open_reader()
+          self.__all_readers.append(con)
+          return con
+      con = self.__readers.get(timeout=timeout)
+    self.__set_mmap_size(con)
+    return con
+
+  def release_reader(self, con):
+    """Gives the given reader connection back to the pool."""
+    assert con in self.__all_readers
+    self.__readers.put(con)
+
+  @contextmanager
+  def reader(self, timeout=None):
+    """Context manager for a pooled reader connection (see acquire_reader)."""
+    con = self.acquire_reader(timeout)
+    try:
+      yield con
+    finally:
+      self.release_reader(con)
+
+  def set_tracer(self, tracer):
+    """Sets the given db_trace.QueryTracer on the writer and all reader
+    connections (open now or later), so that it records the statements
+    run on them (and on the cursors created from them from now on); or
+    stops tracing them if tracer is None."""
+    assert tracer is None or isinstance(tracer, db_trace.QueryTracer)
+    self.tracer = tracer
+    with self.__writer_lock:
+      if self.__writer is not None:
+        self.__writer.tracer = tracer
+    with self.__readers_lock:
+      for con in self.__all_readers:
+        con.tracer = tracer
+
+  def close(self):
+    """Closes the writer and all reader connections (the manager can still
+    be used afterwards; it then opens new connections)."""
+    with self.__writer_lock:
+      if self.__writer is not None:
+        self.__writer.close()
+        self.__writer = None
+    with self.__readers_lock:
+      for con in self.__all_readers:
+        con.close()
+      self.__all_readers = []
+      self.__readers = queue.LifoQueue()
+
+"""Connection managers by (absolute) database path, so that all callers
+share the same connections to a given database."""
+glbl_managers = {}
+glbl_managers_lock = threading.Lock()
+
+def get_manager(db_path=WINE_INIT_PATH_TO_DB, **kwargs):
+  """Returns the shared connection manager for the given database file,
+  creating it (with any extra arguments to ConnectionManager) if needed."""
+  assert isinstance(db_path, str)
+  with glbl_managers_lock:
+    key = os.path.abspath(db_path)
+    if key not in glbl_managers:
+      glbl_managers[key] = ConnectionManager(db_path, **kwargs)
+    return glbl_managers[key]
+
+def close_all():
+  """Closes the connections of every shared connection manager."""
+  with glbl_managers_lock:
+    for manager in glbl_managers.values():
+      manager.close()
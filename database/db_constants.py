@@ -3,4 +3,24 @@
 WINE_INIT_DB_NAME = 'wine_init.db' # needs to end in .db
 WINE_INIT_TABLE_NAME = 'wine_init'
 WINE_DATA_FILE = 'winemag-data-130k-v2.csv'
-WINE_STR_CLEANED_DATA_FILE = 'winemag-data-130k-v2_cleaned.csv'
\ No newline at end of file
+WINE_STR_CLEANED_DATA_FILE = 'winemag-data-130k-v2_cleaned.csv'
+#dtypes the columns of the wine init table are read in as with
+#db_op.read_table(..., compact=True): the columns with few distinct values
+#as categoricals (whose groupbys run on integer codes), the numbers
+#downcast, and the free text columns as arrow strings (COMPACT_TEXT_DTYPE)
+COMPACT_TEXT_DTYPE = 'text'
+WINE_INIT_COMPACT_DTYPES = {
+  'country': 'category',
+  'province': 'category',
+  'region_1': 'category',
+  'region_2': 'category',
+  'variety': 'category',
+  'winery': 'category',
+  'taster_name': 'category',
+  'taster_twitter_handle': 'category',
+  'points': 'int8',
+  'price': 'float32',
+  'description': COMPACT_TEXT_DTYPE,
+  'designation': COMPACT_TEXT_DTYPE,
+  'title': COMPACT_TEXT_DTYPE
+}
@@ -0,0 +1,196 @@
+import re
+from database import db_constants, db_op
+from wine_stat import freq, common_stat
+
+"""Index management for the wine init table: creates the indexes
+the analyses group and filter by, and reports which index (if any)
+sqlite uses for a given query."""
+
+#constants
+WINE_INIT_TABLE_NAME = db_constants.WINE_INIT_TABLE_NAME
+"""
+Indexes to create on the wine init table, as a dictionary of a suffix
+for the index name to its list of columns (in order). Each index is
+named idx_<table name>_<suffix>. These are the indexes the project's
+queries use (see get_project_queries and report_index_usage): the
+grouped statistics (and exact medians) computed inside sqlite, which read
+them as covering indexes (the frequency tables and the cube of statistics are counted from
+full scans, which no index serves).
+ - hier: composite index for the hierarchical keys (country ->
+   province -> region_1), that also covers price and points so that
+   grouped statistics of these can be read from the index alone.
+ - The rest are for the other columns statistics of price/points are
+   grouped by, and cover those too.
+"""
+WINE_INIT_INDEXES = {
+  'hier': ['country', 'province', 'region_1', 'price', 'points'],
+  'province': ['province', 'price', 'points'],
+  'region_1': ['region_1', 'price', 'points'],
+  'variety': ['variety', 'price', 'points']
+}
+#regular expression to get the index used from a query plan step
+INDEX_IN_PLAN_RE = re.compile(r'USING (?:COVERING )?INDEX (\S+)')
+#regular expressions to get the table scanned by a query plan step, and the
+#subqueries (materialized or run as co-routines) that plan steps can scan
+SCAN_IN_PLAN_RE = re.compile(r'^SCAN (\S+)(.*)$')
+SUBQUERY_IN_PLAN_RE = re.compile(r'^(?:MATERIALIZE|CO-ROUTINE) (\S+)')
+
+def get_index_name(table_name, index_suffix):
+  """Returns the name of the index with the given suffix on the given table."""
+  return f'idx_{table_name}_{index_suffix}'
+
+def create_indexes(cur, con, table_name=WINE_INIT_TABLE_NAME, dict_indexes=WINE_INIT_INDEXES,
+  analyze=True):
+  """Creates the given indexes on the given table (if they don't already
+  exist), and then runs ANALYZE on the table so that sqlite's query
+  planner has statistics to choose between them with. Columns that
+  aren't in the table are left out of its indexes (and an index is
+  skipped if none of its columns are in the table).
+  Since tables written by pandas' to_sql(if_exists='replace') drop
+  their indexes, this should be called after the table is (re)created.
+  Param:
+    @cur, con: database vars
+    @table_name: the name of the table to index
+    @dict_indexes: dictionary of index name suffixes to their lists of
+    columns; see WINE_INIT_INDEXES above.
+    @analyze: whether to run ANALYZE on the table after indexing it
+  Returns the list of the names of the indexes on the table.
+  """
+  assert isinstance(table_name, str)
+  assert isinstance(dict_indexes, dict)
+  assert isinstance(analyze, bool)
+  set_of_col_names = set(db_op.get_table_col_names(cur, con, table_name))
+  index_names = []
+  with con:
+    for (index_suffix, index_cols) in dict_indexes.items():
+      assert isinstance(index_cols, list)
+      index_cols = [col for col in index_cols if col in set_of_col_names]
+      if len(index_cols) == 0:
+        continue
+      index_name = get_index_name(table_name, index_suffix)
+      cols_str = ', '.join([db_op.quote_identifier(col) for col in index_cols])
+      con.execute(f'CREATE INDEX IF NOT EXISTS {db_op.quote_identifier(index_name)} ON {db_op.quote_identifier(table_name)} ({cols_str})')
+      index_names.append(index_name)
+    if analyze:
+      con.execute(f'ANALYZE {db_op.quote_identifier(table_name)}')
+  return index_names
+
+def drop_indexes(cur, con, table_name=WINE_INIT_TABLE_NAME, dict_indexes=WINE_INIT_INDEXES):
+  """Drops the given indexes on the given table, if they exist (such
+  as before bulk-loading the table, so that they aren't updated row
+  by row). Param: as for create_indexes.
+  """
+  assert isinstance(table_name, str)
+  assert isinstance(dict_indexes, dict)
+  with con:
+    for index_suffix in dict_indexes:
+      con.execute(f'DROP INDEX IF EXISTS {db_op.quote_identifier(get_index_name(table_name, index_suffix))}')
+
+def explain_query_plan(cur, con, query_str, params=()):
+  """Returns sqlite's query plan for the given query (without running
+  it), as a list of the detail strings of its steps. Ex:
+    ['SCAN wine_init USING COVERING INDEX idx_wine_init_variety']
+  Param:
+    @cur, con: database vars
+    @query_str: the query to get the plan of
+    @params: parameters for the placeholders (?) of the query, if any
+  """
+  assert isinstance(query_str, str)
+  plan_rows = con.execute(f'EXPLAIN QUERY PLAN {query_str}', params).fetchall()
+  #each row is (id, parent, notused, detail)
+  return [plan_row[-1] for plan_row in plan_rows]
+
+def get_indexes_used(plan_details):
+  """Returns the list of index names used in the given query plan
+  (as returned by explain_query_plan)."""
+  assert isinstance(plan_details, list)
+  indexes_used = []
+  for detail in plan_details:
+    match = INDEX_IN_PLAN_RE.search(detail)
+    if match:
+      indexes_used.append(match.group(1))
+  return indexes_used
+
+def get_full_scans(plan_details):
+  """Returns the list of the tables the given query plan (as returned by
+  explain_query_plan) scans in full without an index, leaving out scans
+  of subqueries and of sqlite's own tables. Ex:
+    ['SCAN wine_init', 'USE TEMP B-TREE FOR GROUP BY'] -> ['wine_init']
+  """
+  assert isinstance(plan_details, list)
+  subquery_names = set()
+  for detail in plan_details:
+    match = SUBQUERY_IN_PLAN_RE.match(detail)
+    if match:
+      subquery_names.add(match.group(1))
+  full_scans = []
+  for detail in plan_details:
+    match = SCAN_IN_PLAN_RE.match(detail)
+    if match is None or 'USING' in match.group(2):
+      continue
+    scanned_name = match.group(1)
+    if scanned_name in subquery_names or scanned_name == 'CONSTANT' or scanned_name.startswith('(') or scanned_name.startswith('sqlite_'):
+      continue
+    full_scans.append(scanned_name)
+  return full_scans
+
+def get_project_queries(table_name=WINE_INIT_TABLE_NAME):
+  """Returns a dictionary of descriptions to the queries the project
+  issues against the wine init table, as built by the functions that
+  issue them:
+    - the scan the frequency tables are counted from (see
+    freq.get_value_counts_of_cols)
+    - the scan the cube of statistics is built from (see
+    common_stat.StatsCube.build), that init serves the grouped statistics
+    tables from
+    - the queries of the exact medians of the grouped statistics tables
+    written from the cube (see common_stat.StatsCube.get_exact_medians),
+    for the groupings of init.STATS_GROUPINGS; the same as those of
+    common_stat.get_basic_stats_of_col1_grouped_by_cols (which computes
+    the other statistics in the same pass)
+  """
+  #imported here, as init imports this module
+  import init
+  queries = {}
+  queries['frequency tables scan'] = freq.get_value_counts_query(table_name,
+    [freq_table_spec[0] for freq_table_spec in freq.FREQ_TABLE_SPECS])
+  stats_cube = common_stat.StatsCube(init.STATS_CUBE_DIMS, init.STATS_CUBE_MEASURES)
+  queries['statistics cube scan'] = db_op.get_select_query(table_name, stats_cube.get_read_cols())[0]
+  for (col_name, cols_to_group_by) in init.STATS_GROUPINGS:
+    queries[f'median of {col_name} grouped by {", ".join(cols_to_group_by)}'] = common_stat.get_sql_basic_stats_query(
+      col_name, cols_to_group_by, table_name, ['median'])
+  return queries
+
+def report_index_usage(cur, con, dict_queries=None, table_name=WINE_INIT_TABLE_NAME, print_report=True):
+  """Reports which index (if any) sqlite would use for each of the given
+  queries, using EXPLAIN QUERY PLAN.
+  Param:
+    @cur, con: database vars
+    @dict_queries: dictionary of descriptions to query strings to report
+    on. Defaults to the project's queries against table_name (see
+    get_project_queries).
+    @table_name: the table the default queries are against
+    @print_report: whether to also print the report
+  Returns a dictionary of the query descriptions to a dictionary with the
+  query ('query'), its query plan ('plan') and the indexes it uses
+  ('indexes'; an empty list if it is a full-table scan).
+  """
+  assert dict_queries is None or isinstance(dict_queries, dict)
+  assert isinstance(print_report, bool)
+  dict_queries = get_project_queries(table_name) if dict_queries is None else dict_queries
+  dict_report = {}
+  for (description, query_str) in dict_queries.items():
+    plan_details = explain_query_plan(cur, con, query_str)
+    dict_report[description] = {
+      'query': query_str,
+      'plan': plan_details,
+      'indexes': get_indexes_used(plan_details)
+    }
+  if print_report:
+    print("*************")
+    print("Index usage of queries:")
+    for (description, query_report) in dict_report.items():
+      indexes_str = ', '.join(query_report['indexes']) if query_report['indexes'] else 'none (full-table scan)'
+      print(f' - {description}: {indexes_str}')
+    print("*************")
+  return dict_report
@@ -1,18 +1,336 @@
+import sys
+import math
+import importlib.util
+import sqlite3 as sl
+from contextlib import contextmanager
+import numpy as np
 import pandas as pd
+from database import db_constants, db_columnar, instrument
 
-"""Common operations with database."""
+"""Common operations with database.
+The table operations (get_table_col_names, get_num_rows, read_table,
+read_table_chunks, write_table) also take a db_columnar.ColumnarStore as
+con, so that the functions built on them run against either backend."""
+
+#constants
+COMPACT_CHUNK_SIZE = 50000 #number of rows read (and cast) at a time by read_table(..., compact=True)
+
+def quote_identifier(name):
+  """Returns the given table or column name quoted for use in an SQL
+  query string (table names created here can contain hyphens, for
+  example)."""
+  assert isinstance(name, str)
+  return '"' + name.replace('"', '""') + '"'
+
+def get_table_col_names(cur, con, tablename):
+  """Returns the list of column names of the given table, in the order
+  they are in the table, without reading any of its rows.
+  Param:
+    @cur, con: database vars
+    @tablename: the name of the table to get the column names of
+  """
+  assert isinstance(tablename, str)
+  if db_columnar.is_columnar_store(con):
+    return con.get_col_names(tablename)
+  table_info = con.execute(f'PRAGMA table_info({quote_identifier(tablename)})').fetchall()
+  assert len(table_info) > 0 #assert table exists
+  return [col_info[1] for col_info in table_info]
+
+def get_num_rows(cur, con, tablename):
+  """Returns the number of rows of the given table."""
+  assert isinstance(tablename, str)
+  if db_columnar.is_columnar_store(con):
+    return con.get_num_rows(tablename)
+  return con.execute(f'SELECT COUNT(*) FROM {quote_identifier(tablename)}').fetchone()[0]
+
+def read_table_chunks(cur, con, tablename, cols, chunksize):
+  """Yields the given columns of the given table as dataframes of up to
+  chunksize rows each, in order, so that the table can be processed in
+  bounded memory.
+  Param:
+    @cur, con: database vars
+    @tablename: the name of the table to read
+    @cols: the list of columns to read
+    @chunksize: the maximum number of rows of each chunk
+  """
+  assert isinstance(tablename, str)
+  assert isinstance(cols, list)
+  assert isinstance(chunksize, int)
+  if db_columnar.is_columnar_store(con):
+    yield from con.read_table_chunks(tablename, cols, chunksize)
+    return
+  query_str = f'SELECT {", ".join([quote_identifier(col) for col in cols])} FROM {quote_identifier(tablename)}'
+  yield from pd.read_sql(query_str, con, chunksize=chunksize)
+
+def write_table(cur, con, tablename, df, index=True):
+  """Writes the given dataframe as the given table, replacing any table
+  with the same name (as pandas' to_sql(if_exists='replace') does).
+  Param:
+    @cur, con: database vars
+    @tablename: the name of the table to write
+    @df: the dataframe to write
+    @index: whether to write the index of df as column(s)
+  Returns the name of the table.
+  """
+  assert isinstance(tablename, str)
+  assert isinstance(df, pd.DataFrame)
+  if db_columnar.is_columnar_store(con):
+    return con.write_table(tablename, df, index)
+  df.to_sql(tablename, con, if_exists='replace', index=index)
+  return tablename
+
+@contextmanager
+def transaction(cur, con):
+  """Context manager running its statements in one transaction of con:
+  commits at the end, and rolls back on error. Unlike "with con:", it
+  starts the transaction explicitly (BEGIN), as sqlite3 only opens one
+  implicitly before INSERT/UPDATE/DELETE statements, so statements such
+  as DROP TABLE or CREATE TABLE run before the first of those would
+  otherwise be committed right away (and not rolled back on error).
+  Inside of another transaction (con.in_transaction), its statements are
+  part of that one instead, which commits (or rolls back) them."""
+  if con.in_transaction:
+    yield con
+    return
+  con.execute('BEGIN')
+  try:
+    yield con
+  except BaseException:
+    con.rollback()
+    raise
+  con.commit()
+
+def create_table_as(cur, con, res_table_name, select_query_str, params=(), temp=False):
+  """Materializes the result of the given SELECT query as a new table
+  in the database (CREATE TABLE ... AS SELECT), replacing any table
+  with the same name. The query is run entirely inside SQLite, so
+  no rows are converted to python/pandas objects.
+  Param:
+    @cur, con: database vars
+    @res_table_name: the name of the table to create
+    @select_query_str: the SELECT query whose result is the new table
+    @params: parameters for the placeholders (?) of the query, if any
+    @temp: if True, then the table is created as a TEMP table, which
+    is only visible to this connection and is dropped when it closes
+  Returns the name of the created table.
+  """
+  assert isinstance(res_table_name, str)
+  assert isinstance(select_query_str, str)
+  assert isinstance(temp, bool)
+  temp_str = 'TEMP ' if temp else ''
+  with transaction(cur, con): #so that the old table is only dropped if the new one is created
+    con.execute(f'DROP TABLE IF EXISTS {"temp." if temp else ""}{quote_identifier(res_table_name)}')
+    con.execute(f'CREATE {temp_str}TABLE {quote_identifier(res_table_name)} AS {select_query_str}', params)
+  return res_table_name
+
+def ensure_math_functions(cur, con):
+  """Makes sure the sql math functions used here (currently sqrt) can
+  be used on the given connection. SQLite only has them built in when
+  compiled with SQLITE_ENABLE_MATH_FUNCTIONS, so they are registered
+  as python functions otherwise."""
+  try:
+    con.execute('SELECT sqrt(1.0)')
+  except sl.OperationalError:
+    con.create_function('sqrt', 1, lambda x: None if x is None else math.sqrt(x), deterministic=True)
+
+def delete_rows_where(cur, con, tablename, where_str, params=()):
+  """Deletes the rows of the given table matching the given WHERE
+  condition in place (DELETE ... WHERE), inside SQLite.
+  Param:
+    @cur, con: database vars
+    @tablename: the name of the table to delete rows from
+    @where_str: the condition (without "WHERE") rows to delete match
+    @params: parameters for the placeholders (?) of the condition, if any
+  Returns the number of rows deleted.
+  """
+  assert isinstance(tablename, str)
+  assert isinstance(where_str, str)
+  with con:
+    num_rows_deleted = con.execute(f'DELETE FROM {quote_identifier(tablename)} WHERE {where_str}', params).rowcount
+  return num_rows_deleted
+
+def materialize_with_pandas(cur, con, res_table_name, select_query_str, df_func, params=()):
+  """Fallback to create_table_as for operations that cannot be expressed
+  in SQLite (such as aggregates it lacks): reads the result of the
+  given SELECT query into a dataframe, applies df_func to it, and writes
+  the resulting dataframe (with its index) as the table res_table_name,
+  replacing any table with the same name. The SELECT query should thus
+  only select the columns df_func needs.
+  Param:
+    @cur, con: database vars
+    @res_table_name: the name of the table to create
+    @select_query_str: the SELECT query to read the input of df_func with
+    @df_func: function taking the dataframe read and returning the
+    dataframe to write
+    @params: parameters for the placeholders (?) of the query, if any
+  Returns the name of the created table.
+  """
+  assert isinstance(res_table_name, str)
+  assert isinstance(select_query_str, str)
+  assert callable(df_func)
+  df = pd.read_sql(select_query_str, con, params=params)
+  df_func(df).to_sql(res_table_name, con, if_exists='replace')
+  return res_table_name
+
+def get_compact_dtypes(cols):
+  """Returns the dictionary of the given columns of the wine init table
+  (those of them in db_constants.WINE_INIT_COMPACT_DTYPES) to the compact
+  dtypes they are read in as (see cast_dtypes)."""
+  assert isinstance(cols, list)
+  return {col: db_constants.WINE_INIT_COMPACT_DTYPES[col] for col in cols
+    if col in db_constants.WINE_INIT_COMPACT_DTYPES}
+
+def get_text_dtype():
+  """Returns the dtype of arrow-backed strings (with nan as the missing
+  value, as pandas' default strings), or None if pyarrow isn't
+  installed."""
+  if importlib.util.find_spec('pyarrow') is None:
+    return None
+  return pd.StringDtype('pyarrow', na_value=np.nan)
+
+def cast_dtypes(df, dtypes):
+  """Returns the dataframe with its columns cast to the given dtypes.
+  Categoricals' categories are sorted (so that they group and sort as the
+  strings would), integer columns with nulls are cast to the nullable
+  integer dtype of the same size, and columns of
+  db_constants.COMPACT_TEXT_DTYPE are cast to arrow strings (left as
+  they are if pyarrow isn't installed).
+  Param:
+    @df: the dataframe to cast
+    @dtypes: dictionary of column names to dtypes (columns not in df
+    are skipped)
+  """
+  assert isinstance(dtypes, dict)
+  df_casted = df.copy(deep=False)
+  for (col, dtype) in dtypes.items():
+    if col not in df.columns:
+      continue
+    if dtype == db_constants.COMPACT_TEXT_DTYPE:
+      dtype = get_text_dtype()
+      if dtype is None:
+        continue
+    elif dtype == 'category':
+      if isinstance(df[col].dtype, pd.CategoricalDtype):
+        #(already categorical, as read from a columnar store)
+        df_casted[col] = df[col].cat.set_categories(df[col].cat.categories.sort_values())
+        continue
+    elif pd.api.types.is_integer_dtype(np.dtype(dtype) if isinstance(dtype, str) else dtype) and df[col].isna().any():
+      dtype = str(np.dtype(dtype)).capitalize()
+    df_casted[col] = df[col].astype(dtype)
+  return df_casted
+
+def concat_compact_dfs(dfs, ignore_index=True):
+  """Concatenates the given dataframes (with the same columns), keeping
+  their categorical columns categorical (with the union of their
+  categories, sorted), rather than falling back to objects as pd.concat
+  does when their categories differ."""
+  assert isinstance(dfs, list) and len(dfs) > 0
+  cat_cols = [col for col in dfs[0].columns if isinstance(dfs[0][col].dtype, pd.CategoricalDtype)]
+  df = pd.concat([df_chunk.drop(columns=cat_cols) for df_chunk in dfs], ignore_index=ignore_index)
+  for col in cat_cols:
+    df[col] = pd.api.types.union_categoricals([df_chunk[col] for df_chunk in dfs], sort_categories=True)
+  return df[list(dfs[0].columns)]
+
+def get_where_clause(where):
+  """Compiles the given predicates to a parameterized sql WHERE clause
+  (matching the rows that match all of them), returning it (the empty
+  string if there are none) along with the list of its parameters.
+  Param:
+    @where: list of predicates, as tuples of (column name, operator,
+    value), with the operator one of db_columnar.FILTER_OPS (value is a
+    list for 'in' and 'not in', and is left out for 'is null' and 'is not
+    null'). Ex:
+      [('country', '=', 'US'), ('price', '<=', 100)]
+  """
+  assert where is None or isinstance(where, list)
+  if not where:
+    return '', []
+  conditions = []
+  params = []
+  for predicate in where:
+    assert isinstance(predicate, tuple)
+    col, op = quote_identifier(predicate[0]), predicate[1].lower()
+    assert op in db_columnar.FILTER_OPS
+    if op in ['is null', 'is not null']:
+      conditions.append(f'{col} {op.upper()}')
+    elif op in ['in', 'not in']:
+      values = list(predicate[2])
+      if len(values) == 0:
+        #nothing is in an empty list (and nulls are never matched)
+        conditions.append('0' if op == 'in' else f'{col} IS NOT NULL')
+        continue
+      conditions.append(f'{col} {op.upper()} ({", ".join(["?"] * len(values))})')
+      params += values
+    else:
+      conditions.append(f'{col} {"=" if op == "==" else op} ?')
+      params.append(predicate[2])
+  return ' WHERE ' + ' AND '.join(conditions), params
+
+def get_order_by_list(order_by=None, col_to_sort_by=None, sort_by_ascending=False):
+  """Returns the list of tuples of (column name, ascending) to sort by,
+  from order_by (a list of column names, sorted ascending, and/or
+  tuples of (column name, ascending)), or else from the single column
+  col_to_sort_by (if given)."""
+  if order_by is None:
+    return [] if col_to_sort_by == None else [(col_to_sort_by, sort_by_ascending)]
+  assert isinstance(order_by, list)
+  order_by_list = []
+  for col in order_by:
+    if isinstance(col, str):
+      col = (col, True)
+    assert isinstance(col, tuple) and isinstance(col[0], str) and isinstance(col[1], bool)
+    order_by_list.append(col)
+  return order_by_list
+
+def get_select_query(tablename, cols=[], where=None, order_by=[], limit=None):
+  """Compiles a parameterized sql query selecting the given columns (all
+  of them if none) of the rows of the given table matching the given
+  predicates (see get_where_clause), sorted by order_by (a list of
+  tuples of (column name, ascending), with nulls last) and cut to the
+  first limit rows, returning it along with the list of its parameters."""
+  col_str = '*' if len(cols) == 0 else ', '.join([quote_identifier(col) for col in cols])
+  query_str = f'SELECT {col_str} FROM {quote_identifier(tablename)}'
+  where_str, params = get_where_clause(where)
+  query_str += where_str
+  if len(order_by) > 0:
+    #nulls last, as pandas' sort_values
+    query_str += ' ORDER BY ' + ', '.join([f'{quote_identifier(col)} {"ASC" if ascending else "DESC"} NULLS LAST'
+      for (col, ascending) in order_by])
+  if limit is not None:
+    query_str += ' LIMIT ?'
+    params.append(limit)
+  return query_str, params
 
 def read_table(cur, con, tablename, cols=[],
-  col_to_sort_by=None, sort_by_ascending=False):
+  col_to_sort_by=None, sort_by_ascending=False,
+  where=None, order_by=None, limit=None, dtypes=None, index_col=None, compact=False):
   """Reads the table from the database,
   returning all columns by default,
   else the concatenated list given
   of column names in the order
-  given in that list.
+  given in that list. The filtering,
+  sorting and limiting are run in the
+  database (or pushed down to the
+  columnar store), so only the rows
+  and columns needed are read.
   Param:
     @cur, con: database vars
     @tablename: the name of the table to read from
     @cols: the list of columns to select
+    @col_to_sort_by, sort_by_ascending: the column to sort by, and in
+    which direction (shorthand for order_by, if it isn't given)
+    @where: list of predicates the rows read must match, as tuples of
+    (column name, operator, value) (see get_where_clause)
+    @order_by: list of the columns to sort by, in order of priority, as
+    column names (ascending) and/or tuples of (column name, ascending);
+    nulls are sorted last
+    @limit: the maximum number of rows to read (after sorting)
+    @dtypes: dictionary of column names to the dtypes to cast them to
+    (see cast_dtypes)
+    @index_col: the column to set as the index of the dataframe
+    @compact: whether to read the columns of the wine init table in
+    their compact dtypes (see get_compact_dtypes), casting the rows a
+    chunk at a time so that the full table is never held as objects
   """
   assert isinstance(cols, list)
   for i in cols:
@@ -21,20 +339,33 @@ def read_table(cur, con, tablename, cols=[],
   if col_to_sort_by != None:
     assert isinstance(col_to_sort_by, str)
   assert isinstance(sort_by_ascending, bool)
+  assert limit is None or isinstance(limit, int)
+  assert dtypes is None or isinstance(dtypes, dict)
+  assert index_col is None or isinstance(index_col, str)
+  assert isinstance(compact, bool)
+  order_by = get_order_by_list(order_by, col_to_sort_by, sort_by_ascending)
+  if compact:
+    dtypes = {**get_compact_dtypes(cols if len(cols) > 0 else get_table_col_names(cur, con, tablename)), **(dtypes or {})}
 
-  #build query str
-  query_str = ''
-  if len(cols) == 0:
-    query_str = f'SELECT * FROM {tablename}'
-  else:
-    query_str = f'SELECT {cols[0]}'
-    for col in cols[1:]:
-      query_str += f', {col}'
-      query_str += f' FROM {tablename}'
-  df = pd.read_sql(query_str, con)
-  if col_to_sort_by != None:
-    df = df.sort_values(by=col_to_sort_by, ascending=sort_by_ascending)
-  return df
+  if db_columnar.is_columnar_store(con):
+    #(dictionary-encoded columns are read directly as categoricals)
+    df = con.read_table(tablename, cols if len(cols) > 0 else None, where,
+      categoricals=compact, order_by=order_by, limit=limit)
+    df = cast_dtypes(df, dtypes) if dtypes else df
+    if index_col != None:
+      df = df.set_index(index_col)
+    return df
+
+  query_str, params = get_select_query(tablename, cols, where, order_by, limit)
+  if not compact:
+    df = pd.read_sql(query_str, con, params=params, index_col=index_col)
+    return cast_dtypes(df, dtypes) if dtypes else df
+  dfs = [cast_dtypes(df_chunk, dtypes) for df_chunk in
+    pd.read_sql(query_str, con, params=params, index_col=index_col, chunksize=COMPACT_CHUNK_SIZE)]
+  if len(dfs) == 0:
+    #(no rows)
+    return cast_dtypes(pd.read_sql(query_str, con, params=params, index_col=index_col), dtypes)
+  return concat_compact_dfs(dfs, ignore_index=index_col is None)
 
 def join_dfs(df1, df2, list_cols_to_join_on, join_type='inner', **kwargs):
   """Joins the two passed dataframes on the columns passed as the third
@@ -90,22 +421,37 @@ def filter_top_n(
   assert topnnum > 0
   assert (df is not None) or df_table_name is not None
   assert (df is None) or df_table_name is None
+  cols_to_select_by = cols_to_group_by + [col_to_measure_by]
   if df_to_measure_by is None and tablename_to_measure_by is None:
-    df_to_measure_by = df if df is not None else read_table(cur, con, df_table_name)
-  elif tablename_to_measure_by != None:
+    if df is not None:
+      df_to_measure_by = df
+    else:
+      tablename_to_measure_by = df_table_name
+  if df_to_measure_by is not None:
+    for col in cols_to_group_by:
+      assert col in df_to_measure_by.columns
+    cols_to_measure_by_df = df_to_measure_by[cols_to_select_by].sort_values(by=col_to_measure_by, ascending=ascending)
+    rows_to_measure_by_df = cols_to_measure_by_df.head(topnnum)[cols_to_group_by]
+  else:
     assert isinstance(tablename_to_measure_by, str)
-    #read from database if specified
-    df_to_measure_by = read_table(cur, con, tablename_to_measure_by)
+    #rank in the database, reading only the top n rows
+    rows_to_measure_by_df = read_table(cur, con, tablename_to_measure_by, cols_to_select_by,
+      order_by=[(col_to_measure_by, ascending)], limit=topnnum)[cols_to_group_by]
   if df is None:
-    df = read_table(cur, con, df_table_name)
-  #assert cols to group by are both in df and df to measure by
-  cols_in_df_to_measure_by_set = set(list(df_to_measure_by.columns))
+    where = None
+    group_values = list(rows_to_measure_by_df[cols_to_group_by[0]]) if len(cols_to_group_by) == 1 else []
+    if len(group_values) > 0 and not pd.isna(group_values).any():
+      #read only the rows of the top n groups (nulls are joined on in
+      #pandas, but never matched in sql, so those aren't pushed down)
+      where = [(cols_to_group_by[0], 'in', group_values)]
+    df = read_table(cur, con, df_table_name, where=where)
+  #assert cols to group by are in df
   cols_in_df_set = set(list(df.columns))
   for col in cols_to_group_by:
-    assert col in cols_in_df_to_measure_by_set
     assert col in cols_in_df_set
-  cols_to_select_by = cols_to_group_by + [col_to_measure_by]
-  cols_to_measure_by_df = df_to_measure_by[cols_to_select_by].sort_values(by=col_to_measure_by, ascending=ascending)
-  rows_to_measure_by_df = cols_to_measure_by_df.head(topnnum)[cols_to_group_by]
   cols_filtered_res = join_dfs(df, rows_to_measure_by_df, list_cols_to_join_on=cols_to_group_by)
-  return cols_filtered_res
\ No newline at end of file
+  return cols_filtered_res
+
+#record the calls of the public functions of this module while the
+#instrumentation is enabled (see database/instrument.py)
+instrument.instrument_module(sys.modules[__name__], exclude=['quote_identifier'])
@@ -0,0 +1,310 @@
+import re
+import json
+import time
+import threading
+import sqlite3 as sl
+from contextlib import contextmanager
+
+"""Opt-in tracing of the sql statements run on a connection. The
+connections of db_conn.ConnectionManager are opened as TracedConnection's;
+once a QueryTracer is set on them (see ConnectionManager.set_tracer), each
+statement they (or the cursors created from them since) run is recorded with:
+  - its latency: the time to run it and to fetch its rows
+  - its number of rows (fetched for queries, changed for writes)
+  - its EXPLAIN QUERY PLAN (captured once per distinct statement)
+and the tracer reports the statements that scan whole tables (without an
+index) and those that are run more than once with the same parameters,
+which are the candidates for indexing or caching.
+
+Ex:
+  tracer = db_trace.QueryTracer()
+  manager = db_conn.get_manager()
+  manager.set_tracer(tracer)
+  ... # run the analyses with manager.get_writer() / manager.reader()
+  manager.set_tracer(None)
+  tracer.print_report()
+  tracer.dump_json('queries.json')
+"""
+
+#constants
+MAX_PARAMS_STR_LEN = 200 #parameters are recorded as their repr, cut to this length
+#statements that have no query plan (worth capturing)
+NO_PLAN_STATEMENT_RE = re.compile(r'^\s*(PRAGMA|EXPLAIN|BEGIN|COMMIT|END|ROLLBACK|SAVEPOINT|RELEASE|ANALYZE|VACUUM|ATTACH|DETACH|DROP|CREATE\s+(UNIQUE\s+)?INDEX)\b', re.IGNORECASE)
+#statements that change the schema (and so can change the plans of others)
+SCHEMA_STATEMENT_RE = re.compile(r'^\s*(CREATE|DROP|ALTER|ANALYZE)\b', re.IGNORECASE)
+#CREATE TABLE ... AS statements (whose rows aren't counted as changes), with
+#the name of the table they create
+CREATE_TABLE_AS_RE = re.compile(r'^\s*CREATE\s+(?:TEMP\s+|TEMPORARY\s+)?TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?("(?:[^"]|"")+"|[^\s(]+)\s+AS\b', re.IGNORECASE)
+WHITESPACE_RE = re.compile(r'\s+')
+
+class QueryRecord:
+  """The record of one statement run (see the module docstring). Rows
+  fetched after it was run are added to it as they are fetched."""
+  def __init__(self, sql, params, is_many):
+    self.sql = sql
+    #(for executemany, params is already a description of the parameters)
+    self.params_str = params if is_many else (repr(params)[:MAX_PARAMS_STR_LEN] if params else '')
+    self.is_many = is_many
+    self.seconds = 0.0
+    self.num_rows = 0
+    self.plan = None
+    self.full_scans = []
+
+  def get_key(self):
+    """Returns the key that identical statements (same sql, up to
+    whitespace, and same parameters) share."""
+    return (WHITESPACE_RE.sub(' ', self.sql).strip(), self.params_str)
+
+  def to_dict(self):
+    """Returns the record as a json-serializable dictionary."""
+    return {
+      'sql': self.sql,
+      'params': self.params_str,
+      'is_many': self.is_many,
+      'seconds': self.seconds,
+      'num_rows': self.num_rows,
+      'plan': self.plan,
+      'full_scans': self.full_scans
+    }
+
+class QueryTracer:
+  """Records the statements run on the connections it is set on (see
+  the module docstring)."""
+  def __init__(self, explain=True):
+    """Initializes an empty tracer.
+    Param:
+      @explain: whether to capture the query plan of each distinct
+      statement (with EXPLAIN QUERY PLAN, which sqlite plans but doesn't run)
+    """
+    assert isinstance(explain, bool)
+    self.explain = explain
+    self.records = []
+    self.__plans = {} #cache of the plans of the statements, by sql
+    self.__lock = threading.Lock()
+    self.__thread_state = threading.local()
+
+  def is_suspended(self):
+    """Returns whether recording is suspended in this thread (while the
+    tracer runs its own EXPLAIN statements)."""
+    return getattr(self.__thread_state, 'suspended', False)
+
+  @contextmanager
+  def suspended(self):
+    """Context manager that suspends recording in this thread, for running
+    statements that aren't the traced program's own (such as the tracer's
+    EXPLAIN statements, or the row counts of the instrumentation)."""
+    was_suspended = self.is_suspended()
+    self.__thread_state.suspended = True
+    try:
+      yield self
+    finally:
+      self.__thread_state.suspended = was_suspended
+
+  def add_record(self, con, sql, params, is_many):
+    """Records a statement about to be run on the given connection, and
+    returns its record. Its plan is captured first (so that the time
+    to capture it isn't counted in the statement's latency)."""
+    record = QueryRecord(sql, params, is_many)
+    if SCHEMA_STATEMENT_RE.match(sql):
+      self.__plans = {}
+    if self.explain and not is_many and not NO_PLAN_STATEMENT_RE.match(sql):
+      record.plan = self.get_plan(con, sql, params)
+      if record.plan is not None:
+        #imported here so that opening a connection stays light
+        from database import db_index
+        record.full_scans = db_index.get_full_scans(record.plan)
+    with self.__lock:
+      self.records.append(record)
+    return record
+
+  def get_plan(self, con, sql, params):
+    """Returns the (cached) query plan of the given statement, as from
+    db_index.explain_query_plan, or None if it can't be explained (such
+    as a statement on a table that doesn't exist yet)."""
+    if sql in self.__plans:
+      return self.__plans[sql]
+    from database import db_index
+    try:
+      with self.suspended():
+        plan = db_index.explain_query_plan(None, con, sql, params if params is not None else ())
+    except (sl.Error, ValueError):
+      plan = None
+    #statements can't be explained before the tables they use exist
+    if plan is not None:
+      self.__plans[sql] = plan
+    return plan
+
+  def count_created_rows(self, con, sql):
+    """Returns the number of rows of the table the given CREATE TABLE
+    ... AS statement created, or None if it isn't one."""
+    match = CREATE_TABLE_AS_RE.match(sql)
+    if match is None:
+      return None
+    try:
+      with self.suspended():
+        return con.execute(f'SELECT COUNT(*) FROM {match.group(1)}').fetchone()[0]
+    except sl.Error:
+      return None
+
+  def reset(self):
+    """Clears the records (and cached plans)."""
+    with self.__lock:
+      self.records = []
+      self.__plans = {}
+
+  def get_full_scan_records(self):
+    """Returns the list of the records of the statements whose plan scans
+    a whole table without an index."""
+    return [record for record in self.records if len(record.full_scans) > 0]
+
+  def get_repeated_queries(self, min_count=2):
+    """Returns the list of the statements run at least min_count times
+    with the same parameters, as dictionaries with the statement ('sql'),
+    its parameters ('params'), the number of times it was run ('count'),
+    and its total latency ('seconds'), by total latency (descending)."""
+    assert isinstance(min_count, int)
+    dict_repeated = {}
+    for record in self.records:
+      repeated = dict_repeated.setdefault(record.get_key(), {'sql': record.sql, 'params': record.params_str, 'count': 0, 'seconds': 0.0})
+      repeated['count'] += 1
+      repeated['seconds'] += record.seconds
+    repeated_queries = [repeated for repeated in dict_repeated.values() if repeated['count'] >= min_count]
+    return sorted(repeated_queries, key=lambda repeated: repeated['seconds'], reverse=True)
+
+  def get_report(self):
+    """Returns the report of the statements recorded, as a
+    json-serializable dictionary with: their number ('num_queries') and
+    total latency ('seconds'), the records of all of them ('queries'),
+    of those that scan whole tables ('full_scans'), and the repeated
+    statements ('repeated'; see get_repeated_queries)."""
+    records = list(self.records)
+    return {
+      'num_queries': len(records),
+      'seconds': sum([record.seconds for record in records]),
+      'queries': [record.to_dict() for record in records],
+      'full_scans': [record.to_dict() for record in self.get_full_scan_records()],
+      'repeated': self.get_repeated_queries()
+    }
+
+  def dump_json(self, path):
+    """Writes the report (see get_report) to a .json file."""
+    with open(path, 'w') as f:
+      json.dump(self.get_report(), f, indent=2)
+
+  def print_report(self, top_n=10):
+    """Prints the top_n slowest statements, the statements that scan whole
+    tables, and the top_n repeated statements."""
+    def get_sql_str(sql):
+      sql = WHITESPACE_RE.sub(' ', sql).strip()
+      return sql if len(sql) <= 120 else sql[:117] + '...'
+    records = list(self.records)
+    print("*************")
+    print(f"{len(records)} queries, {sum([record.seconds for record in records]):.3f}s in total")
+    print("Slowest queries:")
+    for record in sorted(records, key=lambda record: record.seconds, reverse=True)[:top_n]:
+      print(f' - {record.seconds:.4f}s, {record.num_rows} rows: {get_sql_str(record.sql)}')
+    print("Full-table scans:")
+    dict_full_scans = {}
+    for record in self.get_full_scan_records():
+      dict_full_scans.setdefault(get_sql_str(record.sql), []).append(record)
+    for (sql_str, scan_records) in dict_full_scans.items():
+      print(f' - scans {", ".join(scan_records[0].full_scans)} ({len(scan_records)}x, {sum([record.seconds for record in scan_records]):.4f}s): {sql_str}')
+    print("Repeated queries:")
+    for repeated in self.get_repeated_queries()[:top_n]:
+      print(f' - {repeated["count"]}x, {repeated["seconds"]:.4f}s: {get_sql_str(repeated["sql"])} {repeated["params"]}')
+    print("*************")
+
+class TracedCursor(sl.Cursor):
+  """Cursor that records the statements it runs, and the rows fetched
+  from them, with its connection's tracer (if any)."""
+  def __init__(self, con):
+    super().__init__(con)
+    self.__record = None
+
+  def __get_tracer(self):
+    tracer = getattr(self.connection, 'tracer', None)
+    return tracer if tracer is not None and not tracer.is_suspended() else None
+
+  def __run(self, run_func, sql, params, is_many):
+    """Runs the statement with run_func, recording it if traced."""
+    tracer = self.__get_tracer()
+    if tracer is None:
+      self.__record = None
+      return run_func()
+    record = tracer.add_record(self.connection, sql, params, is_many)
+    self.__record = record
+    start_total_changes = self.connection.total_changes
+    start_time = time.perf_counter()
+    try:
+      run_func()
+    finally:
+      record.seconds += time.perf_counter() - start_time
+    if self.description is None:
+      #not a query: count the rows it changed (or created)
+      record.num_rows = self.rowcount if self.rowcount >= 0 else self.connection.total_changes - start_total_changes
+      num_created_rows = tracer.count_created_rows(self.connection, sql) if not is_many else None
+      if num_created_rows is not None:
+        record.num_rows = num_created_rows
+    return self
+
+  def __fetched(self, fetch_func):
+    """Fetches with fetch_func, adding the time and rows to the record of
+    the last statement run (if traced)."""
+    record = self.__record
+    if record is None:
+      return fetch_func()
+    start_time = time.perf_counter()
+    rows = fetch_func()
+    record.seconds += time.perf_counter() - start_time
+    if isinstance(rows, list):
+      record.num_rows += len(rows)
+    elif rows is not None:
+      record.num_rows += 1
+    return rows
+
+  def execute(self, sql, parameters=()):
+    return self.__run(lambda: super(TracedCursor, self).execute(sql, parameters), sql, parameters, False)
+
+  def executemany(self, sql, seq_of_parameters):
+    if self.__get_tracer() is not None:
+      #the parameters may be an iterator, that can only be read once
+      seq_of_parameters = list(seq_of_parameters)
+    return self.__run(lambda: super(TracedCursor, self).executemany(sql, seq_of_parameters), sql,
+      f'{len(seq_of_parameters)} rows' if isinstance(seq_of_parameters, list) else '', True)
+
+  def fetchone(self):
+    return self.__fetched(super().fetchone)
+
+  def fetchmany(self, size=None):
+    return self.__fetched(lambda: super(TracedCursor, self).fetchmany(self.arraysize if size is None else size))
+
+  def fetchall(self):
+    return self.__fetched(super().fetchall)
+
+  def __next__(self):
+    row = self.__fetched(lambda: super(TracedCursor, self).fetchone())
+    if row is None:
+      raise StopIteration
+    return row
+
+class TracedConnection(sl.Connection):
+  """Connection (given as the factory to sqlite3.connect) that records its
+  statements with its tracer (a QueryTracer; none by default, in which
+  case nothing is recorded). While it has a tracer, its cursors are
+  TracedCursor's; otherwise they are plain cursors, so that fetching
+  rows costs nothing more (cursors created before a tracer is set are
+  thus not traced)."""
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.tracer = None
+
+  def cursor(self, factory=None):
+    if factory is None:
+      factory = TracedCursor if self.tracer is not None else sl.Cursor
+    return super().cursor(factory)
+
+  def execute(self, sql, parameters=()):
+    return self.cursor().execute(sql, parameters)
+
+  def executemany(self, sql, seq_of_parameters):
+    return self.cursor().executemany(sql, seq_of_parameters)
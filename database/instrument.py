@@ -0,0 +1,432 @@
+import os
+import json
+import time
+import functools
+import inspect
+import threading
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+try:
+  import resource
+except ImportError: # not on windows
+  resource = None
+
+"""Stage-level timing and memory instrumentation of the pipeline.
+When enabled, each call of an instrumented function (or each stage()
+block) records:
+  - its wall time (excluding the instrumentation's own overhead)
+  - the number of rows of its input table / dataframe and of its output
+  (when these can be told from its arguments and result)
+  - the bytes the process read from files while it ran (from
+  /proc/self/io, on linux), which is mostly the sqlite database's pages
+  (reads through a memory map are not counted, so the connections of
+  db_conn don't memory-map the database while enabled)
+  - how much it raised the peak RSS of the process
+  - (optionally) the peak memory allocated (traced by tracemalloc) while
+  it ran, beyond what was allocated when it started
+Calls are nested: calls made inside an instrumented call are recorded as
+its children. pandas' read_sql and to_sql are also recorded while enabled,
+so that time spent converting to and from dataframes shows up on its own.
+When disabled (the default), an instrumented function only checks one
+global flag before calling the function.
+
+Ex:
+  instrument.enable()
+  init.init()
+  instrument.dump_json('report.json')
+  instrument.dump_folded_stacks('report.folded') # for flamegraph.pl/speedscope
+Setting the environment variable WINE_INSTRUMENT=1 enables it on import.
+"""
+
+#constants
+ENV_VAR = 'WINE_INSTRUMENT'
+PROC_IO_PATH = '/proc/self/io'
+#names of the arguments that hold the name of the input table / dataframe
+INPUT_TABLE_ARG_NAMES = ['input_table_name', 'table_name', 'tablename', 'wine_init_table']
+INPUT_DF_ARG_NAMES = ['df', 'd', 'df_', 'frame']
+
+glbl_enabled = False
+glbl_trace_memory = False
+glbl_started_tracemalloc = False #whether enable() started tracemalloc (so disable() stops it)
+glbl_count_rows = True
+glbl_records = [] #records of the top-level calls (with their children)
+glbl_records_lock = threading.Lock()
+glbl_run_started_at = None
+glbl_thread_state = threading.local() #stack of the calls in progress, per thread
+glbl_pandas_originals = {} #pandas functions replaced while enabled
+
+class CallRecord:
+  """Measurements of one instrumented call (see the module docstring)."""
+  def __init__(self, name):
+    self.name = name
+    self.seconds = None
+    self.rows_in = None
+    self.rows_out = None
+    self.bytes_read = None
+    self.maxrss_increase_kib = None
+    self.peak_traced_bytes = None
+    self.children = []
+
+  def get_self_seconds(self):
+    """Returns the wall time spent in the call outside of its children."""
+    return max(0.0, self.seconds - sum([child.seconds for child in self.children]))
+
+  def to_dict(self):
+    """Returns the record (and its children) as a json-serializable dictionary."""
+    return {
+      'name': self.name,
+      'seconds': self.seconds,
+      'self_seconds': self.get_self_seconds(),
+      'rows_in': self.rows_in,
+      'rows_out': self.rows_out,
+      'bytes_read': self.bytes_read,
+      'maxrss_increase_kib': self.maxrss_increase_kib,
+      'peak_traced_bytes': self.peak_traced_bytes,
+      'children': [child.to_dict() for child in self.children]
+    }
+
+def get_thread_state():
+  """Returns this thread's stack of calls in progress (and its overhead counter)."""
+  if not hasattr(glbl_thread_state, 'stack'):
+    glbl_thread_state.stack = []
+    glbl_thread_state.overhead_seconds = 0.0
+    glbl_thread_state.overhead_bytes_read = 0
+  return glbl_thread_state
+
+def get_bytes_read():
+  """Returns the number of bytes the process has read so far (rchar of
+  /proc/self/io), or None if not available. The bytes of /proc/self/io
+  read here are counted as overhead of this thread."""
+  try:
+    with open(PROC_IO_PATH, 'rb') as f:
+      content = f.read()
+  except OSError:
+    return None
+  get_thread_state().overhead_bytes_read += len(content)
+  for line in content.split(b'\n'):
+    if line.startswith(b'rchar:'):
+      return int(line.split()[1])
+  return None
+
+def get_maxrss_kib():
+  """Returns the peak RSS of the process so far, in KiB (or None)."""
+  if resource is None:
+    return None
+  maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return maxrss // 1024 if os.uname().sysname == 'Darwin' else maxrss
+
+def count_rows(obj, con=None):
+  """Returns the number of rows of the given dataframe/series/list, or of
+  the table with the given name in the database of con, or None. The
+  queries counting the rows of a table are not recorded by the query
+  tracer of con (see db_trace), if it has one."""
+  if hasattr(obj, 'shape') and len(getattr(obj, 'shape')) > 0:
+    return int(obj.shape[0])
+  if isinstance(obj, (list, tuple)):
+    return len(obj)
+  if isinstance(obj, str) and con is not None and hasattr(con, 'execute'):
+    tracer = getattr(con, 'tracer', None)
+    try:
+      with tracer.suspended() if tracer is not None else nullcontext():
+        res = con.execute('''SELECT COUNT(*) FROM (SELECT name FROM sqlite_master UNION ALL SELECT name FROM sqlite_temp_master)
+          WHERE name = ?''', (obj,)).fetchone()
+        if res[0] > 0:
+          return con.execute('SELECT COUNT(*) FROM "' + obj.replace('"', '""') + '"').fetchone()[0]
+    except Exception: # not an sqlite connection, or not a table
+      pass
+  return None
+
+class CallFrame:
+  """A call in progress: its record, and its measurements at its start."""
+  def __init__(self, name):
+    self.record = CallRecord(name)
+    state = get_thread_state()
+    self.start_overhead_seconds = state.overhead_seconds
+    self.start_overhead_bytes_read = state.overhead_bytes_read
+    self.start_bytes_read = get_bytes_read()
+    self.start_maxrss_kib = get_maxrss_kib()
+    self.start_traced_bytes, self.peak_traced_bytes_seen = None, None
+    if glbl_trace_memory and tracemalloc.is_tracing():
+      self.start_traced_bytes, self.peak_traced_bytes_seen = tracemalloc.get_traced_memory()
+      tracemalloc.reset_peak()
+    self.start_time = time.perf_counter()
+
+  def finish(self):
+    """Records the measurements of the call (at its end)."""
+    end_time = time.perf_counter()
+    state = get_thread_state()
+    record = self.record
+    record.seconds = end_time - self.start_time - (state.overhead_seconds - self.start_overhead_seconds)
+    end_overhead_bytes_read = state.overhead_bytes_read
+    end_bytes_read = get_bytes_read()
+    if self.start_bytes_read is not None and end_bytes_read is not None:
+      record.bytes_read = max(0, end_bytes_read - self.start_bytes_read - (end_overhead_bytes_read - self.start_overhead_bytes_read))
+    end_maxrss_kib = get_maxrss_kib()
+    if self.start_maxrss_kib is not None and end_maxrss_kib is not None:
+      record.maxrss_increase_kib = end_maxrss_kib - self.start_maxrss_kib
+    if self.start_traced_bytes is not None and tracemalloc.is_tracing():
+      #tracemalloc has one (global) peak, that children reset: each call
+      #thus keeps the max of its own and its children's peaks
+      peak_traced_bytes = max(tracemalloc.get_traced_memory()[1], self.peak_traced_bytes_seen)
+      record.peak_traced_bytes = max(0, peak_traced_bytes - self.start_traced_bytes)
+      if len(state.stack) > 0:
+        parent = state.stack[-1]
+        if parent.peak_traced_bytes_seen is not None:
+          parent.peak_traced_bytes_seen = max(parent.peak_traced_bytes_seen, peak_traced_bytes)
+
+def push_frame(name):
+  """Starts recording a call with the given name, and returns its frame."""
+  frame = CallFrame(name)
+  get_thread_state().stack.append(frame)
+  return frame
+
+def pop_frame(frame, rows_in_func=None, rows_out_func=None):
+  """Finishes recording the given call (the last one started in this
+  thread), counting its rows in/out with the given functions (after the
+  call's time is measured, with the time they take counted as overhead),
+  and adds its record to its parent's children (or to the records)."""
+  frame.finish()
+  state = get_thread_state()
+  state.stack.pop()
+  if glbl_count_rows and (rows_in_func is not None or rows_out_func is not None):
+    start_time = time.perf_counter()
+    start_overhead_bytes_read = state.overhead_bytes_read
+    start_bytes_read = get_bytes_read()
+    proc_io_bytes_read = state.overhead_bytes_read - start_overhead_bytes_read
+    frame.record.rows_in = rows_in_func() if rows_in_func is not None else None
+    frame.record.rows_out = rows_out_func() if rows_out_func is not None else None
+    end_bytes_read = get_bytes_read()
+    if start_bytes_read is not None and end_bytes_read is not None:
+      #bytes read counting the rows (the read of /proc/self/io is already counted)
+      state.overhead_bytes_read += end_bytes_read - start_bytes_read - proc_io_bytes_read
+    state.overhead_seconds += time.perf_counter() - start_time
+  if len(state.stack) > 0:
+    state.stack[-1].record.children.append(frame.record)
+  else:
+    with glbl_records_lock:
+      glbl_records.append(frame.record)
+
+def get_call_rows_funcs(func, signature, args, kwargs, get_result):
+  """Returns the functions that count the rows in and out of a call of
+  func (see count_rows), from its (bound) arguments and result."""
+  try:
+    bound_args = signature.bind(*args, **kwargs).arguments
+  except TypeError:
+    return None, None
+  con = bound_args.get('con')
+  def rows_in_func():
+    for arg_name in INPUT_TABLE_ARG_NAMES + INPUT_DF_ARG_NAMES:
+      if arg_name in bound_args:
+        return count_rows(bound_args[arg_name], con)
+    return None
+  def rows_out_func():
+    return count_rows(get_result(), con)
+  return rows_in_func, rows_out_func
+
+def instrumented(func=None, name=None):
+  """Decorator that records each call of the function while the
+  instrumentation is enabled (see the module docstring).
+  Param:
+    @func: the function to instrument
+    @name: the name to record its calls under; defaults to
+    <module>.<qualified name of the function>
+  """
+  if func is None:
+    return lambda func: instrumented(func, name)
+  if getattr(func, '__instrumented__', False):
+    return func
+  call_name = name if name is not None else f'{func.__module__}.{func.__qualname__}'
+  signature_holder = []
+
+  @functools.wraps(func)
+  def wrapper(*args, **kwargs):
+    if not glbl_enabled:
+      return func(*args, **kwargs)
+    if len(signature_holder) == 0:
+      try:
+        signature_holder.append(inspect.signature(func))
+      except (TypeError, ValueError):
+        signature_holder.append(None)
+    frame = push_frame(call_name)
+    result_holder = []
+    try:
+      result = func(*args, **kwargs)
+      result_holder.append(result)
+      return result
+    finally:
+      rows_in_func, rows_out_func = None, None
+      if signature_holder[0] is not None:
+        rows_in_func, rows_out_func = get_call_rows_funcs(func, signature_holder[0], args, kwargs,
+          lambda: result_holder[0] if len(result_holder) > 0 else None)
+      pop_frame(frame, rows_in_func, rows_out_func)
+  wrapper.__instrumented__ = True
+  return wrapper
+
+def instrument_module(module, include_classes=True, exclude=[]):
+  """Instruments every public function defined in the given module (and
+  the public methods of its classes, if include_classes), replacing them
+  in the module, so that calls through the module (module.func(...),
+  including from within the module itself) are recorded. Call it at the
+  end of the module: instrument.instrument_module(sys.modules[__name__])
+  Param:
+    @module: the module to instrument
+    @include_classes: whether to also instrument the methods of its classes
+    @exclude: list of the names of functions (or classes) to leave as is,
+    such as small helpers called once per row, that would flood the records
+  """
+  assert isinstance(exclude, list)
+  for (attr_name, attr) in list(vars(module).items()):
+    if attr_name.startswith('_') or attr_name in exclude or getattr(attr, '__module__', None) != module.__name__:
+      continue
+    if inspect.isfunction(attr):
+      setattr(module, attr_name, instrumented(attr))
+    elif include_classes and inspect.isclass(attr):
+      for (method_name, method) in list(vars(attr).items()):
+        #public methods (and __init__), but not static/class methods or properties
+        if (not method_name.startswith('_') or method_name == '__init__') and inspect.isfunction(method):
+          setattr(attr, method_name, instrumented(method))
+
+@contextmanager
+def stage(name, rows_in=None):
+  """Context manager that records the block it wraps as a call with the
+  given name (when enabled). Ex:
+    with instrument.stage('plot bar charts'):
+      ...
+  Param:
+    @name: the name to record the block under
+    @rows_in: the number of rows the block processes, if known
+  """
+  if not glbl_enabled:
+    yield
+    return
+  frame = push_frame(name)
+  try:
+    yield
+  finally:
+    pop_frame(frame, (lambda: rows_in) if rows_in is not None else None)
+
+def patch_pandas():
+  """Replaces pandas' read_sql, read_sql_query and DataFrame.to_sql with
+  instrumented versions (undone by unpatch_pandas)."""
+  import pandas as pd
+  if len(glbl_pandas_originals) > 0:
+    return
+  for (owner, attr_name, call_name) in [
+    (pd, 'read_sql', 'pandas.read_sql'),
+    (pd, 'read_sql_query', 'pandas.read_sql_query'),
+    (pd.DataFrame, 'to_sql', 'pandas.DataFrame.to_sql')
+  ]:
+    original = getattr(owner, attr_name)
+    glbl_pandas_originals[(owner, attr_name)] = original
+    setattr(owner, attr_name, instrumented(original, call_name))
+
+def unpatch_pandas():
+  """Puts back pandas' functions replaced by patch_pandas."""
+  for ((owner, attr_name), original) in glbl_pandas_originals.items():
+    setattr(owner, attr_name, original)
+  glbl_pandas_originals.clear()
+
+def enable(trace_memory=False, count_rows=True, record_pandas=True):
+  """Enables the instrumentation, and starts a new run (clearing the
+  records of the previous one).
+  Param:
+    @trace_memory: whether to trace memory allocations with tracemalloc
+    to record the peak allocated memory of each call (slows down the
+    calls noticeably)
+    @count_rows: whether to count the rows in and out of each call
+    (counting the rows of tables takes a COUNT(*) query; its time is not
+    counted in the calls' times)
+    @record_pandas: whether to also record pandas' read_sql and to_sql
+  """
+  global glbl_enabled, glbl_trace_memory, glbl_count_rows, glbl_run_started_at, glbl_started_tracemalloc
+  reset()
+  glbl_trace_memory = trace_memory
+  glbl_count_rows = count_rows
+  glbl_run_started_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+  if trace_memory and not tracemalloc.is_tracing():
+    tracemalloc.start()
+    glbl_started_tracemalloc = True
+  if record_pandas:
+    patch_pandas()
+  glbl_enabled = True
+
+def disable():
+  """Disables the instrumentation (the records of the run are kept).
+  tracemalloc is only stopped if enable() started it, so tracing started
+  by the caller (such as a benchmark) keeps going."""
+  global glbl_enabled, glbl_started_tracemalloc
+  glbl_enabled = False
+  unpatch_pandas()
+  if glbl_started_tracemalloc:
+    if tracemalloc.is_tracing():
+      tracemalloc.stop()
+    glbl_started_tracemalloc = False
+
+def is_enabled():
+  """Returns whether the instrumentation is enabled."""
+  return glbl_enabled
+
+def reset():
+  """Clears the records of the calls recorded so far."""
+  with glbl_records_lock:
+    glbl_records.clear()
+
+def get_totals(records=None):
+  """Returns a dictionary of each recorded name to its number of calls,
+  total time, and total self time (excluding children), over all
+  (nested) records, sorted by total self time (descending)."""
+  records = glbl_records if records is None else records
+  dict_totals = {}
+  def add_record(record):
+    totals = dict_totals.setdefault(record.name, {'calls': 0, 'seconds': 0.0, 'self_seconds': 0.0})
+    totals['calls'] += 1
+    totals['seconds'] += record.seconds
+    totals['self_seconds'] += record.get_self_seconds()
+    for child in record.children:
+      add_record(child)
+  for record in records:
+    add_record(record)
+  return dict(sorted(dict_totals.items(), key=lambda item: item[1]['self_seconds'], reverse=True))
+
+def get_report():
+  """Returns the report of the run, as a json-serializable dictionary
+  with the tree of recorded calls ('calls') and the totals per name
+  ('totals', see get_totals)."""
+  with glbl_records_lock:
+    records = list(glbl_records)
+  return {
+    'run_started_at': glbl_run_started_at,
+    'trace_memory': glbl_trace_memory,
+    'calls': [record.to_dict() for record in records],
+    'totals': get_totals(records)
+  }
+
+def dump_json(path):
+  """Writes the report of the run (see get_report) to a .json file."""
+  with open(path, 'w') as f:
+    json.dump(get_report(), f, indent=2)
+
+def get_folded_stacks():
+  """Returns the lines of the run's calls in the folded stack format
+  (as read by flamegraph.pl, speedscope, ...): the semicolon-separated
+  names of the calls of a stack, then its self time in microseconds."""
+  dict_stack_us = {}
+  def add_record(record, parent_stack):
+    stack = f'{parent_stack};{record.name}' if parent_stack else record.name
+    dict_stack_us[stack] = dict_stack_us.get(stack, 0) + int(round(record.get_self_seconds() * 1e6))
+    for child in record.children:
+      add_record(child, stack)
+  with glbl_records_lock:
+    for record in glbl_records:
+      add_record(record, '')
+  return [f'{stack} {us}' for (stack, us) in dict_stack_us.items()]
+
+def dump_folded_stacks(path):
+  """Writes the run's calls to a file in the folded stack format (see
+  get_folded_stacks)."""
+  with open(path, 'w') as f:
+    f.write('\n'.join(get_folded_stacks()) + '\n')
+
+if os.environ.get(ENV_VAR, '') not in ['', '0']:
+  enable()
@@ -1,9 +1,7 @@
-import sqlite3 as sl
-import matplotlib
 import pandas as pd
 from wine_stat import freq, vis, common_stat # named it wine_stat so that it doesn't override python's stat package
 from data_cleaning import data_cleaning
-from database import db_constants
+from database import db_constants, db_index, db_conn, db_trace, instrument
 
 #constants
 WINE_INIT_DB_NAME = db_constants.WINE_INIT_DB_NAME # needs to end in .db
@@ -11,14 +9,45 @@ WINE_INIT_PATH_TO_DB = 'database/' + WINE_INIT_DB_NAME
 WINE_INIT_TABLE_NAME = db_constants.WINE_INIT_TABLE_NAME
 WINE_DATA_FILE = db_constants.WINE_DATA_FILE
 WINE_DATA_PATH = 'data/' + WINE_DATA_FILE
+#dimensions (hierarchy of country -> province -> region_1, and variety)
+#and measures of the cube of statistics the grouped statistics tables
+#are served from
+STATS_CUBE_DIMS = ['country', 'province', 'region_1', 'variety']
+STATS_CUBE_MEASURES = ['price', 'points']
+#groupings (measure, columns grouped by) of the tables of statistics the
+#bar charts of plot_price_grouping_bar_charts are plotted from
+STATS_GROUPINGS = [
+  ('price', ['country']),
+  ('price', ['variety']),
+  ('points', ['variety']),
+  ('price', ['region_1']),
+  ('price', ['province']),
+  ('price', ['country', 'province', 'region_1'])
+]
 
 #helpers
 def get_db(cur=None, con=None):
+  """Returns the database vars, using the shared writer connection
+  to the wine init database if no connection is passed."""
   #database vars
-  con = con if con else sl.connect(WINE_INIT_PATH_TO_DB)
+  con = con if con else db_conn.get_manager(WINE_INIT_PATH_TO_DB).get_writer()
   cur = cur if cur else con.cursor()
   return (con, cur)
 
+def get_read_db():
+  """Returns a context manager for a pooled read-only connection to the
+  wine init database, for running analyses (in any thread) while the
+  writer connection from get_db rebuilds tables. Ex:
+    with get_read_db() as con:
+      common_stat.get_num_rows_in_table(con.cursor(), con, WINE_INIT_TABLE_NAME)
+  """
+  return db_conn.get_manager(WINE_INIT_PATH_TO_DB).reader()
+
+def get_stats_cube(cur, con):
+  """Returns the cube of price and points statistics of the wine init
+  table (see common_stat.StatsCube), built from one scan of it."""
+  return common_stat.StatsCube(STATS_CUBE_DIMS, STATS_CUBE_MEASURES).build(cur, con, WINE_INIT_TABLE_NAME)
+
 #testing:
 def test_num_rows(cur):
   """Test number of rows in initial wine database.
@@ -39,26 +68,10 @@ def set_freq_tables(cur=None, con=None, testing=True):
   """
   #database vars
   con, cur = get_db(cur, con)
-  #set frequency of countries
-  freq.set_db_freq_country(cur, con, WINE_INIT_TABLE_NAME, testing=testing)
-  #set frequency of desginations
-  freq.set_db_freq_desig(cur, con, WINE_INIT_TABLE_NAME, testing=testing)
-  #set frequency of points
-  freq.set_db_freq_points(cur, con, WINE_INIT_TABLE_NAME, testing=testing)
-  #set frequency of provinces
-  freq.set_db_freq_province(cur, con, WINE_INIT_TABLE_NAME, testing=testing)
-  #set frequency of region1
-  freq.set_db_freq_region1(cur, con, WINE_INIT_TABLE_NAME, testing=testing)
-  #set frequency of region2
-  freq.set_db_freq_region2(cur, con, WINE_INIT_TABLE_NAME, testing=testing)
-  #set frequency of taster_name
-  freq.set_db_freq_taster(cur, con, WINE_INIT_TABLE_NAME, testing=testing)
-  #set frequency of taster_twitter_handle
-  freq.set_db_freq_taster_twtr(cur, con, WINE_INIT_TABLE_NAME, testing=testing)
-  #set frequency of wine 'variety'
-  freq.set_db_freq_variety(cur, con, WINE_INIT_TABLE_NAME, testing=testing)
-  #set frequency of wine 'winery'
-  freq.set_db_freq_winery(cur, con, WINE_INIT_TABLE_NAME, testing=testing)
+  #set frequency of countries, desginations, points, provinces, region1,
+  #region2, taster_name, taster_twitter_handle, wine 'variety' and wine
+  #'winery', all from one scan of the wine table
+  freq.set_db_freq_tables(cur, con, WINE_INIT_TABLE_NAME, freq.FREQ_TABLE_SPECS, testing=testing)
 
 def get_top_ns_tables_for_n(cur=None, con=None, n=5):
   """Create top n tables from frequencies for
@@ -81,16 +94,27 @@ def get_top_ns_tables(cur=None, con=None, n_list=[5]):
   assert isinstance(n_list, list) or isinstance(n_list, int)
   #make as list if just a single entry passed
   n_list = [n_list] if isinstance(n_list, int) else n_list
-  for n_i in n_list:
-    get_top_ns_tables_for_n(cur, con, n_i)
+  #database vars
+  con, cur = get_db(cur, con)
+  #reads each frequency table once for all of the n_i's
+  freq.get_top_ns_rows_of_each_freq_table(cur, con, n_list)
 
-def plot_price_grouping_bar_charts(cur, con):
+def plot_price_grouping_bar_charts(cur, con, stats_cube=None):
   """Displays bar charts for various hard-coded column names
   given below. These are obtained by grouping by one or more
-  other columns."""
+  other columns.
+  Param:
+    @cur, con: database vars
+    @stats_cube: the cube of statistics to create the tables of
+    statistics plotted from (see get_stats_cube); built if None
+  """
+  #create the tables of statistics of all of the groupings plotted
+  #below (and for price grouped by country, province and region_1)
+  #as slices of the cube, rather than aggregating the wine table for each
+  stats_cube = get_stats_cube(cur, con) if stats_cube is None else stats_cube
+  for (measure, dims) in STATS_GROUPINGS:
+    stats_cube.write_slice(cur, con, measure, dims)
   #plot bar chart for average price grouped by country
-  common_stat.get_basic_stats_of_col1_grouped_by_cols(cur, con, 
-  'price', ['country'], db_constants.WINE_INIT_TABLE_NAME)
   vis.plot_bar_chart(
     cur, 
     con, 
@@ -101,8 +125,6 @@ def plot_price_grouping_bar_charts(cur, con):
     p_title='Average Price of Wine By Country'
   )
   #plot bar chart for average price grouped by variety
-  common_stat.get_basic_stats_of_col1_grouped_by_cols(cur, con, 
-  'price', ['variety'], db_constants.WINE_INIT_TABLE_NAME)
   vis.plot_bar_chart(
     cur, 
     con, 
@@ -114,8 +136,6 @@ def plot_price_grouping_bar_charts(cur, con):
     p_title='Average Price of Wine By Variety'
   )
   #plot bar chart for average points grouped by variety
-  common_stat.get_basic_stats_of_col1_grouped_by_cols(cur, con, 
-  'points', ['variety'], db_constants.WINE_INIT_TABLE_NAME)
   vis.plot_bar_chart(
     cur, 
     con, 
@@ -127,8 +147,6 @@ def plot_price_grouping_bar_charts(cur, con):
     p_title='Average Points of Wine By Variety'
   )
   #plot bar chart for average price grouped by region_1
-  common_stat.get_basic_stats_of_col1_grouped_by_cols(cur, con, 
-    'price', ['region_1'], db_constants.WINE_INIT_TABLE_NAME)
   vis.plot_bar_chart(
     cur, 
     con, 
@@ -140,8 +158,6 @@ def plot_price_grouping_bar_charts(cur, con):
     p_title='Average Price of Wine By Region1'
   )
   #plot bar chart for average price grouped by province
-  common_stat.get_basic_stats_of_col1_grouped_by_cols(cur, con, 
-    'price', ['province'], db_constants.WINE_INIT_TABLE_NAME)
   vis.plot_bar_chart(
     cur, 
     con, 
@@ -152,43 +168,66 @@ def plot_price_grouping_bar_charts(cur, con):
     y_axis_description='Mean price in $',
     p_title='Average Price of Wine By Province'
   )
-  #create table for average price grouped by country and province
-  common_stat.get_basic_stats_of_col1_grouped_by_cols(cur, con, 
-  'price', ['country', 'province', 'region_1'], db_constants.WINE_INIT_TABLE_NAME)
 
 
 
 # if __name__ == "__main__":
-def init():
-  con, cur = get_db(cur=None, con=None) #don't yet have connection to database
-  #initialize database with overall wine data table with 
-  data_cleaning.init_wine_table_with_null_cleaning(cur, con)
+def init(streaming_ingest=False, report_path=None, query_report_path=None):
+  """Initializes the database and its tables.
+  Param:
+    @streaming_ingest: if True, then the wine data is streamed into the
+    database in chunks (bounded memory) rather than loaded all at once.
+    @report_path: if given, then each stage of the initialization is
+    instrumented (see database/instrument.py), and the report is written
+    to <report_path>.json and <report_path>.folded (flame graph stacks).
+    @query_report_path: if given, then the sql statements run on the
+    shared connections are traced (see database/db_trace.py), and their
+    report is printed and written to this .json file.
+  """
+  if report_path is not None:
+    instrument.enable()
+  manager = db_conn.get_manager(WINE_INIT_PATH_TO_DB)
+  if query_report_path is not None:
+    manager.set_tracer(db_trace.QueryTracer())
+  try:
+    with instrument.stage('init.init'):
+      con, cur = get_db(cur=None, con=None) #don't yet have connection to database
+      #initialize database with overall wine data table with 
+      data_cleaning.init_wine_table_with_null_cleaning(cur, con, streaming=streaming_ingest)
+      #index the columns the analyses group and filter the table by
+      db_index.create_indexes(cur, con, WINE_INIT_TABLE_NAME)
 
-  out_table = common_stat.get_basic_stats_of_col1_grouped_by_cols(
-    cur,
-    con,
-    'price',
-    cols_to_group_by=['country', 'province', 'region_1']
-  )
-  common_stat.get_table_recurs_limit_grouped_by(
-    cur,
-    con,
-    input_table_name=out_table,
-    col_of_scores='mean',
-    cols_to_group_by=['country', 'province', 'region_1'],
-    col_limits=[3, 2, 3],
-    keep_duplicates=[True, True, True],
-    sort_by_ascending=False
-  )
-  res_table_name = common_stat.get_table_recurs_limit_grouped_by(
-    cur,
-    con,
-    input_table_name=out_table,
-    col_of_scores='mean',
-    cols_to_group_by=['country', 'province', 'region_1'],
-    col_limits=[3, 2, 2],
-    keep_duplicates=[True, False, False],
-    sort_by_ascending=False
-  )
-  cols_to_group_by = ['country', 'province', 'region_1']
+      stats_cube = get_stats_cube(cur, con)
+      out_table = stats_cube.write_slice(cur, con, 'price', ['country', 'province', 'region_1'])
+      common_stat.get_table_recurs_limit_grouped_by(
+        cur,
+        con,
+        input_table_name=out_table,
+        col_of_scores='mean',
+        cols_to_group_by=['country', 'province', 'region_1'],
+        col_limits=[3, 2, 3],
+        keep_duplicates=[True, True, True],
+        sort_by_ascending=False
+      )
+      res_table_name = common_stat.get_table_recurs_limit_grouped_by(
+        cur,
+        con,
+        input_table_name=out_table,
+        col_of_scores='mean',
+        cols_to_group_by=['country', 'province', 'region_1'],
+        col_limits=[3, 2, 2],
+        keep_duplicates=[True, False, False],
+        sort_by_ascending=False
+      )
+      cols_to_group_by = ['country', 'province', 'region_1']
+  finally:
+    if report_path is not None:
+      instrument.disable()
+      instrument.dump_json(report_path + '.json')
+      instrument.dump_folded_stacks(report_path + '.folded')
+    if query_report_path is not None:
+      tracer = manager.tracer
+      manager.set_tracer(None)
+      tracer.print_report()
+      tracer.dump_json(query_report_path)
   return cur, con
\ No newline at end of file
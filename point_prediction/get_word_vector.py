@@ -3,6 +3,52 @@ import numpy as np
 import json
 import re
 from tqdm import tqdm
+def clean_description(description):
+    '''
+    clean a description string into its list of lowercase words
+    input : description
+    output: list of words, without punctuation
+    '''
+    # remove punctuation
+    r = '[’!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~\n。！，]+'
+    text1=str(description)
+    text1 = text1.replace('\n', '')
+    text1 = text1.replace('<br /><br />', ' ')
+    text1 = re.sub(r, '', text1)
+    text1 = text1.split(' ')
+    return [text1[i].lower() for i in range(len(text1)) if text1[i] != '']
+
+def get_sentence_vectors(sentences, vocabulary_vectors, word_list, max_len=30, dim=50):
+    '''
+    represent each sentence by the word vectors of its first max_len words
+    input : sentences: list of lists of words
+            vocabulary_vectors: glove vectors, one row per word of word_list
+            word_list: list of the words of the vocabulary
+            max_len: number of words per sentence (padded with zero vectors)
+            dim: dimension of word vector
+    output: list of the max_len word vectors of each sentence; words not in
+            the vocabulary get the vector of its last word
+    '''
+    unknown_index = len(word_list) - 1
+    word_vector=[]
+    for sentence in tqdm(sentences):
+        temp = []
+        index = 0
+        for j in range(len(sentence)):
+            try:
+                index = word_list.index(sentence[j])
+            except ValueError:
+                index = unknown_index
+            finally:
+                temp.append(list(vocabulary_vectors[index]))
+        if len(temp) < max_len:
+            for k in range(len(temp), max_len):
+                temp.append([0]*dim)
+        else:
+            temp = temp[0:max_len]
+        word_vector.append(temp)
+    return word_vector
+
 def load_word():
     '''
     load description and cleaning the string
@@ -19,14 +65,7 @@ def load_word():
         if data["description"]==None:
             continue
         label=int(data["points"])
-        # remove punctuation
-        r = '[’!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~\n。！，]+'
-        text1=str(data["description"])
-        text1 = text1.replace('\n', '')
-        text1 = text1.replace('<br /><br />', ' ')
-        text1 = re.sub(r, '', text1)
-        text1 = text1.split(' ')
-        text1 = [text1[i].lower() for i in range(len(text1)) if text1[i] != '']
+        text1 = clean_description(data["description"])
         words_list.append([text1, label])
         l+=len(text1)
         count+=1
@@ -48,30 +87,10 @@ def get_word_vector(vocabulary_path,word_list_path,dim):
     word_list = np.load(word_list_path, allow_pickle=True)
     word_list = word_list.tolist()
     data = load_word()
-    word_vector=[]
-    labels=[]
-    count=0
-    for i in tqdm(range(len(data))):
-        sentence = data[i][0]
-        labels.append(data[i][1])
-        temp = []
-        index = 0
-        for j in range(len(sentence)):
-            try:
-                index = word_list.index(sentence[j])
-            except ValueError:
-                index = 399999
-            finally:
-                temp.append(list(vocabulary_vectors[index]))
-        if len(temp) < 30:
-            for k in range(len(temp), 30):
-                temp.append([0]*50)
-        else:
-            temp = temp[0:30]
-        word_vector.append(temp)
-        count+=1
-        if count>90000:
-            break
+    #only the first 90001 descriptions are used
+    data = data[:90001]
+    labels = [data[i][1] for i in range(len(data))]
+    word_vector = get_sentence_vectors([data[i][0] for i in range(len(data))], vocabulary_vectors, word_list, 30, dim)
     np.save('data/train_data_269'+str(dim), np.array(word_vector[:int(len(word_vector)*0.8)]))
     np.save('data/train_label_269'+str(dim), np.array(labels[:int(len(word_vector)*0.8)]))
     np.save('data/test_data_269' + str(dim), np.array(word_vector[int(len(word_vector)*0.8):]))
@@ -0,0 +1,81 @@
+import sqlite3 as sl
+import numpy as np
+import pandas as pd
+import pytest
+from database import db_constants, db_op, db_columnar
+from wine_stat import null_info, common_stat
+
+"""Smoke check of the columnar backend (see database/db_columnar.py): a
+small database is exported to a store, and the null profile, the
+StatsCube slices and read_table (with where, order_by and limit) are
+checked to give the same results on both backends. Run from the top
+level of the repo:
+  python -m pytest tests
+Skipped if pyarrow is not installed.
+"""
+
+#constants
+NUM_ROWS = 500
+TABLE_NAME = db_constants.WINE_INIT_TABLE_NAME
+DIMS = ['country', 'variety']
+MEASURES = ['price', 'points']
+
+pytest.importorskip('pyarrow')
+
+def get_wine_df(num_rows=NUM_ROWS, seed=0):
+  """Returns a small dataframe shaped like the wine init table, with
+  nulls in its text and price columns."""
+  rng = np.random.default_rng(seed)
+  df = pd.DataFrame({
+    'country': rng.choice(['US', 'France', 'Italy', 'Chile'], num_rows).astype(object),
+    'variety': rng.choice(['Merlot', 'Riesling', 'Syrah'], num_rows).astype(object),
+    'winery': rng.choice(['A', 'B', 'C', 'D', 'E'], num_rows).astype(object),
+    'points': rng.integers(80, 101, num_rows),
+    'price': rng.integers(5, 200, num_rows).astype(float)
+  })
+  df.loc[rng.random(num_rows) < 0.1, 'country'] = None
+  df.loc[rng.random(num_rows) < 0.2, 'winery'] = None
+  df.loc[rng.random(num_rows) < 0.15, 'price'] = np.nan
+  return df
+
+@pytest.fixture(scope='module')
+def backends(tmp_path_factory):
+  """Returns a tuple of the (cur, con) of a small sqlite database with the
+  wine init table, and a ColumnarStore it was exported to."""
+  con = sl.connect(str(tmp_path_factory.mktemp('sqlite') / 'wine.db'))
+  cur = con.cursor()
+  get_wine_df().to_sql(TABLE_NAME, con)
+  store = db_columnar.ColumnarStore(str(tmp_path_factory.mktemp('columnar')))
+  db_columnar.export_tables(cur, con, store, [TABLE_NAME])
+  yield (cur, con, store)
+  con.close()
+
+def test_null_profile(backends):
+  cur, con, store = backends
+  sqlite_profile = null_info.get_null_profile(cur, con, TABLE_NAME)
+  store_profile = null_info.get_null_profile(None, store, TABLE_NAME)
+  assert store_profile.num_rows == sqlite_profile.num_rows == NUM_ROWS
+  assert store_profile.dict_num_nulls_in_each_col == sqlite_profile.dict_num_nulls_in_each_col
+  assert store_profile.num_fully_non_null_rows == sqlite_profile.num_fully_non_null_rows
+
+@pytest.mark.parametrize('measure, dims', [('price', ['country']), ('points', ['variety']), ('price', DIMS)])
+def test_stats_cube_slices(backends, measure, dims):
+  cur, con, store = backends
+  sqlite_slice = common_stat.StatsCube(DIMS, MEASURES).build(cur, con, TABLE_NAME).get_slice(measure, dims)
+  store_slice = common_stat.StatsCube(DIMS, MEASURES).build(None, store, TABLE_NAME).get_slice(measure, dims)
+  pd.testing.assert_frame_equal(store_slice, sqlite_slice, check_dtype=False)
+
+def test_read_table_where_order_by_limit(backends):
+  cur, con, store = backends
+  kwargs = {
+    'cols': ['country', 'winery', 'price'],
+    'where': [('country', 'in', ['US', 'France']), ('price', '>=', 20)],
+    #(ending with the index, so that the order, and thus the rows kept, are the same)
+    'order_by': [('winery', True), ('price', False), ('index', True)],
+    'limit': 50
+  }
+  sqlite_df = db_op.read_table(cur, con, TABLE_NAME, **kwargs)
+  store_df = db_op.read_table(None, store, TABLE_NAME, **kwargs)
+  assert len(sqlite_df) == 50
+  pd.testing.assert_frame_equal(store_df.astype(object).where(store_df.notna(), None),
+    sqlite_df.astype(object).where(sqlite_df.notna(), None))
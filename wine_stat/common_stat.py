@@ -1,11 +1,47 @@
+import sys
+import time
+import numpy as np
 import pandas as pd
-from database import db_constants
+from database import db_constants, db_op, db_catalog, db_columnar, instrument
+from wine_stat import sketches
 from collections import defaultdict
 
 """A general-purpose statistics module,
 and other basic operations (like number
 of rows in table)."""
 
+#statistics (by their pandas names) that sqlite can compute itself,
+#as the sql expression to compute each on a column
+SQL_AGGREGATES = {
+  'count': 'COUNT({})',
+  'sum': 'SUM({})',
+  'min': 'MIN({})',
+  'max': 'MAX({})',
+  'mean': 'AVG({})'
+}
+#statistics (by their pandas names) that sqlite computes with a window
+#function pass over the rows of each group, as the sql expression to
+#compute each on a column. Within a group, _rn is the rank of the row by
+#the column (nulls last), _cnt the number of non-null values and _mean
+#their mean. As in pandas, std and var are the sample ones (ddof=1).
+SQL_WINDOW_AGGREGATES = {
+  'median': 'AVG(CASE WHEN _rn IN ((_cnt + 1) / 2, (_cnt + 2) / 2) THEN {} END)',
+  'var': 'SUM(({0} - _mean) * ({0} - _mean)) / (_cnt - 1)',
+  'std': 'sqrt(SUM(({0} - _mean) * ({0} - _mean)) / (_cnt - 1))'
+}
+#engines to compute grouped basic statistics with
+STATS_ENGINE_SQL = 'sql' #inside sqlite (falls back to pandas for other statistics)
+STATS_ENGINE_PANDAS = 'pandas' #read the needed columns into pandas
+#modes of the distinct count profiler (see get_distinct_count_profile)
+DISTINCT_MODE_EXACT = 'exact' #sets of each column's distinct values
+DISTINCT_MODE_APPROX = 'approx' #HyperLogLog sketches (bounded memory)
+DISTINCT_CHUNK_SIZE = 100000 #number of rows read at a time when profiling
+#statistics (by their pandas names) a StatsCube can compute
+CUBE_STATS = ['count', 'sum', 'min', 'max', 'mean', 'median', 'std', 'var']
+#cells of a StatsCube with at most this many values of a measure keep them,
+#so that groups of these cells get exact medians (see StatsCube.get_slice)
+CUBE_EXACT_MEDIAN_MAX_COUNT = 64
+
 def counts(df_col):
     """
     Helper function for counts_table.
@@ -53,7 +89,7 @@ def counts_table(df, col_name, common_filter=0):
     
     common_words = set([i[0] for i in counts(df[col_name])[:common_filter] ])
     
-    return df.groupby('points_range')[col_name].apply(lambda x: counts(x)).apply(lambda x: [i for i in x if i[0] not in common_words])
+    return df.groupby('points_range', observed=True)[col_name].apply(lambda x: counts(x)).apply(lambda x: [i for i in x if i[0] not in common_words])
 
 def get_num_rows_in_table(cur, con, table_name):
   """Gets the number of rows in the given table with name
@@ -63,6 +99,8 @@ def get_num_rows_in_table(cur, con, table_name):
     @cur, con: database connection vars
     @table_name: name of the table to return the number of rows of
   """
+  if db_columnar.is_columnar_store(con):
+    return db_op.get_num_rows(cur, con, table_name)
   COUNT_COL_RES_NAME = "COUNT_COL"
   pd_table = pd.read_sql(f'SELECT COUNT(*) AS {COUNT_COL_RES_NAME} FROM {table_name}', con)
   total_count = pd_table[COUNT_COL_RES_NAME][0]
@@ -77,6 +115,8 @@ def get_num_unique_rows_in_column(cur, con, table_name, col_name):
    @table_name: name of the table to use
    @col_name: column in table to se
   """
+  if db_columnar.is_columnar_store(con):
+    return get_distinct_count_profile(cur, con, table_name, [col_name])[col_name]
   COUNT_DISTINCT_COL_RSE_NAME = "COUNT_COL_DISTINCT"
   pd_table = pd.read_sql(f'SELECT COUNT(DISTINCT {col_name}) AS {COUNT_DISTINCT_COL_RSE_NAME} FROM {table_name}', con)
   total_distinct_count = pd_table[COUNT_DISTINCT_COL_RSE_NAME][0]
@@ -86,21 +126,73 @@ def get_num_uniq_rows_for_each_col_in_table(cur, con, table_name):
   """Gets the number of non=null distinct/unique rows for
   each column in that table; returns this as a dictionary
   with the keys as column names and the values as these
-  counts.
+  counts. The counts are exact, and are all gathered from
+  one scan of the table (see get_distinct_count_profile).
   Param:
     @cur, con: database vars
     @table_name: the name of the table to get the number
     of unique entries in each column for
   """ 
-  pd_table = pd.read_sql(f'SELECT * FROM {table_name}', con)
-  pd_table.set_index('index')
-  col_names = list(pd_table.columns.values)
-  dict_uniq_row_counts = {}
-  for col_name in col_names:
-    if col_name != 'index': # don't count values for index column
-      dict_uniq_row_counts[col_name] = get_num_unique_rows_in_column(cur,
-        con, table_name, col_name)
-  return dict_uniq_row_counts
+  return get_distinct_count_profile(cur, con, table_name, mode=DISTINCT_MODE_EXACT)
+
+def get_distinct_count_profile(cur, con, table_name, cols=None, mode=DISTINCT_MODE_EXACT,
+  chunksize=DISTINCT_CHUNK_SIZE, precision=sketches.HLL_PRECISION, store_sketches=False):
+  """Counts the number of non-null distinct values of each of the given
+  columns of the table, reading the table once, chunksize rows at a time.
+  Param:
+    @cur, con: database vars
+    @table_name: the name of the table to profile
+    @cols: list of the columns to count the distinct values of; all
+    of them but the index column if None
+    @mode: DISTINCT_MODE_EXACT to count them exactly, keeping a set of
+    the distinct values of each column (the uniques of each chunk are
+    found by factorizing it), or DISTINCT_MODE_APPROX to estimate them
+    with a HyperLogLog sketch per column (see sketches.py), which takes
+    2**precision bytes per column however many distinct values there
+    are. The sketches of each chunk are merged into those of the table.
+    @chunksize: number of rows to read at a time
+    @precision: precision of the HyperLogLog sketches (approx mode)
+    @store_sketches: (approx mode) whether to store the sketches in the
+    database's catalog (see db_catalog.store_sketches), so that they can
+    be read back with get_stored_distinct_count_sketches
+  Returns a dictionary of each column name to its (estimated) number
+  of distinct values.
+  """
+  assert isinstance(table_name, str)
+  assert cols is None or isinstance(cols, list)
+  assert mode in [DISTINCT_MODE_EXACT, DISTINCT_MODE_APPROX]
+  assert isinstance(chunksize, int)
+  assert chunksize > 0
+  assert isinstance(store_sketches, bool)
+  cols = [col for col in db_op.get_table_col_names(cur, con, table_name) if col != 'index'] if cols is None else cols
+  assert len(cols) > 0
+  if mode == DISTINCT_MODE_EXACT:
+    dict_distinct_values = {col: set() for col in cols}
+  else:
+    dict_sketches = {col: sketches.HyperLogLog(precision) for col in cols}
+  for df_chunk in db_op.read_table_chunks(cur, con, table_name, cols, chunksize):
+    for col in cols:
+      if mode == DISTINCT_MODE_EXACT:
+        #tolist gives python values, so equal ints and floats are one value
+        dict_distinct_values[col].update(pd.factorize(df_chunk[col])[1].tolist())
+      else:
+        chunk_sketch = sketches.HyperLogLog(precision)
+        chunk_sketch.add(df_chunk[col])
+        dict_sketches[col].merge(chunk_sketch)
+  if mode == DISTINCT_MODE_EXACT:
+    return {col: len(distinct_values) for (col, distinct_values) in dict_distinct_values.items()}
+  if store_sketches:
+    db_catalog.store_sketches(cur, con, table_name, db_catalog.SKETCH_KIND_HLL,
+      {col: sketch.to_bytes() for (col, sketch) in dict_sketches.items()}, {'precision': precision})
+  return {col: sketch.count() for (col, sketch) in dict_sketches.items()}
+
+def get_stored_distinct_count_sketches(cur, con, table_name):
+  """Returns a dictionary of the column names of the given table to
+  their HyperLogLog sketches stored by get_distinct_count_profile
+  (empty if none are stored). These can be merged with the sketches
+  of new rows of the table, instead of profiling it all again."""
+  return {col: sketches.HyperLogLog.from_bytes(sketch_bytes, params['precision'])
+    for (col, (sketch_bytes, params)) in db_catalog.get_sketches(cur, con, table_name, db_catalog.SKETCH_KIND_HLL).items()}
 
 def concat_str_columns(cur, con, table_name,
   cols_to_concat):
@@ -125,18 +217,22 @@ def concat_str_columns(cur, con, table_name,
     assert isinstance(col, str)
   col_name_res = "strconcat-" + '-'.join(cols_to_concat)
   table_name_res = f'{table_name}-{col_name_res}'
-  new_pd_table = pd.read_sql(f'SELECT * FROM {table_name}', con)
-  new_pd_table[col_name_res] = ""
-  first_el = True
-  for col in cols_to_concat:
-    hyphen_str = "" if first_el else "-"
-    first_el = False
-    new_pd_table[col_name_res] += hyphen_str + new_pd_table[col]
-    #remove just-concatenated column from table
-    new_pd_table = new_pd_table.drop(columns=[col])
-  new_pd_table = new_pd_table.set_index('index') #restore index
+  #select all other columns (in their order in the table), followed
+  #by the concatenated column
+  cols_to_keep = [col for col in db_op.get_table_col_names(cur, con, table_name) if col not in cols_to_concat]
+  concat_expr_str = " || '-' || ".join([db_op.quote_identifier(col) for col in cols_to_concat])
+  select_strs = [db_op.quote_identifier(col) for col in cols_to_keep] + [f'{concat_expr_str} AS {db_op.quote_identifier(col_name_res)}']
+  query_str = f'SELECT {", ".join(select_strs)} FROM {db_op.quote_identifier(table_name)}'
   #write resulting table to database
-  new_pd_table.to_sql(table_name_res, con, if_exists='replace')
+  if db_columnar.is_columnar_store(con):
+    df = db_op.read_table(cur, con, table_name)
+    df_res = df[cols_to_keep].assign(**{col_name_res: df[cols_to_concat[0]].str.cat(
+      [df[col] for col in cols_to_concat[1:]], sep='-') if len(cols_to_concat) > 1 else df[cols_to_concat[0]]})
+    db_op.write_table(cur, con, table_name_res, df_res, index=False)
+  else:
+    db_op.create_table_as(cur, con, table_name_res, query_str)
+  db_catalog.register_table(cur, con, table_name_res, db_catalog.KIND_STR_CONCAT, table_name,
+    {'cols_to_concat': cols_to_concat})
   return table_name_res
 
 def get_table_recurs_limit_grouped_by(
@@ -348,8 +444,7 @@ def get_table_recurs_limit_grouped_by(
   assert isinstance(sort_by_ascending, bool)
   assert isinstance(res_table_suffix, str)
   #assert columns exist in input table
-  df = pd.read_sql(f'SELECT * FROM {input_table_name}', con)
-  set_of_col_names = set(list(df.columns))
+  set_of_col_names = set(db_op.get_table_col_names(cur, con, input_table_name))
   for col in cols_to_group_by:
     assert col in set_of_col_names
   assert col_of_scores in set_of_col_names
@@ -358,49 +453,12 @@ def get_table_recurs_limit_grouped_by(
   # cols_to_group_by col_of_scores
   #from left to right. This will thus also
   #be the order of columns for the resulting table.
-  # build query string
-  query_str = f'SELECT {cols_to_group_by[0]}'
-  for col_to_group_by in cols_to_group_by[1:]:
-    query_str += f', {col_to_group_by}'
-  query_str += f', {col_of_scores}'
-  query_str += f' FROM {input_table_name}'
-  # get table and process per parameters
-  df = pd.read_sql(query_str, con)
-  df = df.sort_values(by=col_of_scores, ascending=sort_by_ascending)
-  first_res_col_name, first_col_limit = cols_to_group_by[0], col_limits[0]
-  if(keep_duplicates[0]==False):
-    #drop duplicates in first column
-    df = df.drop_duplicates(subset=[first_res_col_name])
-  # only keep entries in first col that have at least
-  # one row that they are in that is within the
-  # col_limits[0]th topmost/bottomost entries
-  # (top if sort_by_ascending==True, else
-  # bottom). df2 stores the names of these entries of the first column.
-  df2 = df.groupby(first_res_col_name)[col_of_scores].max().to_frame()
-  # make sure still sorted by col_of_scores, and grab
-  # number of rows given by first limit specified in col_limits
-  df2 = df2.sort_values(by=col_of_scores, ascending=False).head(first_col_limit)
-  # restrict to only those with that topmost/bottomost col_limits[0]th
-  # entries in overall dataframe (df) being used here.
-  df = df[df[first_res_col_name].isin(df2.index.to_frame()[first_res_col_name])]
-
-  #for each subsequent index (>= 1) in col_limits and keep_duplicates,
-  #further restrict the table, going to its right.
-  subsets_cols_to_group_by = [cols_to_group_by[0:(i+1)] for i in range(len(cols_to_group_by))]
-  #subset list to group by at any given iteration is always at index one greater
-  #than subset list for droping duplicates
-  for ind in range(len(cols_to_group_by[1:])):
-    keep_duplicates_in_cur_col = keep_duplicates[ind+1]
-    cur_cols_duplicate_list = subsets_cols_to_group_by[ind+1]
-    cur_cols_group_by_list = subsets_cols_to_group_by[ind]
-    cur_limit = col_limits[ind+1]
-    if not(keep_duplicates_in_cur_col):
-      #drop duplicates in current column
-      df = df.drop_duplicates(subset=cur_cols_duplicate_list)
-    #limit number of entries in column by highest/lowest num groupings,
-    #given by cur_limit
-    df.groupby(by=cur_cols_group_by_list, group_keys=False).head(cur_limit)
-  
+  df = db_op.read_table(cur, con, input_table_name, cols_to_group_by + [col_of_scores],
+    dtypes=db_op.get_compact_dtypes(cols_to_group_by))
+  df = limit_sorted_hierarchy(
+    df.sort_values(by=col_of_scores, ascending=sort_by_ascending, kind='stable'),
+    cols_to_group_by, col_limits, keep_duplicates)
+
   #construct resulting table name
   res_table_name = f'{input_table_name}_grouped_by_'
   cols_limited_as_strs = [str(i) for i in col_limits]
@@ -409,13 +467,51 @@ def get_table_recurs_limit_grouped_by(
   res_table_name += cols_delimited_with_eqs_as_str
   res_table_name += res_table_suffix #add suffix
   #write resulting table to database, and return its table name
-  df.to_sql(res_table_name, con, if_exists='replace')
+  db_op.write_table(cur, con, res_table_name, df)
+  db_catalog.register_table(cur, con, res_table_name, db_catalog.KIND_GROUPED_LIMIT, input_table_name, {
+    'col_of_scores': col_of_scores,
+    'cols_to_group_by': cols_to_group_by,
+    'col_limits': col_limits,
+    'keep_duplicates': keep_duplicates,
+    'sort_by_ascending': sort_by_ascending
+  })
   return res_table_name
 
+def limit_sorted_hierarchy(df, cols_to_group_by, col_limits, keep_duplicates):
+  """Helper for get_table_recurs_limit_grouped_by: limits the rows of
+  the given dataframe, already sorted by its column of scores, level by
+  level of the hierarchy cols_to_group_by (see there for the meaning of
+  col_limits and keep_duplicates). At each level, the rank of each row
+  within its parent group (the values of the columns to its left) is
+  computed for all rows at once with cumcount (or, for the first
+  level, the rank of its value with ngroup, in order of first
+  appearance, ie of best score), and the rows ranked past the level's
+  limit are dropped. The columns are factorized to integer codes once,
+  so that each level only groups integers. Nulls are treated as values
+  of their own.
+  Returns the limited dataframe, still sorted.
+  """
+  df_codes = pd.DataFrame({col: pd.factorize(df[col], use_na_sentinel=False)[0] for col in cols_to_group_by})
+  for (ind, (col_limit, keep_duplicates_in_cur_col)) in enumerate(zip(col_limits, keep_duplicates)):
+    if not(keep_duplicates_in_cur_col):
+      #drop duplicates in current column (for each parent), keeping the
+      #best-scoring row of each
+      df_codes = df_codes[~df_codes.duplicated(subset=cols_to_group_by[:(ind+1)])]
+    if ind == 0:
+      #keep the rows of the col_limit best-scoring values of the first column
+      ranks = df_codes.groupby(cols_to_group_by[0], sort=False).ngroup()
+    else:
+      #keep the col_limit best-scoring rows of each parent
+      ranks = df_codes.groupby(cols_to_group_by[:ind], sort=False).cumcount()
+    df_codes = df_codes[ranks.to_numpy() < col_limit]
+  #df_codes has the default index, so its index is the positions of the rows kept
+  return df.iloc[df_codes.index.to_numpy()]
+
 def get_basic_stats_of_col1_grouped_by_cols(cur, con,
   col_name, cols_to_group_by, input_table_name=db_constants.WINE_INIT_TABLE_NAME, 
   res_table_suffix="",
-  stats_to_compute=['count', 'min', 'max', 'mean', 'median', 'std']):
+  stats_to_compute=['count', 'min', 'max', 'mean', 'median', 'std'],
+  engine=STATS_ENGINE_SQL):
   """Creates a new table from the input table name,
   grouped by the column names passed, that gives the statistical
   functions passed computed on that column by those groups, and writes
@@ -445,6 +541,13 @@ def get_basic_stats_of_col1_grouped_by_cols(cur, con,
       This argument is just the list of functions argument to
       aggregate(), so whatever goes for that list for it also
       applies here on what stats_to_compute may be.
+   @engine: how to compute the statistics. With STATS_ENGINE_SQL,
+   they are computed inside sqlite when they are all in
+   SQL_AGGREGATES or SQL_WINDOW_AGGREGATES (median, std and var
+   are computed with one window function pass over each group),
+   and otherwise in pandas. With STATS_ENGINE_PANDAS, they are
+   always computed in pandas. Either way only the columns grouped
+   by and col_name are read from the input table.
   The resulting table has the columns for statistics have
   the same names as the names of the functions used to compute them
   (currently assumes pandas functions, though might work otherwise).
@@ -476,20 +579,312 @@ def get_basic_stats_of_col1_grouped_by_cols(cur, con,
   assert isinstance(input_table_name, str)
   assert isinstance(res_table_suffix, str)
   assert isinstance(stats_to_compute, list)
+  assert engine in [STATS_ENGINE_SQL, STATS_ENGINE_PANDAS]
 
-  #construct resulting table name for stats in database to create
-  str_cols_grouped_by = ""
-  for col_to_group_by in cols_to_group_by:
-    str_cols_grouped_by += "_" + col_to_group_by
-  # add undescore for result table name's suffix if it is specified
-  res_table_suffix = res_table_suffix if not(res_table_suffix) else f'_{res_table_suffix}' 
-  res_table_name = f'{col_name}_basic_stats_grouped_by{str_cols_grouped_by}'
-
-  #read in table to data frame
-  pd_table = pd.read_sql(f'SELECT * FROM {input_table_name}', con)
-  #group by the columns in cols_to_group_by
-  pd_res = pd_table.groupby(cols_to_group_by)[col_name].aggregate(stats_to_compute)
-  #output to database
-  pd_res.to_sql(res_table_name, con, if_exists='replace')
+  res_table_name = get_basic_stats_table_name(col_name, cols_to_group_by)
+  start_time = time.perf_counter()
+  build_basic_stats_table(cur, con, col_name, cols_to_group_by, input_table_name,
+    res_table_name, stats_to_compute, engine)
+  register_basic_stats_table(cur, con, res_table_name, col_name, cols_to_group_by,
+    input_table_name, stats_to_compute, time.perf_counter() - start_time)
   #return the newly-created table's name
-  return res_table_name
\ No newline at end of file
+  return res_table_name
+
+def get_basic_stats_table_name(col_name, cols_to_group_by):
+  """Returns the name of the table of basic statistics of col_name
+  grouped by cols_to_group_by (see get_basic_stats_of_col1_grouped_by_cols)."""
+  return f'{col_name}_basic_stats_grouped_by_' + '_'.join(cols_to_group_by)
+
+def get_sql_basic_stats_query(col_name, cols_to_group_by, input_table_name, stats_to_compute):
+  """Returns the query string that computes the given statistics of
+  col_name grouped by cols_to_group_by inside sqlite, or None if one
+  of them is in neither SQL_AGGREGATES nor SQL_WINDOW_AGGREGATES.
+  Rows with a null in a column grouped by are left out, and the result
+  is sorted by the columns grouped by, as with pandas' groupby."""
+  if not all([isinstance(stat, str) and (stat in SQL_AGGREGATES or stat in SQL_WINDOW_AGGREGATES) for stat in stats_to_compute]):
+    return None
+  group_by_str = ', '.join([db_op.quote_identifier(col) for col in cols_to_group_by])
+  input_table_str = db_op.quote_identifier(input_table_name)
+  measure_col = db_op.quote_identifier(col_name)
+  not_null_str = ' AND '.join([f'{db_op.quote_identifier(col)} IS NOT NULL' for col in cols_to_group_by])
+  agg_strs = []
+  for stat in stats_to_compute:
+    agg_str = SQL_AGGREGATES[stat] if stat in SQL_AGGREGATES else SQL_WINDOW_AGGREGATES[stat]
+    agg_strs.append(f'{agg_str.format(measure_col)} AS {db_op.quote_identifier(stat)}')
+  if not any([stat in SQL_WINDOW_AGGREGATES for stat in stats_to_compute]):
+    return f'SELECT {group_by_str}, {", ".join(agg_strs)} FROM {input_table_str} WHERE {not_null_str} GROUP BY {group_by_str} ORDER BY {group_by_str}'
+  #rank, count and average the values of each group in one window pass,
+  #then aggregate over these ranked rows
+  return f'''WITH ranked AS (
+    SELECT {group_by_str}, {measure_col},
+      ROW_NUMBER() OVER (grp ORDER BY {measure_col} IS NULL, {measure_col}) AS _rn,
+      COUNT({measure_col}) OVER grp AS _cnt,
+      AVG({measure_col}) OVER grp AS _mean
+    FROM {input_table_str} WHERE {not_null_str}
+    WINDOW grp AS (PARTITION BY {group_by_str}))
+  SELECT {group_by_str}, {", ".join(agg_strs)} FROM ranked GROUP BY {group_by_str} ORDER BY {group_by_str}'''
+
+def build_basic_stats_table(cur, con, col_name, cols_to_group_by, input_table_name,
+  res_table_name, stats_to_compute, engine=STATS_ENGINE_SQL):
+  """Creates the table res_table_name of the given statistics of
+  col_name grouped by cols_to_group_by, from input_table_name, with the
+  given engine (see get_basic_stats_of_col1_grouped_by_cols)."""
+  query_str = get_sql_basic_stats_query(col_name, cols_to_group_by, input_table_name, stats_to_compute)
+  if engine == STATS_ENGINE_SQL and query_str is not None and not db_columnar.is_columnar_store(con):
+    db_op.ensure_math_functions(cur, con)
+    db_op.create_table_as(cur, con, res_table_name, query_str)
+  else:
+    #fall back to pandas for statistics sqlite doesn't have (and for
+    #columnar stores), reading in only the columns needed for them
+    #(with the columns grouped by as categoricals, so they group on integer codes)
+    pd_table = db_op.read_table(cur, con, input_table_name, cols_to_group_by + [col_name],
+      dtypes=db_op.get_compact_dtypes(cols_to_group_by))
+    db_op.write_table(cur, con, res_table_name, pd_table.groupby(cols_to_group_by, observed=True)[col_name].aggregate(stats_to_compute))
+  return res_table_name
+
+def register_basic_stats_table(cur, con, res_table_name, col_name, cols_to_group_by,
+  input_table_name, stats_to_compute, build_seconds=None):
+  """Records the given table of basic statistics in the catalog."""
+  db_catalog.register_table(cur, con, res_table_name, db_catalog.KIND_BASIC_STATS, input_table_name, {
+    'col_name': col_name,
+    'cols_to_group_by': cols_to_group_by,
+    'stats_to_compute': [str(stat) for stat in stats_to_compute]
+  }, build_seconds=build_seconds)
+
+def get_basic_stats_of_cols_grouped_by_cols(cur, con,
+  groupings, input_table_name=db_constants.WINE_INIT_TABLE_NAME,
+  stats_to_compute=['count', 'min', 'max', 'mean', 'median', 'std'],
+  engine=STATS_ENGINE_SQL):
+  """Creates the tables of basic statistics for several groupings at
+  once, as get_basic_stats_of_col1_grouped_by_cols does for each, but
+  reading the input table only once: the columns the groupings need
+  are first copied into a temporary table, that each grouping's
+  statistics are then computed from (so the other columns of the
+  input table, like its descriptions, are only read past once).
+  Param:
+   @cur, con: database vars
+   @groupings: a list of tuples of (col_name, cols_to_group_by), as
+   passed to get_basic_stats_of_col1_grouped_by_cols
+   @input_table_name: the name of the table these columns are in
+   @stats_to_compute, engine: as for get_basic_stats_of_col1_grouped_by_cols
+  Ex:
+    get_basic_stats_of_cols_grouped_by_cols(cur, con,
+      [('price', ['country']), ('points', ['variety'])])
+  creates the tables 'price_basic_stats_grouped_by_country' and
+  'points_basic_stats_grouped_by_variety'.
+  Returns the list of the names of the created tables, in the order
+  of groupings.
+  """
+  assert isinstance(groupings, list)
+  assert isinstance(input_table_name, str)
+  assert isinstance(stats_to_compute, list)
+  assert engine in [STATS_ENGINE_SQL, STATS_ENGINE_PANDAS]
+  cols_needed = []
+  for (col_name, cols_to_group_by) in groupings:
+    assert isinstance(col_name, str)
+    assert isinstance(cols_to_group_by, list)
+    assert len(cols_to_group_by) > 0
+    for col in cols_to_group_by + [col_name]:
+      if col not in cols_needed:
+        cols_needed.append(col)
+  #the one scan of the input table (columnar stores already only read
+  #the columns needed)
+  start_time = time.perf_counter()
+  is_columnar = db_columnar.is_columnar_store(con)
+  scan_table_name = input_table_name if is_columnar else f'{input_table_name}_basic_stats_scan'
+  if not is_columnar:
+    cols_str = ', '.join([db_op.quote_identifier(col) for col in cols_needed])
+    db_op.create_table_as(cur, con, scan_table_name,
+      f'SELECT {cols_str} FROM {db_op.quote_identifier(input_table_name)}', temp=True)
+  scan_seconds = time.perf_counter() - start_time
+  res_table_names = []
+  try:
+    for (col_name, cols_to_group_by) in groupings:
+      start_time = time.perf_counter()
+      res_table_name = get_basic_stats_table_name(col_name, cols_to_group_by)
+      build_basic_stats_table(cur, con, col_name, cols_to_group_by, scan_table_name,
+        res_table_name, stats_to_compute, engine)
+      register_basic_stats_table(cur, con, res_table_name, col_name, cols_to_group_by,
+        input_table_name, stats_to_compute, scan_seconds / len(groupings) + time.perf_counter() - start_time)
+      res_table_names.append(res_table_name)
+  finally:
+    if not is_columnar:
+      with con:
+        con.execute(f'DROP TABLE IF EXISTS temp.{db_op.quote_identifier(scan_table_name)}')
+  return res_table_names
+
+class StatsCube:
+  """Cube of mergeable aggregates of numeric columns (measures) over
+  the combinations of values of several columns (dimensions), built
+  from one scan of a table. For each measure and each combination of
+  values of all of the dimensions (a cell), it keeps the count, sum,
+  sum of squares, min and max of the measure, and a quantile sketch of
+  it (see sketches.py). The statistics of the measure grouped by any
+  subset of the dimensions (such as every prefix of a hierarchy like
+  country -> province -> region_1) are then computed by merging these
+  cells, without going back to the table.
+  Medians are read from the sketches (clamped to each group's min and
+  max), so they are within sketches.RELATIVE_ACCURACY of the exact ones,
+  except for groups of at most CUBE_EXACT_MEDIAN_MAX_COUNT values, whose
+  cells keep their values, and get exact medians. The slices written to
+  the database (see write_slice) get exact medians from the input table.
+  The other statistics are exact (up to floating point error).
+  Ex:
+    cube = StatsCube(['country', 'province', 'variety'], ['price']).build(cur, con)
+    cube.get_slice('price', ['country']) # price stats grouped by country
+    cube.write_slice(cur, con, 'price', ['variety']) # writes price_basic_stats_grouped_by_variety
+  """
+  CELL_COL = '_cell' #column of the cell ids in the sketches
+
+  def __init__(self, dims, measures, relative_accuracy=sketches.RELATIVE_ACCURACY):
+    """Initializes the (empty) cube; see build.
+    Param:
+      @dims: list of the names of the columns to group by
+      @measures: list of the names of the numeric columns to aggregate
+      @relative_accuracy: the relative accuracy of the quantile sketches
+    """
+    assert isinstance(dims, list)
+    assert len(dims) > 0
+    assert isinstance(measures, list)
+    assert len(measures) > 0
+    self.dims = dims
+    self.measures = measures
+    self.relative_accuracy = relative_accuracy
+    self.input_table_name = None
+    self.build_seconds = None
+    self.__cells = None #dataframe of the dims' values of each cell, indexed by cell id
+    self.__aggs = {} #measure to dataframe of its aggregates in each cell
+    self.__sketches = {} #measure to its quantile sketches of each cell
+    #measure to the (cell id, value) of its values in the cells with at most
+    #CUBE_EXACT_MEDIAN_MAX_COUNT of them
+    self.__small_cell_values = {}
+
+  def get_read_cols(self):
+    """Returns the list of the columns build reads from its input table:
+    the dimensions, then the measures."""
+    return self.dims + [measure for measure in self.measures if measure not in self.dims]
+
+  def build(self, cur, con, input_table_name=db_constants.WINE_INIT_TABLE_NAME):
+    """Builds the cells of the cube from one scan of the given table,
+    reading only the dimension and measure columns from it.
+    Rows with a null in a dimension are kept (in cells of their own),
+    so that they still count towards groupings by the other dimensions.
+    Returns the cube itself.
+    """
+    assert isinstance(input_table_name, str)
+    start_time = time.perf_counter()
+    #(with the dimensions as categoricals, so they group on integer codes)
+    df = db_op.read_table(cur, con, input_table_name, self.get_read_cols(), dtypes=db_op.get_compact_dtypes(self.dims))
+    cell_ids = df.groupby(self.dims, sort=True, dropna=False, observed=True).ngroup().to_numpy()
+    num_cells = int(cell_ids.max()) + 1 if len(cell_ids) > 0 else 0
+    is_first_of_cell = ~pd.Series(cell_ids).duplicated().to_numpy()
+    self.__cells = df.loc[is_first_of_cell, self.dims].set_index(
+      pd.Index(cell_ids[is_first_of_cell], name=self.CELL_COL)).sort_index()
+    for measure in self.measures:
+      values = df[measure].astype('float64').to_numpy()
+      is_not_null = ~np.isnan(values)
+      ids, not_null_values = cell_ids[is_not_null], values[is_not_null]
+      series_values = pd.Series(not_null_values)
+      self.__aggs[measure] = pd.DataFrame({
+        'count': np.bincount(ids, minlength=num_cells),
+        'sum': np.bincount(ids, weights=not_null_values, minlength=num_cells),
+        'sumsq': np.bincount(ids, weights=not_null_values * not_null_values, minlength=num_cells),
+        'min': series_values.groupby(ids).min().reindex(range(num_cells)).to_numpy(),
+        'max': series_values.groupby(ids).max().reindex(range(num_cells)).to_numpy()
+      }, index=pd.RangeIndex(num_cells, name=self.CELL_COL))
+      self.__sketches[measure] = sketches.get_quantile_sketches(
+        pd.DataFrame({self.CELL_COL: cell_ids, measure: values}), [self.CELL_COL], measure, self.relative_accuracy)
+      is_small_cell = self.__aggs[measure]['count'].to_numpy() <= CUBE_EXACT_MEDIAN_MAX_COUNT
+      is_kept = is_small_cell[ids]
+      self.__small_cell_values[measure] = pd.DataFrame({self.CELL_COL: ids[is_kept], measure: not_null_values[is_kept]})
+    self.input_table_name = input_table_name
+    self.build_seconds = time.perf_counter() - start_time
+    return self
+
+  def get_slice(self, measure, dims, stats_to_compute=['count', 'min', 'max', 'mean', 'median', 'std']):
+    """Returns the given statistics of the measure grouped by the given
+    dimensions, as a dataframe indexed by them (sorted) with a column for
+    each statistic, in the same form as pandas' groupby().aggregate().
+    As with pandas' groupby, groups with a null in a dimension are left out.
+    Param:
+      @measure: one of the cube's measures
+      @dims: list of (some of) the cube's dimensions to group by
+      @stats_to_compute: list of statistics, from CUBE_STATS
+    """
+    assert self.__cells is not None, 'the cube must be built first'
+    assert measure in self.measures
+    assert isinstance(dims, list)
+    assert len(dims) > 0
+    for dim in dims:
+      assert dim in self.dims
+    for stat in stats_to_compute:
+      assert stat in CUBE_STATS
+    cells = self.__cells[dims]
+    is_kept = cells.notna().all(axis=1)
+    df_aggs = self.__aggs[measure].join(cells)[is_kept.to_numpy()]
+    df_res = df_aggs.groupby(dims, sort=True, observed=True).agg(
+      count=('count', 'sum'), sum=('sum', 'sum'), sumsq=('sumsq', 'sum'), min=('min', 'min'), max=('max', 'max'))
+    counts = df_res['count']
+    df_res['mean'] = df_res['sum'] / counts.where(counts > 0)
+    #sample variance (ddof=1, as in pandas) from the merged sums
+    df_res['var'] = ((df_res['sumsq'] - df_res['sum'] * df_res['mean']) / (counts - 1).where(counts > 1)).clip(lower=0)
+    df_res['std'] = np.sqrt(df_res['var'])
+    if 'median' in stats_to_compute:
+      df_sketches = self.__sketches[measure]
+      df_sketches = df_sketches.join(cells, on=self.CELL_COL)[is_kept.loc[df_sketches[self.CELL_COL]].to_numpy()]
+      df_sketches = sketches.merge_quantile_sketches(df_sketches, dims)
+      medians = sketches.get_quantiles(df_sketches, dims, 0.5, self.relative_accuracy).reindex(df_res.index)
+      #(the sketches' estimates can be slightly outside of a group's values)
+      medians = medians.clip(lower=df_res['min'], upper=df_res['max'])
+      #groups with few values (all of whose cells thus kept them) get exact medians
+      is_small_group = counts <= CUBE_EXACT_MEDIAN_MAX_COUNT
+      if is_small_group.any():
+        df_values = self.__small_cell_values[measure].join(cells, on=self.CELL_COL).dropna(subset=dims)
+        exact_medians = df_values.groupby(dims, sort=True, observed=True)[measure].median().reindex(df_res.index)
+        medians = medians.where(~is_small_group, exact_medians)
+      df_res['median'] = medians
+    return df_res[stats_to_compute]
+
+  def get_exact_medians(self, cur, con, measure, dims):
+    """Returns the exact medians of the measure grouped by the given
+    dimensions, computed from the input table the cube was built from
+    (inside sqlite, with the median of SQL_WINDOW_AGGREGATES; or from the
+    columns read, for a columnar store), as a series indexed by them."""
+    assert self.input_table_name is not None, 'the cube must be built first'
+    assert measure in self.measures
+    assert isinstance(dims, list)
+    query_str = get_sql_basic_stats_query(measure, dims, self.input_table_name, ['median'])
+    if not db_columnar.is_columnar_store(con):
+      return pd.read_sql(query_str, con).set_index(dims)['median']
+    df = db_op.read_table(cur, con, self.input_table_name, dims + [measure], dtypes=db_op.get_compact_dtypes(dims))
+    return df.groupby(dims, sort=True, observed=True)[measure].median()
+
+  def get_rollup(self, measure, hierarchy, stats_to_compute=['count', 'min', 'max', 'mean', 'median', 'std']):
+    """Returns the slices (see get_slice) of the measure for every prefix
+    of the given hierarchy of dimensions, as a list in order of the
+    prefixes. Ex: for ['country', 'province'], the statistics grouped by
+    country, and then by country and province."""
+    assert isinstance(hierarchy, list)
+    return [self.get_slice(measure, hierarchy[:(i+1)], stats_to_compute) for i in range(len(hierarchy))]
+
+  def write_slice(self, cur, con, measure, dims, stats_to_compute=['count', 'min', 'max', 'mean', 'median', 'std'],
+    exact_medians=True):
+    """Writes the given slice (see get_slice) to the database as the table
+    that get_basic_stats_of_col1_grouped_by_cols would create for it, and
+    returns its name. If exact_medians, then its medians are the exact
+    ones (see get_exact_medians), as in that table, rather than those of
+    the sketches; this takes one more query of the input table."""
+    assert isinstance(exact_medians, bool)
+    start_time = time.perf_counter()
+    res_table_name = get_basic_stats_table_name(measure, dims)
+    df_slice = self.get_slice(measure, dims, stats_to_compute)
+    if exact_medians and 'median' in stats_to_compute:
+      df_slice['median'] = self.get_exact_medians(cur, con, measure, dims).reindex(df_slice.index)
+    db_op.write_table(cur, con, res_table_name, df_slice)
+    register_basic_stats_table(cur, con, res_table_name, measure, dims,
+      self.input_table_name, stats_to_compute, time.perf_counter() - start_time)
+    return res_table_name
+
+#record the calls of the public functions of this module while the
+#instrumentation is enabled (see database/instrument.py)
+instrument.instrument_module(sys.modules[__name__])
@@ -1,4 +1,8 @@
+import sys
+import time
+import numpy as np
 import pandas as pd
+from database import db_op, db_catalog, instrument
 
 """Get statistics about frequencies in columns.
 """
@@ -9,14 +13,17 @@ import pandas as pd
 COUNTRY_COL = "country"
 FREQ_COUNTRY_COUNT_RES_COL = "freq_country"
 FREQ_COUNTRY_TABLE = FREQ_COUNTRY_COUNT_RES_COL
+NUM_FREQ_COUNTRY_ROWS = 44 #expected number of rows when testing; 43 if excluding a "None" row
 # - desigmation:
 DESIG_COL = 'designation'
 FREQ_DESIG_COUNT_RES_COL = 'freq_designation'
 FREQ_DESIG_TABLE = FREQ_DESIG_COUNT_RES_COL
+NUM_FREQ_DESIG_ROWS = 37980 #expected number of rows when testing; 37979 if excluding a "None" row
 # - points:
 POINTS_COL = 'points'
 FREQ_POINTS_COUNT_RES_COL = 'freq_points'
 FREQ_POINTS_TABLE = FREQ_POINTS_COUNT_RES_COL
+NUM_FREQ_POINTS_ROWS = 21 #expected number of rows when testing
 # - price
 PRICE_COL = 'price'
 FREQ_PRICE_COUNT_RES_COL = 'freq_price'
@@ -50,6 +57,14 @@ WINERY_COL = 'winery'
 FREQ_WINERY_COUNT_RES_COL = 'freq_winery'
 FREQ_WINERY_TABLE = FREQ_WINERY_COUNT_RES_COL
 """
+The frequency and top n tables created here are recorded in the catalog
+table of the database they are written to (see database/db_catalog.py), which
+is what the functions here (and in vis.py) read their schemas from by
+default. So they can be used from any process with an existing database.
+The two dictionaries below are in-process copies of the schemas of the
+tables created by this process, kept for existing callers.
+"""
+"""
 Dictionary of table schemas of frequency tables; is added to when a frequency table is created.
 Each entry should be a list of column names in the order they are in the db.
 Ex: if two tables freq_country (with cols country, freq_country) and 
@@ -79,6 +94,24 @@ Ex: if two tables freq_country_top_5 (with cols country, freq_country) and
   }
 """ 
 glbl_top_n_freq_schemas = {}
+"""
+Frequency tables created by set_freq_tables (from init.py): a list of, for each table,
+(column to count, resulting count column, resulting table name, number of
+rows the table is expected to have when testing (None to not test it)).
+""" 
+FREQ_TABLE_SPECS = [
+  (COUNTRY_COL, FREQ_COUNTRY_COUNT_RES_COL, FREQ_COUNTRY_TABLE, NUM_FREQ_COUNTRY_ROWS),
+  (DESIG_COL, FREQ_DESIG_COUNT_RES_COL, FREQ_DESIG_TABLE, NUM_FREQ_DESIG_ROWS),
+  (POINTS_COL, FREQ_POINTS_COUNT_RES_COL, FREQ_POINTS_TABLE, NUM_FREQ_POINTS_ROWS),
+  (PROVINCE_COL, FREQ_PROVINCE_COUNT_RES_COL, FREQ_PROVINCE_TABLE, None),
+  (REGION1_COL, FREQ_REGION1_COUNT_RES_COL, FREQ_REGION1_TABLE, None),
+  (REGION2_COL, FREQ_REGION2_COUNT_RES_COL, FREQ_REGION2_TABLE, None),
+  (TASTER_COL, FREQ_TASTER_COUNT_RES_COL, FREQ_TASTER_TABLE, None),
+  (TASTER_TWTR_COL, FREQ_TASTER_TWTR_COUNT_RES_COL, FREQ_TASTER_TWTR_TABLE, None),
+  (VARIETY_COL, FREQ_VARIETY_COUNT_RES_COL, FREQ_VARIETY_TABLE, None),
+  (WINERY_COL, FREQ_WINERY_COUNT_RES_COL, FREQ_WINERY_TABLE, None)
+]
+FREQ_CHUNK_SIZE = 100000 # number of rows read at a time when counting frequencies
 
 
 #for testing if imported correctly
@@ -86,9 +119,10 @@ def test_import():
   print("Imported!")
 
 #gets top n rows of each frequency table; should only be called
-#after the frequency tables are created (ie after dict_freq_schemas
-#is populated with frequency tables to get the top n rows of))
-def get_top_n_rows_of_each_freq_table(cur, con, n, dict_freq_schemas=glbl_dict_freq_schemas):
+#after the frequency tables are created (ie after they are in the
+#catalog, or dict_freq_schemas is populated with frequency tables to
+#get the top n rows of))
+def get_top_n_rows_of_each_freq_table(cur, con, n, dict_freq_schemas=None):
   """Grabs the top n rows of each frequency table, creating a new table with those top n
   rows, and a "Other" category with the counts of the rest as an additional row after those
   top/greatest n. Uses the default result table name and other columsn name ('Other') of
@@ -97,15 +131,37 @@ def get_top_n_rows_of_each_freq_table(cur, con, n, dict_freq_schemas=glbl_dict_f
     @cur, con: vars to wine init database
     @dict_freq_schemas: dictionary with keys as frequency table names and values as lists
     of their column names. Currently is labels column followed by frequency/count column.
+    Defaults to the frequency tables in the database's catalog.
   """
   assert isinstance(n, int)
   assert n > 0
+  dict_freq_schemas = db_catalog.get_freq_schemas(cur, con) if dict_freq_schemas is None else dict_freq_schemas
   assert isinstance(dict_freq_schemas, dict)
   for (freq_table_name, schema_list) in dict_freq_schemas.items():
     # get top n rows table of corresponding frequency table
     col_of_labels_name, col_of_freqs_name = schema_list[0], schema_list[1]
     get_top_n_rows(cur, con, col_of_labels_name, col_of_freqs_name, freq_table_name, n)
 
+#gets top n rows of each frequency table, for each n in n_list; as above, should
+#only be called after the frequency tables are created
+def get_top_ns_rows_of_each_freq_table(cur, con, n_list, dict_freq_schemas=None,
+  in_sql=False):
+  """Same as get_top_n_rows_of_each_freq_table, but for each n in n_list,
+  reading each frequency table only once for all of them (see get_top_ns_rows).
+  Param:
+    @cur, con: vars to wine init database
+    @n_list: list of the n's (n_i's) to create top n tables for
+    @dict_freq_schemas: as for get_top_n_rows_of_each_freq_table
+    @in_sql: whether to compute the top n tables inside sqlite
+  """
+  assert isinstance(n_list, list)
+  dict_freq_schemas = db_catalog.get_freq_schemas(cur, con) if dict_freq_schemas is None else dict_freq_schemas
+  assert isinstance(dict_freq_schemas, dict)
+  for (freq_table_name, schema_list) in dict_freq_schemas.items():
+    # get top n rows tables of corresponding frequency table
+    col_of_labels_name, col_of_freqs_name = schema_list[0], schema_list[1]
+    get_top_ns_rows(cur, con, col_of_labels_name, col_of_freqs_name, freq_table_name, n_list, in_sql=in_sql)
+
 #get top n rows of (frequency) table and store in database as new table
 def get_top_n_rows(
   cur,
@@ -140,27 +196,216 @@ def get_top_n_rows(
   #by default set resulting table name to same as table name but with top_n appended
   res_table_name = res_table_name if res_table_name != None else f'{table_name}_top_{n}'
 
-  freq_top_n_query_str = f'SELECT {col_of_labels}, {col_of_freqs} FROM {table_name} ORDER BY {col_of_freqs} DESC'
-  freq_counts = pd.read_sql(freq_top_n_query_str, con)
-  freq_counts = freq_counts.set_index(col_of_labels)
-  freq_top_n_counts = freq_counts.head(n)
-  freq_rest_other = freq_counts.iloc[n:, :]
-  freq_rest_other_count = freq_rest_other[col_of_freqs].sum()
-  #form resulting dataframe with new row "OTHER" with sum of other count (of rows below n)
-  dict_freq_rest_other_row = {}
-  dict_freq_rest_other_row[col_of_labels] = [other_columns_name]
-  dict_freq_rest_other_row[col_of_freqs] = [freq_rest_other_count]
-  freq_rest_other_row_as_df = pd.DataFrame(data=dict_freq_rest_other_row)
-  freq_rest_other_row_as_df = freq_rest_other_row_as_df.set_index(col_of_labels)
-  #append other row to top n dataframe
-  freq_top_n_counts_with_other = pd.concat([freq_top_n_counts, freq_rest_other_row_as_df])
-  #write resulting df to database
-  freq_top_n_counts_with_other.to_sql(res_table_name, con, if_exists='replace')
-  #add schema info for this "top n" table to global dictionary of this file for those schemas:
-  global glbl_top_n_freq_schemas
-  # initialize dictionary for that n value to be empty if it doesn't yet exist
-  glbl_top_n_freq_schemas[n] = glbl_top_n_freq_schemas.get(n, {})
-  glbl_top_n_freq_schemas[n][res_table_name] = [col_of_labels, col_of_freqs]
+  get_top_ns_rows(cur, con, col_of_labels, col_of_freqs, table_name, [n],
+    res_table_names={n: res_table_name}, other_columns_name=other_columns_name, in_sql=True)
+
+def get_top_ns_rows(
+  cur,
+  con,
+  col_of_labels,
+  col_of_freqs,
+  table_name,
+  n_list,
+  res_table_names=None,
+  other_columns_name="Other",
+  in_sql=False
+):
+  """Same as get_top_n_rows, but creates a top n table (with its "Other" row)
+  for each n in n_list, while only reading the (frequency) table once.
+  The table is read once sorted by descending frequency, and the count for
+  each "Other" row is the total count minus the cumulative count of the top
+  n rows. If in_sql is True, then this is instead all done inside sqlite
+  (with LIMIT and a window SUM), one query per n, without reading the
+  table into python.
+  Params:
+   @cur, con: database vars
+   @col_of_labels, col_of_freqs, table_name, other_columns_name: as for get_top_n_rows
+   @n_list: list of the n's (n_i's) to create a top n table for
+   @res_table_names: dictionary of n's to the name of their resulting
+   table; by default (and for any n not in it) this is the table name with
+   top_n appended (as for get_top_n_rows)
+   @in_sql: whether to compute the tables inside sqlite
+  Returns a dictionary of each n to the name of its resulting table.
+  """
+  assert isinstance(col_of_labels, str)
+  assert isinstance(col_of_freqs, str)
+  assert isinstance(table_name, str)
+  assert isinstance(n_list, list)
+  for n in n_list:
+    assert isinstance(n, int)
+    assert n > 0
+  assert res_table_names is None or isinstance(res_table_names, dict)
+  assert isinstance(other_columns_name, str)
+  assert isinstance(in_sql, bool)
+  res_table_names = {} if res_table_names is None else res_table_names
+  dict_res_table_names = {}
+  for n in n_list:
+    res_table_name = res_table_names.get(n)
+    dict_res_table_names[n] = res_table_name if res_table_name != None else f'{table_name}_top_{n}'
+  labels_col, freqs_col = db_op.quote_identifier(col_of_labels), db_op.quote_identifier(col_of_freqs)
+  freq_table = db_op.quote_identifier(table_name)
+  start_time = time.perf_counter()
+  if in_sql:
+    #top n rows, followed by an "Other" row with the sum of the counts of the
+    #rest of the rows (0 if there are no other rows), all computed in sqlite
+    freq_top_n_query_str = f'''WITH ranked AS (
+      SELECT {labels_col}, {freqs_col},
+        ROW_NUMBER() OVER (ORDER BY {freqs_col} DESC) AS row_num,
+        SUM({freqs_col}) OVER (ORDER BY {freqs_col} DESC ROWS BETWEEN 1 FOLLOWING AND UNBOUNDED FOLLOWING) AS rest_count
+      FROM {freq_table})
+    SELECT * FROM (SELECT {labels_col}, {freqs_col} FROM ranked ORDER BY row_num LIMIT ?)
+    UNION ALL
+    SELECT ? AS {labels_col}, COALESCE((SELECT rest_count FROM ranked WHERE row_num = ?), 0) AS {freqs_col}'''
+    for (n, res_table_name) in dict_res_table_names.items():
+      #write resulting table to database
+      db_op.create_table_as(cur, con, res_table_name, freq_top_n_query_str, (n, other_columns_name, n))
+      db_catalog.register_table(cur, con, res_table_name, db_catalog.KIND_TOP_N, table_name,
+        {'n': n, 'other_columns_name': other_columns_name}, schema=[col_of_labels, col_of_freqs],
+        build_seconds=time.perf_counter() - start_time)
+      start_time = time.perf_counter()
+  else:
+    freq_counts = pd.read_sql(f'SELECT {labels_col}, {freqs_col} FROM {freq_table} ORDER BY {freqs_col} DESC', con)
+    labels = freq_counts[col_of_labels].astype(object).tolist()
+    counts = freq_counts[col_of_freqs].tolist()
+    cum_counts = np.cumsum(counts).tolist()
+    total_count = cum_counts[-1] if len(cum_counts) > 0 else 0
+    with db_op.transaction(cur, con): # write all of the tables in one transaction (from the first DROP TABLE on)
+      for (n, res_table_name) in dict_res_table_names.items():
+        #count of the rest of the rows (below the top n), for the "Other" row
+        freq_rest_other_count = total_count - (cum_counts[n-1] if n <= len(cum_counts) else total_count)
+        res_table = db_op.quote_identifier(res_table_name)
+        con.execute(f'DROP TABLE IF EXISTS {res_table}')
+        con.execute(f'CREATE TABLE {res_table} ({labels_col}, {freqs_col} INTEGER)')
+        con.executemany(f'INSERT INTO {res_table} ({labels_col}, {freqs_col}) VALUES (?, ?)',
+          list(zip(labels[:n], counts[:n])) + [(other_columns_name, freq_rest_other_count)])
+      build_seconds = time.perf_counter() - start_time
+      for (n, res_table_name) in dict_res_table_names.items():
+        db_catalog.register_table(cur, con, res_table_name, db_catalog.KIND_TOP_N, table_name,
+          {'n': n, 'other_columns_name': other_columns_name}, schema=[col_of_labels, col_of_freqs],
+          row_count=min(n, len(labels)) + 1, build_seconds=build_seconds, commit=False)
+  #add schema info for these "top n" tables to global dictionary of this file for those schemas:
+  for (n, res_table_name) in dict_res_table_names.items():
+    # initialize dictionary for that n value to be empty if it doesn't yet exist
+    glbl_top_n_freq_schemas[n] = glbl_top_n_freq_schemas.get(n, {})
+    glbl_top_n_freq_schemas[n][res_table_name] = [col_of_labels, col_of_freqs]
+  return dict_res_table_names
+
+def get_value_counts_query(table_name, cols_to_count):
+  """Returns the query get_value_counts_of_cols reads the given columns
+  of the given table with (each column once)."""
+  return db_op.get_select_query(table_name, list(dict.fromkeys(cols_to_count)))[0]
+
+def get_value_counts_of_cols(cur, con, table_name, cols_to_count, chunksize=FREQ_CHUNK_SIZE):
+  """Counts how often each distinct value appears in each of the given
+  columns of the given table, in a single scan of the table (reading
+  only those columns, chunksize rows at a time). The values of each
+  column in a chunk are factorized to integer codes, which are counted
+  with numpy's bincount, and the counts of the chunks are then summed.
+  Param:
+    @cur, con: database vars
+    @table_name: the name of the table to count the values of
+    @cols_to_count: list of the names of the columns to count the values of
+    @chunksize: the number of rows to read (and count) at a time
+  Returns a dictionary of each column name to a pandas series of the
+  counts of its values (indexed by the values), sorted by descending count
+  (and by value for equal counts). As for sql's COUNT(col) ... GROUP BY col,
+  if the column has nulls, then these are included as a None value with a
+  count of 0 (at the end).
+  """
+  assert isinstance(table_name, str)
+  assert isinstance(cols_to_count, list)
+  assert len(cols_to_count) > 0
+  for col in cols_to_count:
+    assert isinstance(col, str)
+  assert isinstance(chunksize, int)
+  assert chunksize > 0
+  uniq_cols_to_count = list(dict.fromkeys(cols_to_count))
+  dict_counts = {col: None for col in uniq_cols_to_count}
+  dict_has_nulls = {col: False for col in uniq_cols_to_count}
+  for chunk in pd.read_sql(get_value_counts_query(table_name, uniq_cols_to_count), con, chunksize=chunksize):
+    for col in uniq_cols_to_count:
+      #codes are -1 for nulls
+      codes, uniques = pd.factorize(chunk[col])
+      dict_has_nulls[col] = dict_has_nulls[col] or bool((codes < 0).any())
+      chunk_counts = pd.Series(np.bincount(codes[codes >= 0], minlength=len(uniques)), index=uniques)
+      prev_counts = dict_counts[col]
+      dict_counts[col] = chunk_counts if prev_counts is None else prev_counts.add(chunk_counts, fill_value=0)
+  for col in uniq_cols_to_count:
+    col_counts = dict_counts[col]
+    if col_counts is None: #table has no rows
+      col_counts = pd.Series([], dtype='int64')
+    #sort by value, then (stably) by descending count
+    col_counts = col_counts.astype('int64').sort_index(kind='stable').sort_values(ascending=False, kind='stable')
+    if dict_has_nulls[col]:
+      col_counts = pd.concat([col_counts, pd.Series([0], index=pd.Index([None], dtype=object))])
+    dict_counts[col] = col_counts
+  return dict_counts
+
+def set_db_freq_tables(
+  cur,
+  con,
+  wine_init_table,
+  freq_table_specs=FREQ_TABLE_SPECS,
+  testing=False,
+  chunksize=FREQ_CHUNK_SIZE
+):
+  """Creates a two-column frequency table (see set_db_freq_table_def) for
+  each of the given specs, computing all of them from a single scan of
+  wine_init_table (see get_value_counts_of_cols), and writing all of them
+  to the database in a single transaction. So, no matter how many
+  frequency tables are created, the wine init table is only read once.
+  Param:
+    @cur, @con: vars for that database (should be for the wine init database)
+    @wine_init_table: the name of the wine init table
+    @freq_table_specs: list of, for each frequency table to create, a tuple of
+    (column to count, resulting column of counts, resulting table name,
+    number of rows the resulting table is expected to have). See FREQ_TABLE_SPECS.
+    @testing: if True, then the number of rows of each resulting table whose
+    expected number of rows is not None is asserted to be that number.
+    @chunksize: the number of rows of the wine init table to read at a time
+  This function also records each table created in the database's catalog, and adds
+  its table schema to the global dictionary for frequency tables of this file,
+  glbl_dict_freq_schemas.
+  Returns the list of the names of the tables created.
+  """
+  assert isinstance(wine_init_table, str)
+  assert isinstance(freq_table_specs, list)
+  for freq_table_spec in freq_table_specs:
+    assert isinstance(freq_table_spec, tuple)
+    assert len(freq_table_spec) == 4
+    for name in freq_table_spec[:3]:
+      assert isinstance(name, str)
+  assert isinstance(testing, bool)
+  start_time = time.perf_counter()
+  dict_counts = get_value_counts_of_cols(cur, con, wine_init_table,
+    [freq_table_spec[0] for freq_table_spec in freq_table_specs], chunksize)
+  with db_op.transaction(cur, con): # one transaction for all of the tables (from the first DROP TABLE on)
+    for (col_to_count, freq_count_res_col, freq_count_table, _) in freq_table_specs:
+      count_col, res_col = db_op.quote_identifier(col_to_count), db_op.quote_identifier(freq_count_res_col)
+      freq_table = db_op.quote_identifier(freq_count_table)
+      con.execute(f'DROP TABLE IF EXISTS {freq_table}')
+      con.execute(f'CREATE TABLE {freq_table} ({count_col}, {res_col} INTEGER)')
+      col_counts = dict_counts[col_to_count]
+      #convert numpy values to python ones so that sqlite can store them
+      con.executemany(f'INSERT INTO {freq_table} ({count_col}, {res_col}) VALUES (?, ?)',
+        zip(col_counts.index.astype(object).tolist(), col_counts.tolist()))
+    # record the tables in the database's catalog
+    build_seconds = time.perf_counter() - start_time
+    for (col_to_count, freq_count_res_col, freq_count_table, _) in freq_table_specs:
+      db_catalog.register_table(cur, con, freq_count_table, db_catalog.KIND_FREQ, wine_init_table,
+        {'col_to_count': col_to_count}, schema=[col_to_count, freq_count_res_col],
+        row_count=len(dict_counts[col_to_count]), build_seconds=build_seconds, commit=False)
+  # add tables to dictionary of schemas (each schema added is its own list, keyed by table name),
+  # once they are all written
+  for (col_to_count, freq_count_res_col, freq_count_table, _) in freq_table_specs:
+    glbl_dict_freq_schemas[freq_count_table] = [col_to_count, freq_count_res_col]
+  # if testing, then perform a check to ensure tables are created properly
+  if testing:
+    for (_, _, freq_count_table, num_expected_freq_count_rows) in freq_table_specs:
+      if num_expected_freq_count_rows is not None:
+        num_freq_count_rows = cur.execute("SELECT COUNT(*) FROM " + db_op.quote_identifier(freq_count_table)).fetchall()[0][0]
+        assert num_expected_freq_count_rows == num_freq_count_rows
+  return [freq_table_spec[2] for freq_table_spec in freq_table_specs]
 
 def set_db_freq_table_def(
   cur,
@@ -189,25 +434,16 @@ def set_db_freq_table_def(
     has that same number of rows.
   This function also adds the table schema as a list of column names of the table created/added
   to the global dictionary for frequency tables of this file, dict_freq_schemas. 
+  To create several frequency tables, use set_db_freq_tables instead, as it
+  creates all of them from one scan of the wine init table.
   """
   assert isinstance(wine_init_table, str)
   assert isinstance(col_to_count, str)
   assert isinstance(freq_count_res_col, str)
   assert isinstance(freq_count_table, str)
-  freq_count_query_str = f'SELECT {col_to_count}, COUNT({col_to_count}) AS {freq_count_res_col} FROM {wine_init_table} GROUP BY {col_to_count} ORDER BY {freq_count_res_col} DESC'
-  # two-column table of country names and their counts/frequencies
-  freq_counts = pd.read_sql(freq_count_query_str, con)
-  # write to database as new table
-  freq_counts = freq_counts.set_index(col_to_count)
-  freq_counts.to_sql(freq_count_table, con, if_exists='replace') 
-  # add table to dictionary of schemas (each schema added is its own list, keyed by table name)
-  global glbl_dict_freq_schemas
-  glbl_dict_freq_schemas[freq_count_table] = [col_to_count, freq_count_res_col]
-  # if testing, then perform a check to ensure table is created properly
-  if(num_expected_freq_count_rows):
-    #get number of current rows
-    num_freq_count_rows = cur.execute("SELECT COUNT(*) FROM " + freq_count_table).fetchall()[0][0]
-    assert num_expected_freq_count_rows == num_freq_count_rows
+  set_db_freq_tables(cur, con, wine_init_table,
+    [(col_to_count, freq_count_res_col, freq_count_table, num_expected_freq_count_rows)],
+    testing=bool(num_expected_freq_count_rows))
 
 def set_db_freq_country(
   cur,
@@ -239,7 +475,7 @@ def set_db_freq_country(
   assert isinstance(freq_country_table, str)
   assert isinstance(testing, bool)
   # if testing, then perform a check to ensure table is created properly
-  num_expected_freq_count_rows = 44 if testing else None #43 if excluding a "None" row
+  num_expected_freq_count_rows = NUM_FREQ_COUNTRY_ROWS if testing else None
   set_db_freq_table_def(cur, con, wine_init_table, country_col, 
     freq_country_count_res_col, freq_country_table, num_expected_freq_count_rows)
 
@@ -269,7 +505,7 @@ def set_db_freq_desig(
   assert isinstance(freq_desig_table, str)
   assert isinstance(testing, bool)
   # if testing, then perform a check to ensure table is created properly
-  num_expected_freq_count_rows = 37980 if testing else None #37979 if excluding a "None" row
+  num_expected_freq_count_rows = NUM_FREQ_DESIG_ROWS if testing else None
   set_db_freq_table_def(cur, con, wine_init_table, desig_col, 
     freq_desig_count_res_col, freq_desig_table, num_expected_freq_count_rows)
 
@@ -292,7 +528,7 @@ def set_db_freq_points(
   assert isinstance(freq_points_table, str)
   assert isinstance(testing, bool)
   # if testing, then perform a check to ensure table is created properly
-  num_expected_freq_count_rows = 21 if testing else None  
+  num_expected_freq_count_rows = NUM_FREQ_POINTS_ROWS if testing else None
   set_db_freq_table_def(cur, con, wine_init_table, points_col, 
     freq_points_count_res_col, freq_points_table, num_expected_freq_count_rows)
 
@@ -438,12 +674,12 @@ def set_db_freq_winery(
   cur,
   con, 
   wine_init_table,
-  winery_col=VARIETY_COL, 
-  freq_winery_count_res_col= FREQ_VARIETY_COUNT_RES_COL,
-  freq_winery_table=FREQ_VARIETY_TABLE,
+  winery_col=WINERY_COL, 
+  freq_winery_count_res_col= FREQ_WINERY_COUNT_RES_COL,
+  freq_winery_table=FREQ_WINERY_TABLE,
   testing=False
 ):
-  """Sets the frequency table for the 'variety' column from the 
+  """Sets the frequency table for the 'winery' column from the 
   wine_init_table table. (Two columns, as per
   description of set_db_freq_def.)
   """
@@ -455,4 +691,8 @@ def set_db_freq_winery(
   # if testing, then perform a check to ensure table is created properly
   num_expected_freq_count_rows = None 
   set_db_freq_table_def(cur, con, wine_init_table, winery_col, 
-    freq_winery_count_res_col, freq_winery_table, num_expected_freq_count_rows)
\ No newline at end of file
+    freq_winery_count_res_col, freq_winery_table, num_expected_freq_count_rows)
+
+#record the calls of the public functions of this module while the
+#instrumentation is enabled (see database/instrument.py)
+instrument.instrument_module(sys.modules[__name__], exclude=['test_import'])
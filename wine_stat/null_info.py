@@ -1,12 +1,86 @@
-import pandas as pd
-from wine_stat import common_stat
+import sys
+from database import db_columnar, db_op, instrument
 
 """A module for getting null-related info about a table.
 Namely, use this module by simply calling "print_null_info_for_table"
 below for the specified table, as this will print out a summary
-of all of the null-related info for that table."""
+of all of the null-related info for that table (gathered by
+get_null_profile in a single scan of the table)."""
 
-def print_null_info_for_table(cur, con, table_name):
+class NullProfile:
+  """Null info of a table, as gathered by get_null_profile:
+    - table_name: the name of the table
+    - num_rows: the total number of rows of the table (including null entries)
+    - dict_num_nulls_in_each_col: dictionary of each column name
+    to its number of null entries
+    - num_fully_non_null_rows: the number of rows with no null entries
+  """
+  def __init__(self, table_name, num_rows, dict_num_nulls_in_each_col, num_fully_non_null_rows):
+    assert isinstance(table_name, str)
+    assert isinstance(num_rows, int)
+    assert isinstance(dict_num_nulls_in_each_col, dict)
+    assert isinstance(num_fully_non_null_rows, int)
+    self.table_name = table_name
+    self.num_rows = num_rows
+    self.dict_num_nulls_in_each_col = dict_num_nulls_in_each_col
+    self.num_fully_non_null_rows = num_fully_non_null_rows
+
+  def get_percentage(self, num):
+    """Returns num as a percentage of the number of rows, rounded to
+    two decimal places (0 if the table has no rows)."""
+    return round(100 * (num/self.num_rows), 2) if self.num_rows > 0 else 0
+
+  def get_dict_percentage_null_in_each_col(self):
+    """Returns the dictionary of each column name to the percentage
+    of its entries that are null (rounded to two decimal places)."""
+    return {col_name: self.get_percentage(num_nulls) for (col_name, num_nulls) in self.dict_num_nulls_in_each_col.items()}
+
+  def get_percent_fully_non_null_rows(self):
+    """Returns the percentage of rows with no null entries (rounded
+    to two decimal places)."""
+    return self.get_percentage(self.num_fully_non_null_rows)
+
+  def format(self):
+    """Returns the summary of the null info, as printed by
+    print_null_info_for_table."""
+    return '\n'.join([
+      "*************",
+      f"Null info for table with name:  {self.table_name}",
+      f" - The total number of rows of this table is:  {self.num_rows} rows",
+      f" - The number of nulls in each column is given by:  {self.dict_num_nulls_in_each_col}",
+      f" - The percentage of nulls in each column (rounded to two decimal places) is given by:  {self.get_dict_percentage_null_in_each_col()}",
+      f" - The number of rows with no null entries is:  {self.num_fully_non_null_rows} rows",
+      f" - The percentage of rows in the table with no null entries is:  {self.get_percent_fully_non_null_rows()}%",
+      "*************"
+    ])
+
+def get_null_profile(cur, con, table_name):
+  """Returns the null info of the given table (as a NullProfile),
+  gathered with a single query (one scan of the table) that counts
+  the rows, the nulls in each column, and the rows with no nulls.
+  The 'index' column (written by pandas) is not counted as a column.
+  For a columnar store, the counts are read from the columns' validity
+  bitmaps instead.
+  Param:
+    @cur, con: database vars
+    @table_name: the table to get the null info for
+  """
+  assert isinstance(table_name, str)
+  col_names = [col_name for col_name in db_op.get_table_col_names(cur, con, table_name) if col_name != 'index']
+  assert len(col_names) > 0 #assert table has at least one column
+  if db_columnar.is_columnar_store(con):
+    num_rows, dict_num_nulls, num_fully_non_null_rows = con.get_null_counts(table_name, col_names)
+    return NullProfile(table_name, num_rows, dict_num_nulls, num_fully_non_null_rows)
+  quoted_col_names = [db_op.quote_identifier(col_name) for col_name in col_names]
+  #SUM over an empty table is null, hence the COALESCEs
+  sum_strs = [f'COALESCE(SUM({col} IS NULL), 0)' for col in quoted_col_names]
+  no_nulls_str = ' AND '.join([f'{col} IS NOT NULL' for col in quoted_col_names])
+  sum_strs.append(f'COALESCE(SUM({no_nulls_str}), 0)')
+  res = con.execute(f'SELECT COUNT(*), {", ".join(sum_strs)} FROM {db_op.quote_identifier(table_name)}').fetchone()
+  num_rows, nums_nulls, num_fully_non_null_rows = res[0], res[1:-1], res[-1]
+  return NullProfile(table_name, num_rows, dict(zip(col_names, nums_nulls)), num_fully_non_null_rows)
+
+def print_null_info_for_table(cur, con, table_name, null_profile=None):
   """Prints out (on the command-line) the null info for
   each column. It prints five pieces of info:
     1. the total number of rows in the table (including null entries)
@@ -14,27 +88,16 @@ def print_null_info_for_table(cur, con, table_name):
     3. the percentage of entries in each column that are null
     4. the total number of rows with no null entries in the table
     5. the percentage of rows with no null entries in the table
-  THIS FUNCTION DOES NOT RETURN ANYTHING, it just prints null
-  info for the table.
   Param:
     @cur, con: database vars
     @table_name: the table to print the total number of rows and null info for
+    @null_profile: the null info to print, if already gathered with
+    get_null_profile; else it is gathered here
+  Returns the NullProfile printed, so its counts can be reused.
   """ 
-  total_num_rows_in_table = common_stat.get_num_rows_in_table(cur, con, table_name)
-  dict_num_nulls_in_each_col = get_num_nulls_in_each_column(cur, con, table_name)
-  dict_percentage_null_in_each_column = get_percentage_null_in_each_column(cur, con, table_name)
-  total_num_no_nulls_rows_in_table = get_num_fully_non_null_rows_for_table(cur, con, table_name)
-  #get percentage of rows with no nulls rounded to two decimal places
-  percent_rows_no_nulls = round(100 * (total_num_no_nulls_rows_in_table/total_num_rows_in_table), 2)
-  #print summary info
-  print("*************")
-  print("Null info for table with name: ", table_name)
-  print(" - The total number of rows of this table is: ", f'{total_num_rows_in_table} rows')
-  print(" - The number of nulls in each column is given by: ", dict_num_nulls_in_each_col)
-  print(" - The percentage of nulls in each column (rounded to two decimal places) is given by: ", dict_percentage_null_in_each_column)
-  print(" - The number of rows with no null entries is: ", f'{total_num_no_nulls_rows_in_table} rows')
-  print(" - The percentage of rows in the table with no null entries is: ", f'{percent_rows_no_nulls}%')
-  print("*************")
+  null_profile = get_null_profile(cur, con, table_name) if null_profile is None else null_profile
+  print(null_profile.format())
+  return null_profile
 
 def get_num_fully_non_null_rows_for_table(cur, con, table_name):
   """Returns the number of rows that have no null entries
@@ -44,26 +107,7 @@ def get_num_fully_non_null_rows_for_table(cur, con, table_name):
     @table_name: the table ot get the number of fully non-null
     rows for
   """
-  pd_table = pd.read_sql(f'SELECT * FROM {table_name}', con)
-  pd_table.set_index('index')
-  #all column names of table
-  col_names = list(pd_table.columns.values)
-  assert len(col_names) > 0 #assert table has at least one column
-  #build query string to select only those rows with
-  #no null entries
-  query_str = f'SELECT * FROM {table_name} WHERE ' #{col_names[0]} IS NOT NULL'
-  i = 0
-  for col_name in col_names:
-    if col_name != 'index': #don't consider the index column
-      if i == 0: #if first entry, then don't prefix expression with ' AND '
-        query_str += f'{col_name} IS NOT NULL'
-      else:
-        query_str += f' AND {col_name} IS NOT NULL'
-      i += 1
-  pd_no_nulls_table = pd.read_sql(query_str, con)
-  #number of rows for this no-nulls table
-  num_rows_no_nulls = pd_no_nulls_table.shape[0]
-  return num_rows_no_nulls
+  return get_null_profile(cur, con, table_name).num_fully_non_null_rows
 
 def get_percentage_null_in_each_column(cur, con, table_name):
   """Returns a dictionary of "columns: percentages" that gives
@@ -76,14 +120,7 @@ def get_percentage_null_in_each_column(cur, con, table_name):
     @cur, con: database vars
     @table_name: the table to get the percentage of nulls
   """
-  total_num_rows_in_table = common_stat.get_num_rows_in_table(cur, con, table_name)
-  dict_num_nulls_in_each_col = get_num_nulls_in_each_column(cur, con, table_name)
-  dict_percentage_null_in_each_column = {} #dictionary to return
-  for (col_name, num_rows_null) in dict_num_nulls_in_each_col.items():
-    #round percentage to two decimal places
-    percent_null_in_col = round(100 * (num_rows_null/total_num_rows_in_table), 2)
-    dict_percentage_null_in_each_column[col_name] = percent_null_in_col
-  return dict_percentage_null_in_each_column
+  return get_null_profile(cur, con, table_name).get_dict_percentage_null_in_each_col()
 
 def get_num_nulls_in_each_column(cur, con, table_name):
   """Returns a dictionary of the column names to their
@@ -98,15 +135,8 @@ def get_num_nulls_in_each_column(cur, con, table_name):
     @cur, con: database vars
     @table_name: the table to get the counts of the null columns in
   """ 
-  pd_table = pd.read_sql(f'SELECT * FROM {table_name}', con)
-  pd_table.set_index('index')
-  #get all column names of pandas dataframe for table
-  col_names = list(pd_table.columns.values)
-  COUNT_COL_RES = "COUNT_COL" # name of resulting count column just below
-  dict_count_col_nulls = {} # dictionary to return
-  for col_name in col_names:
-    if col_name != 'index': #don't count the index column
-      query_str = f'SELECT COUNT(*) AS {COUNT_COL_RES} FROM {table_name} WHERE {col_name} IS NULL'
-      count_nulls_in_col = pd.read_sql(query_str, con)
-      dict_count_col_nulls[col_name] = count_nulls_in_col[COUNT_COL_RES][0] #grab 1st/only entry: the count entry
-  return dict_count_col_nulls
\ No newline at end of file
+  return get_null_profile(cur, con, table_name).dict_num_nulls_in_each_col
+
+#record the calls of the public functions of this module while the
+#instrumentation is enabled (see database/instrument.py)
+instrument.instrument_module(sys.modules[__name__])
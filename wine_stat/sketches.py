@@ -0,0 +1,213 @@
+import sys
+import math
+import numpy as np
+import pandas as pd
+from database import instrument
+
+"""Mergeable sketches of the values of a column, that summarize
+them in bounded space and that can be combined (merged) across groups
+without going back to the rows.
+
+Quantile sketch: each value is counted in a logarithmically-sized
+bucket (as in DDSketch), so that any quantile read back from the
+bucket counts is within RELATIVE_ACCURACY of the true value (relative
+to it). Sketches of several groups are merged by adding up their
+counts of each bucket. Sketches are kept as tables (dataframes) of
+bucket counts with the columns:
+  <group column(s)> BUCKET_KEY_COL BUCKET_COUNT_COL
+so that the sketches of many groups are built and merged at once."""
+
+#constants
+RELATIVE_ACCURACY = 0.01 #relative accuracy of the quantiles read from a sketch
+BUCKET_KEY_COL = 'bucket_key'
+BUCKET_COUNT_COL = 'bucket_count'
+#keys of the buckets of positive values are offset by this (and those of
+#negative values are the negatives of these), so that the keys sort in
+#the same order as the values they are for. 0 is the key of the zero bucket.
+BUCKET_KEY_OFFSET = 1000000
+MIN_INDEXABLE_VALUE = 1e-300 #values of a smaller magnitude count as 0
+
+def get_gamma(relative_accuracy=RELATIVE_ACCURACY):
+  """Returns the ratio of the upper to the lower bound of each bucket
+  for the given relative accuracy."""
+  assert 0 < relative_accuracy < 1
+  return (1 + relative_accuracy) / (1 - relative_accuracy)
+
+def get_bucket_keys(values, relative_accuracy=RELATIVE_ACCURACY):
+  """Returns the numpy array of the keys of the buckets the given
+  (non-null) values are counted in. Keys sort in the order of the
+  values of their buckets.
+  Param:
+    @values: array-like of numeric values (without nulls)
+    @relative_accuracy: the relative accuracy of the sketch
+  """
+  values = np.asarray(values, dtype=np.float64)
+  log_gamma = math.log(get_gamma(relative_accuracy))
+  abs_values = np.abs(values)
+  is_indexable = abs_values >= MIN_INDEXABLE_VALUE
+  indexes = np.zeros(len(values), dtype=np.int64)
+  indexes[is_indexable] = np.ceil(np.log(abs_values[is_indexable]) / log_gamma).astype(np.int64)
+  return np.where(is_indexable, np.sign(values).astype(np.int64) * (indexes + BUCKET_KEY_OFFSET), 0)
+
+def get_bucket_values(keys, relative_accuracy=RELATIVE_ACCURACY):
+  """Returns the numpy array of the values the buckets with the given
+  keys stand for (within relative_accuracy of every value counted in
+  them)."""
+  keys = np.asarray(keys, dtype=np.int64)
+  gamma = get_gamma(relative_accuracy)
+  indexes = np.abs(keys) - BUCKET_KEY_OFFSET
+  magnitudes = 2 * np.power(gamma, indexes.astype(np.float64)) / (gamma + 1)
+  return np.where(keys == 0, 0.0, np.sign(keys) * magnitudes)
+
+def get_quantile_sketches(df, group_cols, value_col, relative_accuracy=RELATIVE_ACCURACY):
+  """Returns the quantile sketches of the given value column for each
+  group of the given dataframe, as a table of bucket counts (see above).
+  Nulls in value_col are left out of the sketches, but nulls in the
+  columns grouped by are kept as groups of their own (so that the
+  sketches can later be merged into coarser groups).
+  Param:
+    @df: the dataframe to sketch
+    @group_cols: list of the columns of df to group by
+    @value_col: the numeric column of df to sketch
+    @relative_accuracy: the relative accuracy of the sketches
+  """
+  assert isinstance(group_cols, list)
+  assert isinstance(value_col, str)
+  is_not_null = df[value_col].notna()
+  df_sketches = df.loc[is_not_null, group_cols].assign(**{
+    BUCKET_KEY_COL: get_bucket_keys(df.loc[is_not_null, value_col], relative_accuracy),
+    BUCKET_COUNT_COL: 1
+  })
+  return merge_quantile_sketches(df_sketches, group_cols)
+
+def merge_quantile_sketches(df_sketches, group_cols):
+  """Merges the given quantile sketches into one sketch per group of
+  group_cols, by adding up the counts of each of their buckets.
+  Param:
+    @df_sketches: table of bucket counts (see above), with (at least)
+    the columns group_cols, BUCKET_KEY_COL and BUCKET_COUNT_COL
+    @group_cols: list of the columns to group the sketches into
+  Returns the table of bucket counts of the merged sketches, sorted by
+  group and then by bucket key.
+  """
+  assert isinstance(group_cols, list)
+  return df_sketches.groupby(group_cols + [BUCKET_KEY_COL], sort=True, dropna=False, observed=True)[BUCKET_COUNT_COL].sum().reset_index()
+
+def get_quantiles(df_sketches, group_cols, q, relative_accuracy=RELATIVE_ACCURACY):
+  """Returns the given quantile of each of the given sketches, as a
+  series indexed by group_cols.
+  Param:
+    @df_sketches: table of bucket counts with one sketch per group of
+    group_cols, sorted by group and then by bucket key (as returned
+    by merge_quantile_sketches)
+    @group_cols: list of the columns the sketches are grouped by
+    @q: the quantile to get, between 0 and 1 (ex: 0.5 for the median)
+    @relative_accuracy: the relative accuracy the sketches were built with
+  """
+  assert isinstance(group_cols, list)
+  assert 0 <= q <= 1
+  grouped_counts = df_sketches.groupby(group_cols, sort=False, dropna=False, observed=True)[BUCKET_COUNT_COL]
+  cum_counts = grouped_counts.cumsum()
+  #rank (from 0) of the quantile in each group. As in pandas, a quantile
+  #between two ranks is interpolated between the values at those ranks.
+  ranks = q * (grouped_counts.transform('sum') - 1)
+  lower_ranks = np.floor(ranks)
+  lower_values = get_values_at_ranks(df_sketches, group_cols, cum_counts, lower_ranks, relative_accuracy)
+  upper_values = get_values_at_ranks(df_sketches, group_cols, cum_counts, np.ceil(ranks), relative_accuracy)
+  fractions = pd.Series((ranks - lower_ranks).to_numpy(), index=df_sketches.set_index(group_cols).index)
+  fractions = fractions[~fractions.index.duplicated()].reindex(lower_values.index)
+  return lower_values + (upper_values - lower_values) * fractions
+
+def get_values_at_ranks(df_sketches, group_cols, cum_counts, ranks, relative_accuracy=RELATIVE_ACCURACY):
+  """Helper for get_quantiles: returns the value at the given rank of
+  each sketch (the value of the first of its buckets its cumulative
+  count goes past the rank in), as a series indexed by group_cols.
+  cum_counts and ranks are the cumulative bucket counts and the ranks,
+  aligned with the rows of df_sketches."""
+  df_in_bucket = df_sketches.loc[cum_counts > ranks, group_cols + [BUCKET_KEY_COL]]
+  df_in_bucket = df_in_bucket.drop_duplicates(subset=group_cols, keep='first')
+  return pd.Series(get_bucket_values(df_in_bucket[BUCKET_KEY_COL], relative_accuracy),
+    index=df_in_bucket.set_index(group_cols).index)
+
+"""Distinct count sketch: a HyperLogLog sketch of the (hashed) values of
+a column, that estimates their number of distinct values in a fixed
+2**precision bytes, with a relative standard error of about
+1.04 / sqrt(2**precision) (0.8% for the default precision of 14).
+Sketches of several chunks (or tables) of values are merged by taking
+the max of each of their registers."""
+HLL_PRECISION = 14 #number of bits of the hash that pick the register
+
+class HyperLogLog:
+  """HyperLogLog sketch of the distinct values added to it (see above).
+  Ex:
+    hll = HyperLogLog()
+    hll.add(df['winery'])
+    hll.count() # ~ df['winery'].nunique()
+  """
+  def __init__(self, precision=HLL_PRECISION, registers=None):
+    """Initializes an empty sketch (or one with the given registers).
+    Param:
+      @precision: the number of bits of the hash that pick the register
+      (the sketch has 2**precision registers); between 4 and 18
+      @registers: numpy uint8 array of the 2**precision registers of an
+      existing sketch (as from from_bytes), if any
+    """
+    assert isinstance(precision, int)
+    assert 4 <= precision <= 18
+    self.precision = precision
+    self.num_registers = 1 << precision
+    self.registers = np.zeros(self.num_registers, dtype=np.uint8) if registers is None else registers
+    assert len(self.registers) == self.num_registers
+
+  def add_hashes(self, hashes):
+    """Adds the values with the given 64-bit hashes (numpy uint64 array)
+    to the sketch."""
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    num_rest_bits = 64 - self.precision
+    indexes = (hashes >> np.uint64(num_rest_bits)).astype(np.intp)
+    rest = hashes & np.uint64((1 << num_rest_bits) - 1)
+    #position of the first 1 bit of the rest of the hash (from the left);
+    #the rest has at most 60 bits, so its bit length is exact as a float's exponent
+    bit_lengths = np.frexp(rest.astype(np.float64))[1]
+    ranks = (num_rest_bits - bit_lengths + 1).astype(np.uint8)
+    np.maximum.at(self.registers, indexes, ranks)
+
+  def add(self, values):
+    """Adds the non-null values of the given series to the sketch.
+    Numeric values are hashed as floats, so that equal ints and floats
+    (such as from chunks with and without nulls) count as one value."""
+    values = pd.Series(values).dropna()
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+      values = values.astype(np.float64)
+    self.add_hashes(pd.util.hash_pandas_object(values, index=False).to_numpy())
+
+  def merge(self, other):
+    """Merges the other sketch (of the same precision) into this one, so
+    that this one then sketches the values added to either."""
+    assert isinstance(other, HyperLogLog)
+    assert other.precision == self.precision
+    np.maximum(self.registers, other.registers, out=self.registers)
+
+  def count(self):
+    """Returns the estimated number of distinct values added."""
+    m = self.num_registers
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+    num_zero_registers = int(np.count_nonzero(self.registers == 0))
+    if estimate <= 2.5 * m and num_zero_registers > 0:
+      #small range correction (linear counting)
+      estimate = m * math.log(m / num_zero_registers)
+    return int(round(estimate))
+
+  def to_bytes(self):
+    """Returns the registers of the sketch as bytes, for storing it."""
+    return self.registers.tobytes()
+
+  @staticmethod
+  def from_bytes(sketch_bytes, precision=HLL_PRECISION):
+    """Returns the sketch with the given registers (as from to_bytes)."""
+    return HyperLogLog(precision, np.frombuffer(sketch_bytes, dtype=np.uint8).copy())
+
+#record the calls of the public functions of this module while the
+#instrumentation is enabled (see database/instrument.py)
+instrument.instrument_module(sys.modules[__name__], exclude=['get_gamma'])
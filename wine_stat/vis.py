@@ -1,16 +1,13 @@
+import os
+import sys
 import pandas as pd
-from wine_stat import freq
-import seaborn as sns
-import matplotlib.pyplot as plt
-import colorcet as cc
-from database import db_constants
-import sqlite3 as sl
-import plotly.express as px
-from pyecharts.charts import Map
-from pyecharts import options as opts
+from database import db_constants, db_conn, db_op, db_catalog, instrument
 
 
 """Module for visualizing data.
+The plotting libraries (seaborn, matplotlib, colorcet, plotly) are
+only imported by the functions that use them, when they are first
+called, so that importing this module stays fast.
 """ 
 
 def draw_fig(df, ct, title_ = 'Top Flavors', save=True, topk=5, max_=1):
@@ -24,6 +21,9 @@ def draw_fig(df, ct, title_ = 'Top Flavors', save=True, topk=5, max_=1):
       @topk: plots topk number of words for each points interval
       @max_: xlim max range of all subplots
   """
+  import seaborn as sns
+  import matplotlib.pyplot as plt
+  import colorcet as cc
   uniques = set()
   def fun(x):
       for i in x:
@@ -85,6 +85,8 @@ def plot_bar_chart(
     @limit: the number of topmost rows to select/graph,
     in descending order (ie the limit greatest get plotted)
   """
+  import seaborn as sns
+  import matplotlib.pyplot as plt
   assert isinstance(col_of_labels, str)
   assert isinstance(col_to_plot, str)
   assert isinstance(limit, int) or limit == None
@@ -96,17 +98,13 @@ def plot_bar_chart(
     for i in bar_limits:
       assert isinstance(i, int) or isinstance(i, float)
 
-  #construct query string to select column of labels
-  #and columns to plot. Gets the columns as having
-  #the same name as in the table.
+  #select the column of labels and columns to plot,
+  #sorted and limited in the database. Gets the columns
+  #as having the same name as in the table.
   plt.figure(figsize=figsize)
-  hue_query_str = ""
-  if hue != None:
-    hue_query_str = f', {hue}'
-  pd_table = pd.read_sql(f'SELECT {col_of_labels}, {col_to_plot}{hue_query_str}  FROM {table_name}', con)
-  pd_table = pd_table.sort_values(by=col_to_plot,ascending = False)
-  if limit:
-    pd_table = pd_table.head(limit)
+  cols_to_select = [col_of_labels, col_to_plot] + ([hue] if hue != None else [])
+  pd_table = db_op.read_table(cur, con, table_name, cols_to_select,
+    order_by=[(col_to_plot, False)], limit=limit)
   #swap columns if plotting horizontal bar chart
   x = col_of_labels if orient != 'h' else col_to_plot
   y = col_to_plot if orient != 'h' else col_of_labels
@@ -196,9 +194,8 @@ def plot_pie_chart(
     @col_of_counts: the counts are being plotted by the pie chart
   """
   assert isinstance(freq_table_to_plot, str)
-  plot_query_str = f'SELECT {col_of_labels}, {col_of_counts} FROM {freq_table_to_plot}'
-  plot_df = pd.read_sql(plot_query_str, con)
-  plot_df = plot_df.set_index(col_of_labels)
+  plot_df = db_op.read_table(cur, con, freq_table_to_plot, [col_of_labels, col_of_counts],
+    index_col=col_of_labels)
   #plot showing percentages of the data
   pie_plot = plot_df.plot.pie(y=col_of_counts, figsize=(7,7), legend=True, autopct='%1.1f%%', title=col_of_counts, shadow=True, labeldistance =1.05, pctdistance=0.78)
   return pie_plot
@@ -235,12 +232,12 @@ def plot_pie_charts_for_freq_tables(
     plot_pie_chart(cur, con, table_name, col_of_labels_name, col_of_counts_name)  
 
 #if using default argument for dictionary, needs to be called
-#after top-n tables are created (as default value for dictionary
-#will be empty until they are).
+#after top-n tables are created (as the database's catalog
+#will have no top-n tables until they are).
 def plot_pie_charts_all_top_n_freq_tables(
   cur,
   con,
-  dict_freq_tables=freq.glbl_top_n_freq_schemas
+  dict_freq_tables=None
 ):
   """Plots pie charts for the dictionary of
   top n (n_i) size to the dictionary of table names to 
@@ -263,40 +260,106 @@ def plot_pie_charts_all_top_n_freq_tables(
             freq_variety_top_20: [variety, freq_variety]
           }
       }
+  By default, this is the top_n tables recorded in the database's catalog
+  (see freq.py file and database/db_catalog.py for more descriptoin).
   Importantly, if using the default value here, then those top_n tables
-  in that dictionary (see freq.py file for more descriptoin) must exist
-  before this function is called (otherwise this default value dicitonary
-  will be empty).
+  must exist before this function is called (otherwise this default value
+  dicitonary will be empty).
   """
+  dict_freq_tables = db_catalog.get_top_n_freq_schemas(cur, con) if dict_freq_tables is None else dict_freq_tables
+  assert isinstance(dict_freq_tables, dict)
   for (_, dict_top_n_freq_tables) in dict_freq_tables.items():
     #plot the pie charts for those top_n tables with n=n_i, of ie, for those n_i
     plot_pie_charts_for_freq_tables(cur, con, dict_top_n_freq_tables)
 
 # ----------------------------------------------- Overview ----------------------
-def readin_db_to_df(path='database/'):
-  """Reads in database to dataframe here.""" 
+def readin_db_to_df(path='database/', cols=None, compact=True):
+  """Reads in database to dataframe here (all columns if cols is None,
+  else only those in the list cols, along with the index column), in
+  the compact dtypes of db_op.get_compact_dtypes unless compact is False.""" 
+  assert cols is None or isinstance(cols, list)
   # read in database
   WINE_INIT_DB_NAME = db_constants.WINE_INIT_DB_NAME
   WINE_INIT_PATH_TO_DB = path + WINE_INIT_DB_NAME
-  con = sl.connect(WINE_INIT_PATH_TO_DB)
-  sql_cmd = "SELECT * FROM wine_init"
-  df = pd.read_sql_query(sql_cmd, con, index_col = 'index')
-  con.close()
+  with db_conn.get_manager(WINE_INIT_PATH_TO_DB).reader() as con:
+    df = db_op.read_table(con.cursor(), con, db_constants.WINE_INIT_TABLE_NAME,
+      [] if cols is None else ['index'] + cols, index_col='index', compact=compact)
   return df
 
-def sunBurstChart_winecount(df=readin_db_to_df(), color='Bugn'):
+"""
+Cache of the wine init table for get_wine_df, keyed by the path to the
+database directory. Each entry is a dictionary with the version of the
+database file it was read from ('db_version'; see get_db_file_version)
+and the dataframe of the columns read so far ('df').
+"""
+glbl_wine_df_cache = {}
+
+def get_db_file_version(db_path):
+  """Returns a tuple that changes whenever the given database file
+  is written to: the modification times and sizes of it and of its
+  write-ahead log (as writes in WAL mode first go to that file). An
+  empty write-ahead log (as created by readers) counts as no log."""
+  version = []
+  for file_path in [db_path, db_path + '-wal']:
+    file_stat = os.stat(file_path) if os.path.exists(file_path) else None
+    if file_stat is not None and file_stat.st_size > 0:
+      version += [file_stat.st_mtime_ns, file_stat.st_size]
+    else:
+      version += [None, None]
+  return tuple(version)
+
+def get_wine_df(cols=None, path='database/'):
+  """Returns the wine init table as a dataframe (indexed by its index
+  column), with only the columns in the list cols (all if None).
+  The table is read lazily and memoized: it is read on first use, later
+  calls only read the columns that haven't been read yet, and it is read
+  again if the database file has changed since. The dataframe returned
+  is a new one each call, so modifying it does not modify the cache.
+  Param:
+    @cols: list of columns to get
+    @path: path to the directory of the database
+  """
+  assert cols is None or isinstance(cols, list)
+  db_version = get_db_file_version(path + db_constants.WINE_INIT_DB_NAME)
+  cache_entry = glbl_wine_df_cache.get(path)
+  if cache_entry is None or cache_entry['db_version'] != db_version:
+    #nothing cached for this database yet, or it has changed
+    cache_entry = {'db_version': db_version, 'df': None, 'all_cols': False}
+    glbl_wine_df_cache[path] = cache_entry
+  if cols is None:
+    if not cache_entry['all_cols']:
+      cache_entry['df'] = readin_db_to_df(path)
+      cache_entry['all_cols'] = True
+    return cache_entry['df'][list(cache_entry['df'].columns)]
+  if cache_entry['df'] is None:
+    cache_entry['df'] = readin_db_to_df(path, cols)
+  else:
+    cols_to_read = [col for col in cols if col not in cache_entry['df'].columns]
+    if len(cols_to_read) > 0:
+      cache_entry['df'] = cache_entry['df'].join(readin_db_to_df(path, cols_to_read))
+  return cache_entry['df'][cols]
+
+def sunBurstChart_winecount(df=None, color='Bugn'):
   """Creates a sun-burst chart of the wine count.""" 
+  import plotly.express as px
+  # read (only) the columns needed here if no dataframe is passed
+  df = get_wine_df(['country', 'province', 'region_1']) if df is None else df
   # wine_count under country -> province -> region
   # pick 3 columns and do freq count
-  df_CnPR = df[['country', 'province','region_1']].value_counts()
+  # (grouped on the combinations observed only, as the columns are categoricals)
+  df_CnPR = df.groupby(['country', 'province','region_1'], observed=True).size().sort_values(ascending=False)
   # organize the dataframe
-  df_CnPR = pd.DataFrame(df_CnPR).reset_index().rename(columns = {0 : 'wine_count'})
+  df_CnPR = df_CnPR.rename('wine_count').reset_index()
   # drawing plot:
   fig=px.sunburst(df_CnPR,path=['country','province','region_1'],values='wine_count',color='wine_count',color_continuous_scale=color)
   fig.update_traces(textinfo='label + percent parent + value')
 
-def price_point_all(df=readin_db_to_df()):
+def price_point_all(df=None):
   """Plot relationship between price and points.""" 
+  import seaborn as sns
+  import matplotlib.pyplot as plt
+  # read (only) the columns needed here if no dataframe is passed
+  df = get_wine_df(['price', 'points']) if df is None else df
   title = "Relationship between price and point"
   plt.figure(figsize = [14,6])
   ax = sns.regplot(x = df["price"], y="points", data=df, logx=True, truncate=True)
@@ -304,8 +367,12 @@ def price_point_all(df=readin_db_to_df()):
   plt.tight_layout()
   # plt.savefig(f'./{title}.jpg',dpi=300)
 
-def price_point_province(df=readin_db_to_df(), n=3):
+def price_point_province(df=None, n=3):
   """Plot relationship between price and points for provinces."""
+  import seaborn as sns
+  import matplotlib.pyplot as plt
+  # read (only) the columns needed here if no dataframe is passed
+  df = get_wine_df(['province', 'price', 'points']) if df is None else df
   topProvince = df['province'].value_counts(normalize = True).head(n).index.tolist()
   df_plimit = df[df['price']<=100]
   count = 1
@@ -317,8 +384,12 @@ def price_point_province(df=readin_db_to_df(), n=3):
 #     plt.savefig(f'./0{count}-{title}.jpg',dpi=300)
     count += 1
 
-def price_point_variety(df=readin_db_to_df(), n=3):
+def price_point_variety(df=None, n=3):
   """Plot price and point for wine varieties.""" 
+  import seaborn as sns
+  import matplotlib.pyplot as plt
+  # read (only) the columns needed here if no dataframe is passed
+  df = get_wine_df(['variety', 'price', 'points']) if df is None else df
   df_plimit = df[df['price']<=100]
   topVariety = df['variety'].value_counts(normalize = True).head(n).index.tolist()
   count = 1
@@ -331,18 +402,21 @@ def price_point_variety(df=readin_db_to_df(), n=3):
       count += 1
 
 # ----------------------------------------Overview Map --------------------------
-def count_Country(df=readin_db_to_df()):
+def count_Country(df=None):
   """Creates a world map of the count of number of reviews
   per country.""" 
+  # read (only) the columns needed here if no dataframe is passed
+  df = get_wine_df(['country', 'price']) if df is None else df
   #get the data that can be read in 'echarts' (echarts.apache.org)
   df_map = df[df['price'] <= 1000]
-  df_map.replace("US","United States",inplace=True)
-  df_map.replace("England","United Kingdom",inplace=True)
-  df_map.replace("Czech Republic","Czech Rep.",inplace=True)
-  df_map.replace("Bosnia and Herzegovina","Bosnia and Herz.",inplace=True)
+  country_counts = df_map['country'].value_counts()
+  # (a categorical's value counts include its categories with no rows left)
+  country_counts = country_counts[country_counts > 0]
+  dict_country_names = {"US": "United States", "England": "United Kingdom",
+    "Czech Republic": "Czech Rep.", "Bosnia and Herzegovina": "Bosnia and Herz."}
 
-  country=list(df_map['country'].value_counts().index)
-  counts=list(df_map['country'].value_counts().values)
+  country=[dict_country_names.get(c, c) for c in country_counts.index.astype(str)]
+  counts=list(country_counts.values)
 
   a="'name'"
   b="'value'"
@@ -354,9 +428,13 @@ def count_Country(df=readin_db_to_df()):
   '''
   print(link_str)
 
-def point_mean_description_length(df=readin_db_to_df()):
+def point_mean_description_length(df=None):
   """Plots the points against the average description length
   per taster.""" 
+  import seaborn as sns
+  import matplotlib.pyplot as plt
+  # read (only) the columns needed here if no dataframe is passed
+  df = get_wine_df(['points', 'price', 'description', 'taster_name']) if df is None else df
   #get the correlation plot between Points and Mean Description Length and Mean Price group by tasters
   df_points=df[df['price'] <= 1000]
   df_points['description_length']=df_points['description'].str.len()
@@ -389,4 +467,8 @@ def point_mean_description_length(df=readin_db_to_df()):
       g.set(xlim=(0,600))
       title_="Mean Price Given Points - "+taster
       plt.title(title_,fontsize='x-large')
-      #plt.savefig(f'./{title_}.jpg',dpi=300,bbox_inches='tight')
\ No newline at end of file
+      #plt.savefig(f'./{title_}.jpg',dpi=300,bbox_inches='tight')
+
+#record the calls of the public functions of this module while the
+#instrumentation is enabled (see database/instrument.py)
+instrument.instrument_module(sys.modules[__name__])